@@ -195,6 +195,9 @@ setup(
     ]
     + ["urllib3==1.25.11"],  # noqa: W503
     tests_require=["pytest==3.2.3"],
+    entry_points={
+        "console_scripts": ["scalelib-profile=hpc.autoscale.profiler:main"]
+    },
     cmdclass={
         "test": PyTest,
         "format": Formatter,
@@ -1,11 +1,19 @@
+import typing
+
 from hpc.autoscale import hpctypes
 from hpc.autoscale.ccbindings.interface import ClusterBindingInterface
 
+if typing.TYPE_CHECKING:
+    from hpc.autoscale.ccbindings.asyncbindings import AsyncClusterBindingAdapter
+
 
 def new_cluster_bindings(config: dict,) -> ClusterBindingInterface:
     if config.get("_mock_bindings"):
-        return config["_mock_bindings"]
-    from hpc.autoscale.ccbindings import legacy
+        # async mock bindings wrap a regular MockClusterBinding
+        return getattr(
+            config["_mock_bindings"], "sync_bindings", config["_mock_bindings"]
+        )
+    from hpc.autoscale.ccbindings import legacy, transport
     from cyclecloud.client import Client
 
     cluster_name = hpctypes.ClusterName(config["cluster_name"])
@@ -16,6 +24,30 @@ def new_cluster_bindings(config: dict,) -> ClusterBindingInterface:
     if read_only is None:
         read_only = False
 
+    session = cluster._client.session
+    adapter = transport.install(session, config.get("transport"))
+
+    stream_session = None
+    if config.get("stream_nodes"):
+        stream_session = legacy._get_session(config)
+
     return legacy.ClusterBinding(
-        cluster.name, cluster._client.session, cluster._client, read_only=read_only
+        cluster.name,
+        session,
+        cluster._client,
+        read_only=read_only,
+        transport=adapter,
+        create_concurrency=int(config.get("create_nodes_concurrency", 1)),
+        create_set_timeout=config.get("create_nodes_set_timeout"),
+        url=config.get("url"),
+        stream_session=stream_session,
     )
+
+
+def new_async_cluster_bindings(config: dict,) -> "AsyncClusterBindingAdapter":
+    from hpc.autoscale.ccbindings.asyncbindings import AsyncClusterBindingAdapter
+
+    mock_bindings = config.get("_mock_bindings")
+    if isinstance(mock_bindings, AsyncClusterBindingAdapter):
+        return mock_bindings
+    return AsyncClusterBindingAdapter(new_cluster_bindings(config))
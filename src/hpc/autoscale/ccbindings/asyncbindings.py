@@ -0,0 +1,197 @@
+"""
+asyncio bindings layered on top of the blocking ClusterBindingInterface. Each call
+runs in an executor, so the event loop is never blocked on the REST api and
+independent calls can be awaited concurrently, i.e. with asyncio.gather.
+"""
+import asyncio
+import functools
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, TypeVar
+
+from cyclecloud.model.ClusterStatusModule import ClusterStatus
+from cyclecloud.model.NodeCreationResultModule import NodeCreationResult
+from cyclecloud.model.NodeListModule import NodeList
+from cyclecloud.model.NodeManagementResultModule import NodeManagementResult
+
+from hpc.autoscale.ccbindings.interface import (
+    AsyncClusterBindingInterface,
+    ClusterBindingInterface,
+)
+from hpc.autoscale.ccbindings.statuscache import ClusterStatusDelta
+from hpc.autoscale.codeanalysis import hpcwrapclass
+from hpc.autoscale.hpctypes import (
+    ClusterName,
+    Hostname,
+    IpAddress,
+    NodeArrayName,
+    NodeId,
+    NodeName,
+    OperationId,
+    RequestId,
+)
+from hpc.autoscale.node.node import Node
+
+T = TypeVar("T")
+
+
+@hpcwrapclass
+class AsyncClusterBindingAdapter(AsyncClusterBindingInterface):
+    """
+    Runs every call of the wrapped bindings in executor, or the event loop's
+    default executor if None. The wrapped bindings remain available as
+    sync_bindings for the blocking NodeManager api.
+    """
+
+    def __init__(
+        self, bindings: ClusterBindingInterface, executor: Optional[Executor] = None,
+    ) -> None:
+        self.__bindings = bindings
+        self.__executor = executor
+
+    @property
+    def sync_bindings(self) -> ClusterBindingInterface:
+        return self.__bindings
+
+    @property
+    def cluster_name(self) -> ClusterName:
+        return self.__bindings.cluster_name
+
+    async def _call(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        # the running loop, get_running_loop needs python 3.7
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.__executor, functools.partial(function, *args, **kwargs)
+        )
+
+    async def create_nodes(self, nodes: List[Node]) -> NodeCreationResult:
+        return await self._call(self.__bindings.create_nodes, nodes)
+
+    async def deallocate_nodes(
+        self,
+        nodes: Optional[List[Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        return await self._call(
+            self.__bindings.deallocate_nodes,
+            nodes,
+            names,
+            node_ids,
+            hostnames,
+            ip_addresses,
+            custom_filter,
+        )
+
+    async def get_cluster_status(self, nodes: bool = False) -> ClusterStatus:
+        return await self._call(self.__bindings.get_cluster_status, nodes)
+
+    async def get_nodes(
+        self,
+        operation_id: Optional[OperationId] = None,
+        request_id: Optional[RequestId] = None,
+    ) -> NodeList:
+        return await self._call(
+            self.__bindings.get_nodes, operation_id=operation_id, request_id=request_id
+        )
+
+    async def remove_nodes(
+        self,
+        nodes: Optional[List[Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        return await self._call(
+            self.__bindings.remove_nodes,
+            nodes,
+            names,
+            node_ids,
+            hostnames,
+            ip_addresses,
+            custom_filter,
+        )
+
+    async def scale(
+        self,
+        nodearray: NodeArrayName,
+        total_core_count: Optional[int] = None,
+        total_node_count: Optional[int] = None,
+    ) -> None:
+        return await self._call(
+            self.__bindings.scale, nodearray, total_core_count, total_node_count
+        )
+
+    async def shutdown_nodes(
+        self,
+        nodes: Optional[List[Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        return await self._call(
+            self.__bindings.shutdown_nodes,
+            nodes,
+            names,
+            node_ids,
+            hostnames,
+            ip_addresses,
+            custom_filter,
+        )
+
+    async def start_nodes(
+        self,
+        nodes: Optional[List[Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        return await self._call(
+            self.__bindings.start_nodes,
+            nodes,
+            names,
+            node_ids,
+            hostnames,
+            ip_addresses,
+            custom_filter,
+        )
+
+    async def terminate_nodes(
+        self,
+        nodes: Optional[List[Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        return await self._call(
+            self.__bindings.terminate_nodes,
+            nodes,
+            names,
+            node_ids,
+            hostnames,
+            ip_addresses,
+            custom_filter,
+        )
+
+    async def delete_nodes(self, nodes: List[Node]) -> NodeManagementResult:
+        return await self._call(self.__bindings.delete_nodes, nodes)
+
+    async def get_cluster_status_changes(self) -> ClusterStatusDelta:
+        # shares the wrapped bindings' cache, so sync and async polls agree
+        return await self._call(self.__bindings.get_cluster_status_changes)
+
+    def __str__(self) -> str:
+        return "AsyncClusterBindingAdapter({})".format(self.__bindings)
+
+    def __repr__(self) -> str:
+        return str(self)
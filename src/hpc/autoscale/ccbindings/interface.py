@@ -3,13 +3,14 @@
 #
 import abc
 from abc import ABC, abstractproperty
-from typing import List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 from cyclecloud.model.ClusterStatusModule import ClusterStatus
 from cyclecloud.model.NodeCreationResultModule import NodeCreationResult
 from cyclecloud.model.NodeListModule import NodeList
 from cyclecloud.model.NodeManagementResultModule import NodeManagementResult
 
+from hpc.autoscale.ccbindings.statuscache import ClusterStatusCache, ClusterStatusDelta
 from hpc.autoscale.hpctypes import (
     ClusterName,
     Hostname,
@@ -116,3 +117,157 @@ class ClusterBindingInterface(ABC):
     @abc.abstractmethod
     def delete_nodes(self, nodes: List[node.Node]) -> NodeManagementResult:
         pass
+
+    def iter_nodes(
+        self, skip: Optional[Callable[[Dict[str, Any]], bool]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Iterates over every node record, dropping those for which skip(record)
+        returns True. Bindings that can parse the response incrementally override
+        this, so the records are never all held as one response.
+        """
+        for record in self.get_nodes().nodes:
+            if skip is None or not skip(record):
+                yield record
+
+    def get_cluster_status_changes(self) -> ClusterStatusDelta:
+        """
+        Fetches the cluster status, with nodes, and returns what changed since the
+        previous call. The first call reports every node as added.
+        """
+        return _status_cache(self).update(self.get_cluster_status(nodes=True))
+
+
+class MergedNodeCreationResult(NodeCreationResult):
+    """
+    The result of creating nodes with more than one request, i.e. one request per
+    creation set. operation_id is the first successful request's, and
+    node_operations maps each node name to the (operation_id, operation_offset)
+    of the request that created it.
+    """
+
+    def __init__(
+        self,
+        operation_ids: List[OperationId],
+        sets: List,
+        node_operations: Dict[NodeName, Tuple[OperationId, int]],
+    ) -> None:
+        NodeCreationResult.__init__(self)
+        self.operation_id = operation_ids[0]
+        self.sets = sets
+        self.operation_ids = operation_ids
+        self.node_operations = node_operations
+
+
+class AsyncClusterBindingInterface(ABC):
+    """
+    asyncio counterpart of ClusterBindingInterface, for embedding scalelib in an
+    event loop without blocking it. See asyncbindings.AsyncClusterBindingAdapter
+    for an implementation layered on top of any ClusterBindingInterface.
+    """
+
+    @abstractproperty
+    def cluster_name(self) -> ClusterName:
+        ...
+
+    @abc.abstractmethod
+    async def create_nodes(self, nodes: List[node.Node]) -> NodeCreationResult:
+        pass
+
+    @abc.abstractmethod
+    async def deallocate_nodes(
+        self,
+        nodes: Optional[List[node.Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        pass
+
+    @abc.abstractmethod
+    async def get_cluster_status(self, nodes: bool = False) -> ClusterStatus:
+        pass
+
+    @abc.abstractmethod
+    async def get_nodes(
+        self,
+        operation_id: Optional[OperationId] = None,
+        request_id: Optional[RequestId] = None,
+    ) -> NodeList:
+        pass
+
+    @abc.abstractmethod
+    async def remove_nodes(
+        self,
+        nodes: Optional[List[node.Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        pass
+
+    @abc.abstractmethod
+    async def scale(
+        self,
+        nodearray: NodeArrayName,
+        total_core_count: Optional[int] = None,
+        total_node_count: Optional[int] = None,
+    ) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def shutdown_nodes(
+        self,
+        nodes: Optional[List[node.Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        pass
+
+    @abc.abstractmethod
+    async def start_nodes(
+        self,
+        nodes: Optional[List[node.Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        pass
+
+    @abc.abstractmethod
+    async def terminate_nodes(
+        self,
+        nodes: Optional[List[node.Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        pass
+
+    @abc.abstractmethod
+    async def delete_nodes(self, nodes: List[node.Node]) -> NodeManagementResult:
+        pass
+
+    async def get_cluster_status_changes(self) -> ClusterStatusDelta:
+        """See ClusterBindingInterface.get_cluster_status_changes"""
+        cluster_status = await self.get_cluster_status(nodes=True)
+        return _status_cache(self).update(cluster_status)
+
+
+def _status_cache(bindings: object) -> ClusterStatusCache:
+    # implementations do not call our __init__, so create the cache lazily
+    cache = bindings.__dict__.get("_status_cache")
+    if cache is None:
+        cache = bindings.__dict__["_status_cache"] = ClusterStatusCache()
+    return cache
@@ -0,0 +1,124 @@
+"""
+Incremental parsing of large json responses, i.e. the node list of a cluster with
+tens of thousands of nodes. Items of one top level array are decoded and yielded
+one at a time as the chunks arrive, so neither the whole response text nor the
+whole decoded document has to be held in memory at once.
+"""
+import codecs
+import json
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+CHUNK_SIZE = 64 * 1024
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _Buffer:
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self.__chunks = iter(chunks)
+        self.__decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, min_remaining: int) -> None:
+        # drop what has already been parsed before reading more
+        if self.pos:
+            self.text = self.text[self.pos :]  # noqa: E203
+            self.pos = 0
+
+        parts = [self.text]
+        remaining = len(self.text)
+        while remaining < min_remaining and not self.eof:
+            try:
+                chunk = next(self.__chunks)
+            except StopIteration:
+                self.eof = True
+                part = self.__decoder.decode(b"", final=True)
+            else:
+                part = self.__decoder.decode(chunk)
+            parts.append(part)
+            remaining += len(part)
+        self.text = "".join(parts)
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if self.eof:
+                raise ValueError("Unexpected end of json document")
+            self.fill(1)
+
+    def expect(self, expected: str) -> None:
+        actual = self.peek()
+        if actual != expected:
+            raise ValueError(
+                "Expected '{}' at offset {} but found '{}'".format(
+                    expected, self.pos, actual
+                )
+            )
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                # grow geometrically so large values are not rescanned per chunk
+                self.fill(2 * (len(self.text) - self.pos) + CHUNK_SIZE)
+                continue
+
+            if end == len(self.text) and not self.eof:
+                # i.e. a number that may continue in the next chunk
+                self.fill(len(self.text) - self.pos + 1)
+                continue
+
+            self.pos = end
+            return value
+
+
+def iter_array(
+    chunks: Iterable[bytes], key: str, skip: Optional[Callable[[Any], bool]] = None,
+) -> Iterator[Any]:
+    """
+    Yields the items of the array stored under key in the top level json object
+    that chunks make up. Items for which skip(item) returns True are dropped as
+    soon as they are decoded. Other top level values are decoded and discarded.
+    """
+    buf = _Buffer(chunks)
+    buf.expect("{")
+    if buf.peek() == "}":
+        return
+
+    while True:
+        name = buf.value()
+        buf.expect(":")
+
+        if name != key:
+            buf.value()
+        elif buf.peek() == "[":
+            buf.expect("[")
+            if buf.peek() == "]":
+                buf.expect("]")
+            else:
+                while True:
+                    item = buf.value()
+                    if skip is None or not skip(item):
+                        yield item
+                    if buf.peek() == "]":
+                        buf.expect("]")
+                        break
+                    buf.expect(",")
+        else:
+            # i.e. null
+            buf.value()
+
+        if buf.peek() == "}":
+            return
+        buf.expect(",")
@@ -3,7 +3,11 @@
 #
 
 import json
-from typing import Any, Callable, Dict, List, Optional, Tuple
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
 
 import cyclecloud.api.clusters
 import requests
@@ -14,6 +18,7 @@ from cyclecloud.model.NodeCreationRequestSetDefinitionModule import (
 )
 from cyclecloud.model.NodeCreationRequestSetModule import NodeCreationRequestSet
 from cyclecloud.model.NodeCreationResultModule import NodeCreationResult
+from cyclecloud.model.NodeCreationResultSetModule import NodeCreationResultSet
 from cyclecloud.model.NodeListModule import NodeList
 from cyclecloud.model.NodeManagementRequestModule import NodeManagementRequest
 from cyclecloud.model.NodeManagementResultModule import NodeManagementResult
@@ -23,7 +28,12 @@ from urllib3.exceptions import InsecureRequestWarning
 
 import hpc.autoscale.hpclogging as logging
 from hpc.autoscale import hpctypes as ht
-from hpc.autoscale.ccbindings.interface import ClusterBindingInterface
+from hpc.autoscale.ccbindings import jsonstream
+from hpc.autoscale.ccbindings import transport as transportlib
+from hpc.autoscale.ccbindings.interface import (
+    ClusterBindingInterface,
+    MergedNodeCreationResult,
+)
 from hpc.autoscale.codeanalysis import hpcwrap, hpcwrapclass
 from hpc.autoscale.node.node import Node
 from hpc.autoscale.util import partition
@@ -55,7 +65,21 @@ class ClusterBinding(ClusterBindingInterface):
         client: Any,
         clusters_module: Any = None,
         read_only: bool = False,
+        transport: Optional[transportlib.RetryingHTTPAdapter] = None,
+        create_concurrency: int = 1,
+        create_set_timeout: Optional[float] = None,
+        url: Optional[str] = None,
+        stream_session: Optional[requests.Session] = None,
     ) -> None:
+        """
+        create_concurrency - when greater than 1, create_nodes sends each creation
+            set (nodearray, vm_size, placement group, overrides) as its own request,
+            and merges the results. Up to this many nodearrays are created at a
+            time, the sets of each nodearray one after another.
+        create_set_timeout - in that mode, how long to wait for each set's request.
+        url, stream_session - when both are set, iter_nodes parses the node list
+            incrementally as it is downloaded.
+        """
         self.__cluster_name = cluster_name
         self.session = session
         self.client = client
@@ -63,6 +87,16 @@ class ClusterBinding(ClusterBindingInterface):
         if clusters_module:
             self.clusters_module = clusters_module  # type: ignore
         self.read_only = read_only
+        self.transport = transport
+        self.create_concurrency = create_concurrency
+        self.create_set_timeout = create_set_timeout
+        self.url = url
+        self.stream_session = stream_session
+
+    def endpoint_stats(self) -> Dict[str, transportlib.EndpointStats]:
+        if not self.transport:
+            return {}
+        return self.transport.stats()
 
     @property
     def cluster_name(self) -> ht.ClusterName:
@@ -71,8 +105,20 @@ class ClusterBinding(ClusterBindingInterface):
     @hpcwrap
     @notreadonly
     def create_nodes(self, nodes: List[Node]) -> NodeCreationResult:
-        creation_request = NodeCreationRequest()
-        creation_request.sets = []
+        request_sets = self._creation_request_sets(nodes)
+
+        if self.create_concurrency > 1 and len(request_sets) > 1:
+            return self._create_nodes_concurrently(request_sets)
+
+        return self._create_nodes([request_set for _, request_set in request_sets])
+
+    def _creation_request_sets(
+        self, nodes: List[Node]
+    ) -> List[Tuple[List[Node], NodeCreationRequestSet]]:
+        """
+        Returns each creation set along with its nodes, ordered by the lowest
+        node index of each set.
+        """
         # the node attributes aren't hashable, so a string representation
         # is good enough to ensure they are all the same across the list.
         p_nodes_dict = partition(
@@ -85,7 +131,7 @@ class ClusterBinding(ClusterBindingInterface):
             ),
         )
 
-        request_tuples: List[Tuple[Node, NodeCreationRequestSet]] = []
+        request_tuples: List[Tuple[List[Node], NodeCreationRequestSet]] = []
 
         def _node_key(n: Node) -> Tuple[str, int]:
             try:
@@ -107,13 +153,15 @@ class ClusterBinding(ClusterBindingInterface):
             if p_nodes[0].node_attribute_overrides:
                 request_set.node_attributes = p_nodes[0].node_attribute_overrides
 
-            first_node = sorted(p_nodes, key=_node_key)[0]
+            request_tuples.append((sorted(p_nodes, key=_node_key), request_set))
 
-            request_tuples.append((first_node, request_set))
+        return sorted(request_tuples, key=lambda t: _node_key(t[0][0]))
 
-        sorted_tuples = sorted(request_tuples, key=lambda t: _node_key(t[0]))
-        for _, request_set in sorted_tuples:
-            creation_request.sets.append(request_set)
+    def _create_nodes(
+        self, request_sets: List[NodeCreationRequestSet]
+    ) -> NodeCreationResult:
+        creation_request = NodeCreationRequest()
+        creation_request.sets = list(request_sets)
 
         creation_request.validate()
 
@@ -127,6 +175,115 @@ class ClusterBinding(ClusterBindingInterface):
 
         return result
 
+    def _create_nodes_concurrently(
+        self, request_sets: List[Tuple[List[Node], NodeCreationRequestSet]]
+    ) -> MergedNodeCreationResult:
+        # CycleCloud names new nodes in the order they are created, so the sets of
+        # one nodearray are created one after another, in node index order, for the
+        # names to match ours. Only different nodearrays are created concurrently.
+        by_nodearray = partition(
+            list(enumerate(request_sets)), lambda t: t[1][1].nodearray
+        )
+        queues = [deque(group) for group in by_nodearray.values()]
+        workers = min(self.create_concurrency, len(queues))
+
+        outcomes: Dict[int, Any] = {}
+        # future -> (set index, the rest of its nodearray's sets, deadline)
+        running: Dict[Future, Tuple[int, Deque, Optional[float]]] = {}
+        # timed out requests keep their thread, so do not cap the threads at workers
+        executor = ThreadPoolExecutor(max_workers=len(request_sets))
+
+        def submit(queue: Deque) -> None:
+            index, (_, request_set) = queue.popleft()
+            future = executor.submit(self._create_nodes, [request_set])
+            deadline = None
+            if self.create_set_timeout is not None:
+                deadline = time.monotonic() + self.create_set_timeout
+            running[future] = (index, queue, deadline)
+
+        try:
+            for queue in queues[:workers]:
+                submit(queue)
+            waiting = deque(queues[workers:])
+
+            while running:
+                deadlines = [d for _, _, d in running.values() if d is not None]
+                timeout = None
+                if deadlines:
+                    timeout = max(0, min(deadlines) - time.monotonic())
+                done, _ = wait(list(running), timeout, FIRST_COMPLETED)
+                now = time.monotonic()
+
+                for future, (index, queue, deadline) in list(running.items()):
+                    if future in done:
+                        try:
+                            outcomes[index] = future.result()
+                        except Exception as e:
+                            outcomes[index] = e
+                    elif deadline is not None and now >= deadline:
+                        future.cancel()
+                        outcomes[index] = RuntimeError(
+                            "Timed out after {} seconds. The nodes may still be created.".format(
+                                self.create_set_timeout
+                            )
+                        )
+                    else:
+                        continue
+                    running.pop(future)
+
+                    if isinstance(outcomes[index], Exception):
+                        # the rest would not be named as we expect
+                        for skipped, _ in queue:
+                            outcomes[skipped] = RuntimeError(
+                                "Skipped, as creating an earlier set of this nodearray failed: {}".format(
+                                    outcomes[index]
+                                )
+                            )
+                        queue.clear()
+
+                    if queue:
+                        submit(queue)
+                    elif waiting:
+                        submit(waiting.popleft())
+        finally:
+            # do not block on timed out requests
+            executor.shutdown(wait=False)
+
+        operation_ids: List[ht.OperationId] = []
+        result_sets: List[NodeCreationResultSet] = []
+        node_operations: Dict[ht.NodeName, Tuple[ht.OperationId, int]] = {}
+        first_error: Optional[Exception] = None
+
+        for index, (set_nodes, request_set) in enumerate(request_sets):
+            result = outcomes[index]
+            if isinstance(result, Exception):
+                first_error = first_error or result
+                logging.error(
+                    "Could not create %d %s nodes (vm_size=%s placement_group=%s): %s",
+                    request_set.count,
+                    request_set.nodearray,
+                    request_set.definition.machine_type,
+                    request_set.placement_group_id,
+                    result,
+                )
+                failed_set = NodeCreationResultSet()
+                failed_set.added = 0
+                failed_set.message = str(result)
+                result_sets.append(failed_set)
+                continue
+
+            operation_ids.append(result.operation_id)
+            result_sets.extend(result.sets)
+            # offsets are relative to the request that created the node
+            for offset, node in enumerate(set_nodes):
+                node_operations[node.name] = (result.operation_id, offset)
+
+        if not operation_ids:
+            assert first_error
+            raise first_error
+
+        return MergedNodeCreationResult(operation_ids, result_sets, node_operations)
+
     @notreadonly
     def deallocate_nodes(
         self,
@@ -170,6 +327,22 @@ class ClusterBinding(ClusterBindingInterface):
         self._log_response(http_response, result)
         return result
 
+    def iter_nodes(
+        self, skip: Optional[Callable[[Dict[str, Any]], bool]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        if not (self.url and self.stream_session):
+            yield from ClusterBindingInterface.iter_nodes(self, skip)
+            return
+
+        url = "{}/clusters/{}/nodes".format(
+            self.url.rstrip("/"), quote(self.cluster_name, safe="")
+        )
+        with self.stream_session.get(url, stream=True) as response:
+            response.raise_for_status()
+            yield from jsonstream.iter_array(
+                response.iter_content(jsonstream.CHUNK_SIZE), "nodes", skip
+            )
+
     @notreadonly
     def remove_nodes(
         self,
@@ -374,32 +547,23 @@ class ClusterBinding(ClusterBindingInterface):
 
 
 def _get_session(config: Dict) -> requests.sessions.Session:
-    try:
-        retries = 3
-        while retries > 0:
-            try:
-                if not config["verify_certificates"]:
-                    urllib3.disable_warnings(InsecureRequestWarning)
-
-                s = requests.session()
-                s.auth = (config["username"], config["password"])
-                # TODO apparently this does nothing...
-                # s.timeout = config["cycleserver"]["timeout"]
-                s.verify = config[
-                    "verify_certificates"
-                ]  # Should we auto-accept unrecognized certs?
-                s.headers = CaseInsensitiveDict(
-                    {"X-Cycle-Client-Version": "%s-cli:%s" % ("hpc-autoscale", "0.0.0")}
-                )
-
-                return s
-            except requests.exceptions.SSLError:
-                retries = retries - 1
-                if retries < 1:
-                    raise
-    except ImportError:
-        raise
-
-    raise AssertionError(
-        "Could not connect to CycleCloud. Please see the log for more details."
+    if not config["verify_certificates"]:
+        urllib3.disable_warnings(InsecureRequestWarning)
+
+    s = requests.session()
+    s.auth = (config["username"], config["password"])
+    # timeouts are applied per request by the transport adapter
+    transportlib.mount(
+        s,
+        transportlib.RetryingHTTPAdapter(
+            transportlib.TransportConfig.from_dict(config.get("transport"))
+        ),
+    )
+    s.verify = config[
+        "verify_certificates"
+    ]  # Should we auto-accept unrecognized certs?
+    s.headers = CaseInsensitiveDict(
+        {"X-Cycle-Client-Version": "%s-cli:%s" % ("hpc-autoscale", "0.0.0")}
     )
+
+    return s
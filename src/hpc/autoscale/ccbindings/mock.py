@@ -2,9 +2,11 @@
 # Licensed under the MIT License.
 #
 
+import asyncio
+import time
 import uuid
 from copy import deepcopy
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
 from uuid import uuid4
 
 import cyclecloud  # noqa
@@ -26,6 +28,7 @@ from cyclecloud.model.PlacementGroupStatusModule import PlacementGroupStatus
 from immutabledict import ImmutableOrderedDict
 
 import hpc.autoscale.hpclogging as logging
+from hpc.autoscale.ccbindings.asyncbindings import AsyncClusterBindingAdapter
 from hpc.autoscale.ccbindings.interface import ClusterBindingInterface
 from hpc.autoscale.codeanalysis import hpcwrapclass
 from hpc.autoscale.hpctypes import (
@@ -49,12 +52,30 @@ from hpc.autoscale.util import partition
 
 logger = logging.getLogger("cyclecloud.clustersapi")
 NodeRecord = Dict[str, Any]
+T = TypeVar("T")
 
 
 @hpcwrapclass
 class MockClusterBinding(ClusterBindingInterface):
-    def __init__(self, cluster_name: str = "clusty") -> None:
+    """
+    In memory ClusterBindingInterface. Every api call first sleeps for latency
+    seconds, or latencies[method name] if set, to simulate the round trip to
+    CycleCloud.
+
+    Node records returned by get_nodes / get_cluster_status are built once per
+    change to the node. Each call gets its own copy of a record, but the
+    Configuration within is shared between calls, so treat it as read only.
+    """
+
+    def __init__(
+        self,
+        cluster_name: str = "clusty",
+        latency: float = 0.0,
+        latencies: Optional[Dict[str, float]] = None,
+    ) -> None:
         self.__cluster_name = ClusterName(cluster_name)
+        self.latency = latency
+        self.latencies: Dict[str, float] = dict(latencies or {})
         self.nodes: Dict[NodeName, Node] = {}
         self.nodearrays: Dict[NodeArrayName, ClusterNodearrayStatus] = {}
         self.operations: Dict[OperationId, "MockNodeManagementResult"] = {}
@@ -63,11 +84,20 @@ class MockClusterBinding(ClusterBindingInterface):
         self.subnet_id = "subnetid1"
         self.state = "Started"
         self.target_state = "Started"
+        self.__records: Dict[NodeName, Tuple[Tuple, NodeRecord]] = {}
+        self.__buckets_by_family: Optional[
+            Dict[Tuple[str, str], List[NodearrayBucketStatus]]
+        ] = None
 
     @property
     def cluster_name(self) -> ClusterName:
         return self.__cluster_name
 
+    def _round_trip(self, method: str) -> None:
+        latency = self.latencies.get(method, self.latency)
+        if latency > 0:
+            time.sleep(latency)
+
     def add_nodearray(
         self,
         name: NodeArrayName,
@@ -99,13 +129,13 @@ class MockClusterBinding(ClusterBindingInterface):
         autoscale["resources"] = config_resources = autoscale.get("autoscale", {})
         config_resources.update(resources)
 
-        for attr in dir(nodearray_status):
-            if attr[0].isalpha() and "count" in attr:
-                assert (
-                    getattr(nodearray_status, attr) is not None
-                ), "{} was not defined".format(attr)
+        for attr in _count_attrs(nodearray_status):
+            assert (
+                getattr(nodearray_status, attr) is not None
+            ), "{} was not defined".format(attr)
 
         self.nodearrays[name] = nodearray_status
+        self.__buckets_by_family = None
         return nodearray_status
 
     def add_bucket(
@@ -210,31 +240,31 @@ class MockClusterBinding(ClusterBindingInterface):
                 PlacementGroupStatus(name=pg, active_core_count=0, active_count=0)
             )
 
-        for attr in dir(bucket_status):
-            if attr[0].isalpha() and "count" in attr:
-                assert (
-                    getattr(bucket_status, attr) is not None
-                ), "{} was not defined".format(attr)
+        for attr in _count_attrs(bucket_status):
+            assert (
+                getattr(bucket_status, attr) is not None
+            ), "{} was not defined".format(attr)
 
         nodearray_status.buckets.append(bucket_status)
+        self.__buckets_by_family = None
 
         return bucket_status
 
     def _get_buckets(
         self, location: str, vm_family: str
     ) -> List[NodearrayBucketStatus]:
-        ret = []
-        for _, cluster_nodearray_status in self.nodearrays.items():
-
-            if not cluster_nodearray_status.nodearray.get("Region").lower() == location:
-                continue
-
-            for bucket in cluster_nodearray_status.buckets:
-                vm_size = bucket.definition.machine_type
-                aux_info = vm_sizes.get_aux_vm_size_info(location, vm_size)
-                if aux_info.vm_family == vm_family:
-                    ret.append(bucket)
-        return ret
+        if self.__buckets_by_family is None:
+            # rebuilt only after add_nodearray / add_bucket, not once per node
+            by_family: Dict[Tuple[str, str], List[NodearrayBucketStatus]] = {}
+            for cluster_nodearray_status in self.nodearrays.values():
+                region = cluster_nodearray_status.nodearray.get("Region").lower()
+                for bucket in cluster_nodearray_status.buckets:
+                    vm_size = bucket.definition.machine_type
+                    aux_info = vm_sizes.get_aux_vm_size_info(region, vm_size)
+                    key = (region, aux_info.vm_family)
+                    by_family.setdefault(key, []).append(bucket)
+            self.__buckets_by_family = by_family
+        return self.__buckets_by_family.get((location, vm_family), [])
 
     def add_node(
         self,
@@ -246,7 +276,14 @@ class MockClusterBinding(ClusterBindingInterface):
         spot: bool = False,
         placement_group: str = None,
         keep_alive: bool = False,
+        record_operation: bool = True,
+        node_id: Optional[NodeId] = None,
     ) -> Node:
+        """
+        Adds an existing node without going through create_nodes. Pass
+        record_operation=False to skip recording an operation for the node, i.e.
+        when populating a large synthetic cluster.
+        """
         assert nodearray in self.nodearrays
         nodearray_status = self.nodearrays[nodearray]
         nodearray_record = nodearray_status.nodearray
@@ -286,7 +323,7 @@ class MockClusterBinding(ClusterBindingInterface):
                     pg_status.active_core_count += bucket.virtual_machine.vcpu_count
 
         self.nodes[name] = Node(
-            node_id=DelayedNodeId(name, node_id=NodeId(str(uuid4()))),
+            node_id=DelayedNodeId(name, node_id=node_id or NodeId(str(uuid4()))),
             name=name,
             nodearray=nodearray,
             bucket_id=bucket.bucket_id,
@@ -309,12 +346,14 @@ class MockClusterBinding(ClusterBindingInterface):
             ),
             keep_alive=keep_alive,
         )
-        op_id = OperationId(str(uuid4()))
-        self.operations[op_id] = MockNodeManagementResult(op_id, [self.nodes[name]])
+        if record_operation:
+            op_id = OperationId(str(uuid4()))
+            self.operations[op_id] = MockNodeManagementResult(op_id, [self.nodes[name]])
 
         return self.nodes[name]
 
     def create_nodes(self, new_nodes: List[Node]) -> NodeCreationResult:
+        self._round_trip("create_nodes")
         for node in new_nodes:
             assert node.name not in self.nodes, "{} already in {}".format(
                 node.name, list(self.nodes)
@@ -379,6 +418,7 @@ class MockClusterBinding(ClusterBindingInterface):
         ip_addresses: Optional[List[IpAddress]] = None,
         custom_filter: str = None,
     ) -> NodeManagementResult:
+        self._round_trip("shutdown_nodes")
         if not names:
             assert nodes
             names = [n.name for n in nodes]
@@ -407,6 +447,7 @@ class MockClusterBinding(ClusterBindingInterface):
         raise NotImplementedError()
 
     def get_cluster_status(self, nodes: bool = False) -> ClusterStatus:
+        self._round_trip("get_cluster_status")
         response = ClusterStatus()
         response.max_core_count = self.max_core_count
         response.max_count = self.max_count
@@ -416,7 +457,7 @@ class MockClusterBinding(ClusterBindingInterface):
         response.nodearrays = list(self.nodearrays.values())
         # TODO RDH nodes by bucket
         if nodes:
-            response.nodes = self.get_nodes().nodes
+            response.nodes = self._node_records(self.nodes.values())
 
         return response
 
@@ -425,11 +466,11 @@ class MockClusterBinding(ClusterBindingInterface):
         operation_id: Optional[OperationId] = None,
         request_id: Optional[RequestId] = None,
     ) -> NodeList:
+        self._round_trip("get_nodes")
 
         # TODO what is the actual error?
         if not operation_id:
-            all_nodes = _nodes_to_ccnode(list(self.nodes.values()))
-            return NodeList(nodes=all_nodes)
+            return NodeList(nodes=self._node_records(self.nodes.values()))
 
         if operation_id not in self.operations:
             raise RuntimeError(
@@ -441,13 +482,27 @@ class MockClusterBinding(ClusterBindingInterface):
         assert operation_id in self.operations
 
         mgmt_result = self.operations[operation_id]
-        cc_nodes = [
-            _node_to_ccnode(self.nodes[n.name])
-            for n in mgmt_result.nodes
-            if n.name in self.nodes
-        ]
+        cc_nodes = self._node_records(
+            [self.nodes[n.name] for n in mgmt_result.nodes if n.name in self.nodes]
+        )
         return NodeList(nodes=cc_nodes, operation_id=operation_id)
 
+    def _node_records(self, nodes: Iterable[Node]) -> List[NodeRecord]:
+        records = self.__records
+        ret = []
+        for node in nodes:
+            key = _record_key(node)
+            cached = records.get(node.name)
+            if cached is None or cached[0] != key:
+                cached = (key, _node_to_ccnode(node))
+                records[node.name] = cached
+            ret.append(dict(cached[1]))
+
+        if len(records) > len(self.nodes):
+            for name in [n for n in records if n not in self.nodes]:
+                records.pop(name)
+        return ret
+
     def remove_nodes(
         self,
         nodes: Optional[List[Node]] = None,
@@ -551,13 +606,35 @@ def _nodes_to_ccnode(nodes: List[Node]) -> List[NodeRecord]:
     return [_node_to_ccnode(n) for n in nodes]
 
 
+def _record_key(n: Node) -> Tuple:
+    # what _node_to_ccnode reads that may change after the node is added. The
+    # software configuration is fixed once the node exists.
+    return (
+        n.state,
+        n.hostname,
+        n.private_ip,
+        n.delayed_node_id.node_id,
+        n.placement_group,
+    )
+
+
+_COUNT_ATTRS: Dict[type, List[str]] = {}
+
+
+def _count_attrs(status: Any) -> List[str]:
+    # dir() is far too slow to call once per node added
+    status_type = type(status)
+    if status_type not in _COUNT_ATTRS:
+        _COUNT_ATTRS[status_type] = [
+            attr for attr in dir(status) if attr[0].isalpha() and "count" in attr
+        ]
+    return _COUNT_ATTRS[status_type]
+
+
 def _update_bucket_counts(bucket: NodearrayBucketStatus, num_nodes: int) -> None:
     vcpu_count = bucket.virtual_machine.vcpu_count
 
-    for attr in dir(bucket):
-        if not attr[0].isalpha() or "count" not in attr:
-            continue
-
+    for attr in _count_attrs(bucket):
         mag = vcpu_count if "core" in attr else num_nodes
         current_value = getattr(bucket, attr)
         if "consumed" in attr or "active" in attr:
@@ -569,3 +646,36 @@ def _update_bucket_counts(bucket: NodearrayBucketStatus, num_nodes: int) -> None
         else:
             assert False, attr
     pass
+
+
+class AsyncMockClusterBinding(AsyncClusterBindingAdapter):
+    """
+    Async MockClusterBinding for offline tests. Calls run inline on the event loop,
+    so they are deterministic, after awaiting latency seconds to simulate a round
+    trip. max_in_flight records the most calls that were awaited concurrently.
+    Anything else, i.e. add_nodearray or add_node, is forwarded to the
+    MockClusterBinding.
+    """
+
+    def __init__(self, cluster_name: str = "clusty", latency: float = 0.0,) -> None:
+        AsyncClusterBindingAdapter.__init__(self, MockClusterBinding(cluster_name))
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _call(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            return function(*args, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+    def __getattr__(self, attr: str) -> Any:
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self.sync_bindings, attr)
+
+    def __str__(self) -> str:
+        return "AsyncMockBindings()"
@@ -0,0 +1,208 @@
+"""
+Saves a cluster status, with nodes, to a json file and replays it later as read only
+bindings, i.e. to profile or debug an autoscale cycle offline against the exact
+cluster it ran against.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from cyclecloud.model.ClusterNodearrayStatusModule import ClusterNodearrayStatus
+from cyclecloud.model.ClusterStatusModule import ClusterStatus
+from cyclecloud.model.NodearrayBucketStatusDefinitionModule import (
+    NodearrayBucketStatusDefinition,
+)
+from cyclecloud.model.NodearrayBucketStatusModule import NodearrayBucketStatus
+from cyclecloud.model.NodearrayBucketStatusVirtualMachineModule import (
+    NodearrayBucketStatusVirtualMachine,
+)
+from cyclecloud.model.NodeCreationResultModule import NodeCreationResult
+from cyclecloud.model.NodeListModule import NodeList
+from cyclecloud.model.NodeManagementResultModule import NodeManagementResult
+from cyclecloud.model.PlacementGroupStatusModule import PlacementGroupStatus
+
+from hpc.autoscale.ccbindings.interface import ClusterBindingInterface
+from hpc.autoscale.ccbindings.legacy import ReadOnlyModeException
+from hpc.autoscale.codeanalysis import hpcwrapclass
+from hpc.autoscale.hpctypes import (
+    ClusterName,
+    Hostname,
+    IpAddress,
+    NodeArrayName,
+    NodeId,
+    NodeName,
+    OperationId,
+    RequestId,
+)
+from hpc.autoscale.node.node import Node
+
+RECORDING_VERSION = 1
+
+
+def record_cluster_status(bindings: ClusterBindingInterface, path: str) -> None:
+    cluster_status = bindings.get_cluster_status(nodes=True)
+    with open(path, "w") as fw:
+        json.dump(
+            {
+                "version": RECORDING_VERSION,
+                "cluster_name": bindings.cluster_name,
+                "cluster_status": cluster_status.to_dict(),
+            },
+            fw,
+            default=str,
+        )
+
+
+@hpcwrapclass
+class RecordedClusterBinding(ClusterBindingInterface):
+    """
+    Read only bindings over a cluster status saved by record_cluster_status. Any
+    call that would change the cluster raises a ReadOnlyModeException.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path) as fr:
+            recording = json.load(fr)
+
+        if recording.get("version") != RECORDING_VERSION:
+            raise RuntimeError(
+                "{} has recording version {}, expected {}".format(
+                    path, recording.get("version"), RECORDING_VERSION
+                )
+            )
+        self.path = path
+        self.__cluster_name = ClusterName(recording["cluster_name"])
+        self.__status_dict: Dict = recording["cluster_status"]
+
+    @property
+    def cluster_name(self) -> ClusterName:
+        return self.__cluster_name
+
+    def get_cluster_status(self, nodes: bool = False) -> ClusterStatus:
+        # built fresh every call, so callers can not modify the recording
+        return _cluster_status(self.__status_dict, nodes)
+
+    def get_nodes(
+        self,
+        operation_id: Optional[OperationId] = None,
+        request_id: Optional[RequestId] = None,
+    ) -> NodeList:
+        if operation_id or request_id:
+            raise RuntimeError(
+                "Operations are not recorded: operation_id={} request_id={}".format(
+                    operation_id, request_id
+                )
+            )
+        nodes = json.loads(json.dumps(self.__status_dict.get("nodes") or []))
+        return NodeList(nodes=nodes)
+
+    def create_nodes(self, nodes: List[Node]) -> NodeCreationResult:
+        raise ReadOnlyModeException("Can not call create_nodes on a recorded cluster.")
+
+    def deallocate_nodes(
+        self,
+        nodes: Optional[List[Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        raise ReadOnlyModeException(
+            "Can not call deallocate_nodes on a recorded cluster."
+        )
+
+    def remove_nodes(
+        self,
+        nodes: Optional[List[Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        raise ReadOnlyModeException("Can not call remove_nodes on a recorded cluster.")
+
+    def scale(
+        self,
+        nodearray: NodeArrayName,
+        total_core_count: Optional[int] = None,
+        total_node_count: Optional[int] = None,
+    ) -> None:
+        raise ReadOnlyModeException("Can not call scale on a recorded cluster.")
+
+    def shutdown_nodes(
+        self,
+        nodes: Optional[List[Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        raise ReadOnlyModeException(
+            "Can not call shutdown_nodes on a recorded cluster."
+        )
+
+    def start_nodes(
+        self,
+        nodes: Optional[List[Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        raise ReadOnlyModeException("Can not call start_nodes on a recorded cluster.")
+
+    def terminate_nodes(
+        self,
+        nodes: Optional[List[Node]] = None,
+        names: Optional[List[NodeName]] = None,
+        node_ids: Optional[List[NodeId]] = None,
+        hostnames: Optional[List[Hostname]] = None,
+        ip_addresses: Optional[List[IpAddress]] = None,
+        custom_filter: str = None,
+    ) -> NodeManagementResult:
+        raise ReadOnlyModeException(
+            "Can not call terminate_nodes on a recorded cluster."
+        )
+
+    def delete_nodes(self, nodes: List[Node]) -> NodeManagementResult:
+        raise ReadOnlyModeException("Can not call delete_nodes on a recorded cluster.")
+
+    def __str__(self) -> str:
+        return "RecordedClusterBinding({})".format(self.path)
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+def _cluster_status(status_dict: Dict, nodes: bool) -> ClusterStatus:
+    status_dict = json.loads(json.dumps(status_dict))
+    nodearrays = [_nodearray_status(na) for na in status_dict.pop("nodearrays", [])]
+    node_records = status_dict.pop("nodes", None)
+    ret = ClusterStatus(**status_dict)
+    ret.nodearrays = nodearrays
+    ret.nodes = (node_records or []) if nodes else None
+    return ret
+
+
+def _nodearray_status(nodearray_dict: Dict) -> ClusterNodearrayStatus:
+    buckets = [_bucket_status(b) for b in nodearray_dict.pop("buckets", [])]
+    ret = ClusterNodearrayStatus(**nodearray_dict)
+    ret.buckets = buckets
+    return ret
+
+
+def _bucket_status(bucket_dict: Dict) -> NodearrayBucketStatus:
+    definition = bucket_dict.pop("definition", None)
+    virtual_machine = bucket_dict.pop("virtual_machine", None)
+    placement_groups: List[Any] = bucket_dict.pop("placement_groups", None) or []
+
+    ret = NodearrayBucketStatus(**bucket_dict)
+    if definition is not None:
+        ret.definition = NodearrayBucketStatusDefinition(**definition)
+    if virtual_machine is not None:
+        ret.virtual_machine = NodearrayBucketStatusVirtualMachine(**virtual_machine)
+    ret.placement_groups = [PlacementGroupStatus(**pg) for pg in placement_groups]
+    return ret
@@ -0,0 +1,172 @@
+"""
+Change detection between consecutive cluster status polls. Each node record,
+bucket status and nodearray / cluster limit is reduced to a hash, so a poll only
+has to compare hashes to find the handful of nodes and buckets that changed,
+rather than rebuilding every node and bucket from scratch.
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from cyclecloud.model.ClusterStatusModule import ClusterStatus
+from cyclecloud.model.NodearrayBucketStatusModule import NodearrayBucketStatus
+
+from hpc.autoscale.hpctypes import BucketId, NodeArrayName, NodeName
+
+NodeRecord = Dict[str, Any]
+
+
+def _digest(value: Any) -> int:
+    # records are plain json, so this is stable across polls
+    return hash(json.dumps(value, sort_keys=True, default=str))
+
+
+def _model_dict(model: Any) -> Any:
+    return model.to_dict() if hasattr(model, "to_dict") else model
+
+
+class ClusterStatusDelta:
+    """
+    What changed between two polls of the cluster status.
+
+    structure_changed means a nodearray or bucket was added or removed, or a
+    nodearray's definition changed, and is always True for the first poll.
+    """
+
+    def __init__(
+        self,
+        cluster_status: ClusterStatus,
+        added_nodes: List[NodeRecord],
+        changed_nodes: List[NodeRecord],
+        removed_nodes: List[NodeName],
+        changed_buckets: List[NodearrayBucketStatus],
+        changed_nodearrays: List[NodeArrayName],
+        cluster_limits_changed: bool,
+        structure_changed: bool,
+    ) -> None:
+        self.cluster_status = cluster_status
+        self.added_nodes = added_nodes
+        self.changed_nodes = changed_nodes
+        self.removed_nodes = removed_nodes
+        self.changed_buckets = changed_buckets
+        self.changed_nodearrays = changed_nodearrays
+        self.cluster_limits_changed = cluster_limits_changed
+        self.structure_changed = structure_changed
+
+    @property
+    def limits_changed(self) -> bool:
+        return bool(
+            self.added_nodes
+            or self.removed_nodes
+            or self.changed_buckets
+            or self.changed_nodearrays
+            or self.cluster_limits_changed
+        )
+
+    @property
+    def empty(self) -> bool:
+        return not (self.changed_nodes or self.limits_changed or self.structure_changed)
+
+    def __repr__(self) -> str:
+        return (
+            "ClusterStatusDelta(added={}, changed={}, removed={}, buckets={}, "
+            + "nodearrays={}, cluster_limits={}, structure={})"
+        ).format(
+            [n["Name"] for n in self.added_nodes],
+            [n["Name"] for n in self.changed_nodes],
+            self.removed_nodes,
+            [b.bucket_id for b in self.changed_buckets],
+            self.changed_nodearrays,
+            self.cluster_limits_changed,
+            self.structure_changed,
+        )
+
+
+class ClusterStatusCache:
+    """
+    Remembers the hashes of the last cluster status passed to update.
+    """
+
+    def __init__(self) -> None:
+        self.__node_hashes: Dict[NodeName, int] = {}
+        self.__bucket_hashes: Dict[BucketId, int] = {}
+        self.__nodearray_limits: Dict[NodeArrayName, Tuple] = {}
+        self.__cluster_limits: Optional[Tuple] = None
+        self.__structure: Optional[int] = None
+
+    def reset(self) -> None:
+        """The next update will report everything as added."""
+        self.__node_hashes = {}
+        self.__bucket_hashes = {}
+        self.__nodearray_limits = {}
+        self.__cluster_limits = None
+        self.__structure = None
+
+    def update(self, cluster_status: ClusterStatus) -> ClusterStatusDelta:
+        added_nodes: List[NodeRecord] = []
+        changed_nodes: List[NodeRecord] = []
+        node_hashes: Dict[NodeName, int] = {}
+
+        for record in cluster_status.nodes or []:
+            name = record["Name"]
+            digest = _digest(record)
+            node_hashes[name] = digest
+            previous = self.__node_hashes.get(name)
+            if previous is None:
+                added_nodes.append(record)
+            elif previous != digest:
+                changed_nodes.append(record)
+
+        removed_nodes = [
+            NodeName(name) for name in self.__node_hashes if name not in node_hashes
+        ]
+
+        changed_buckets: List[NodearrayBucketStatus] = []
+        changed_nodearrays: List[NodeArrayName] = []
+        bucket_hashes: Dict[BucketId, int] = {}
+        nodearray_limits: Dict[NodeArrayName, Tuple] = {}
+        structure = []
+
+        for nodearray_status in cluster_status.nodearrays or []:
+            name = nodearray_status.name
+            limits = (nodearray_status.max_count, nodearray_status.max_core_count)
+            nodearray_limits[name] = limits
+            if self.__nodearray_limits.get(name, limits) != limits:
+                changed_nodearrays.append(name)
+
+            bucket_ids = []
+            for bucket in nodearray_status.buckets:
+                digest = _digest(_model_dict(bucket))
+                bucket_hashes[bucket.bucket_id] = digest
+                bucket_ids.append(bucket.bucket_id)
+                previous = self.__bucket_hashes.get(bucket.bucket_id)
+                if previous is not None and previous != digest:
+                    changed_buckets.append(bucket)
+
+            structure.append(
+                (name, _digest(nodearray_status.nodearray), sorted(bucket_ids))
+            )
+
+        cluster_limits = (cluster_status.max_count, cluster_status.max_core_count)
+        cluster_limits_changed = (
+            self.__cluster_limits is not None
+            and self.__cluster_limits != cluster_limits
+        )
+        structure_digest = _digest(sorted(structure))
+        structure_changed = self.__structure != structure_digest
+
+        self.__node_hashes = node_hashes
+        self.__bucket_hashes = bucket_hashes
+        self.__nodearray_limits = nodearray_limits
+        self.__cluster_limits = cluster_limits
+        self.__structure = structure_digest
+
+        return ClusterStatusDelta(
+            cluster_status,
+            added_nodes,
+            changed_nodes,
+            removed_nodes,
+            changed_buckets,
+            changed_nodearrays,
+            cluster_limits_changed,
+            structure_changed,
+        )
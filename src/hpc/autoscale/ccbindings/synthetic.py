@@ -0,0 +1,255 @@
+"""
+Seeded generator of large, realistic MockClusterBinding clusters - hundreds of
+nodearrays and buckets, placement groups, spot nodearrays, nodes in every state and
+regional / family quotas with little headroom left. The same arguments always
+produce the same cluster, including bucket and node ids, so NodeManager and
+DemandCalculator performance can be measured and compared without CycleCloud.
+"""
+import math
+import random
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from cyclecloud.model.NodearrayBucketStatusModule import NodearrayBucketStatus
+
+from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.hpctypes import (
+    Hostname,
+    NodeArrayName,
+    NodeId,
+    NodeName,
+    NodeStatus,
+    VMSize,
+)
+from hpc.autoscale.node import vm_sizes
+
+DEFAULT_LOCATIONS = ["westus2", "eastus"]
+
+DEFAULT_STATE_WEIGHTS: Dict[str, float] = {
+    "Ready": 0.70,
+    "Allocating": 0.04,
+    "Acquiring": 0.04,
+    "Preparing": 0.03,
+    "Started": 0.04,
+    "Deallocated": 0.05,
+    "Off": 0.03,
+    "Failed": 0.03,
+    "Terminating": 0.04,
+}
+
+# states in which a node has a hostname
+_HOSTNAME_STATES = ["Ready", "Started", "Preparing", "Failed"]
+
+
+def generate_cluster(
+    seed: int = 0,
+    nodearrays: int = 100,
+    nodes: int = 10_000,
+    max_buckets_per_nodearray: int = 4,
+    locations: Optional[List[str]] = None,
+    vm_size_names: Optional[List[VMSize]] = None,
+    placement_group_fraction: float = 0.2,
+    max_placement_group_size: int = 100,
+    spot_fraction: float = 0.1,
+    state_weights: Optional[Dict[str, float]] = None,
+    quota_headroom: float = 0.05,
+    cluster_name: str = "synthetic",
+    latency: float = 0.0,
+) -> MockClusterBinding:
+    """
+    nodes are spread unevenly over the buckets of nodearrays nodearrays, each with
+    between 1 and max_buckets_per_nodearray vm sizes. placement_group_fraction of
+    the nodearrays put their nodes in placement groups of at most
+    max_placement_group_size and spot_fraction of them are spot. Nodearray, cluster,
+    family and regional limits leave only quota_headroom of what is consumed, at
+    least one vm, available.
+
+    vm_size_names defaults to every known vm size in each location.
+    """
+    rng = random.Random(seed)
+    locations = locations or list(DEFAULT_LOCATIONS)
+    state_weights = state_weights or DEFAULT_STATE_WEIGHTS
+    states = sorted(state_weights)
+    weights = [state_weights[s] for s in states]
+
+    sizes_by_location = {
+        location: _vm_sizes(location, vm_size_names) for location in locations
+    }
+
+    bindings = MockClusterBinding(cluster_name, latency=latency)
+
+    # decide the layout first, so every limit can be sized to fit the nodes
+    layout: List[Tuple[NodeArrayName, str, bool, bool, List[VMSize]]] = []
+    for n in range(nodearrays):
+        location = rng.choice(locations)
+        has_pgs = rng.random() < placement_group_fraction
+        spot = not has_pgs and rng.random() < spot_fraction
+        kind = "hpc" if has_pgs else ("spot" if spot else "htc")
+        sizes = sizes_by_location[location]
+        bucket_count = rng.randint(1, min(max_buckets_per_nodearray, len(sizes)))
+        layout.append(
+            (
+                NodeArrayName("{}{:04d}".format(kind, n)),
+                location,
+                has_pgs,
+                spot,
+                rng.sample(sizes, bucket_count),
+            )
+        )
+
+    bucket_keys = [
+        (nodearray, vm_size)
+        for nodearray, _, _, _, sizes in layout
+        for vm_size in sizes
+    ]
+    # skewed, i.e. a few busy buckets and a long tail of nearly idle ones
+    bucket_weights = [rng.random() ** 3 for _ in bucket_keys]
+    node_counts: Dict[Tuple[NodeArrayName, VMSize], int] = {
+        key: 0 for key in bucket_keys
+    }
+    for key in rng.choices(bucket_keys, bucket_weights, k=nodes):
+        node_counts[key] += 1
+
+    node_index = 0
+    for nodearray, location, has_pgs, spot, sizes in layout:
+        na_count = sum(node_counts[(nodearray, s)] for s in sizes)
+        na_max_count = na_count + _headroom(na_count, quota_headroom)
+        largest_vcpu = max(_vcpu_count(location, s) for s in sizes)
+        bindings.add_nodearray(
+            nodearray,
+            {"slot_type": nodearray},
+            location=location,
+            max_count=na_max_count,
+            max_core_count=na_max_count * largest_vcpu,
+            spot=spot,
+            max_placement_group_size=max_placement_group_size,
+        )
+
+        for vm_size in sizes:
+            count = node_counts[(nodearray, vm_size)]
+            pgs: List[str] = []
+            if has_pgs:
+                # plus a few empty placement groups
+                pg_count = math.ceil(count / max_placement_group_size)
+                pg_count += rng.randint(0, 2)
+                pgs = [
+                    "{}_{}_pg{}".format(nodearray, vm_size, i) for i in range(pg_count)
+                ]
+
+            max_count = count + _headroom(count, quota_headroom)
+            bucket = bindings.add_bucket(
+                nodearray,
+                vm_size,
+                max_count=max_count,
+                available_count=max_count,
+                family_consumed_core_count=0,
+                regional_consumed_core_count=0,
+                placement_groups=pgs,
+            )
+            bucket.bucket_id = str(uuid.UUID(int=rng.getrandbits(128)))
+
+            node_states = rng.choices(states, weights, k=count)
+            for i in range(count):
+                node_index += 1
+                state = NodeStatus(node_states[i])
+                hostname = None
+                if state in _HOSTNAME_STATES:
+                    hostname = Hostname("ip-{:08X}".format(node_index))
+                bindings.add_node(
+                    NodeName("{}-{}".format(nodearray, node_index)),
+                    nodearray,
+                    vm_size,
+                    state=state,
+                    hostname=hostname,
+                    spot=spot,
+                    placement_group=pgs[i // max_placement_group_size] if pgs else None,
+                    record_operation=False,
+                    node_id=NodeId(str(uuid.UUID(int=rng.getrandbits(128)))),
+                )
+
+    _apply_quotas(bindings, quota_headroom)
+
+    total_count = len(bindings.nodes)
+    total_cores = sum(n.vcpu_count for n in bindings.nodes.values())
+    bindings.max_count = total_count + _headroom(total_count, quota_headroom)
+    bindings.max_core_count = total_cores + _headroom(total_cores, quota_headroom)
+    return bindings
+
+
+def _vm_sizes(location: str, vm_size_names: Optional[List[VMSize]]) -> List[VMSize]:
+    names = vm_size_names or sorted(vm_sizes.VM_SIZES.get(location, {}))
+    ret = []
+    for name in names:
+        aux_info = vm_sizes.get_aux_vm_size_info(location, name)
+        if aux_info.vm_family != "unknown" and aux_info.vcpu_count > 0:
+            ret.append(VMSize(name))
+
+    if not ret:
+        raise RuntimeError("No known vm sizes in location {}".format(location))
+    return ret
+
+
+def _vcpu_count(location: str, vm_size: VMSize) -> int:
+    return vm_sizes.get_aux_vm_size_info(location, vm_size).vcpu_count
+
+
+def _headroom(consumed: int, fraction: float) -> int:
+    return max(1, int(consumed * fraction))
+
+
+def _apply_quotas(bindings: MockClusterBinding, quota_headroom: float) -> None:
+    """
+    add_node only counts a node against its own bucket, while CycleCloud reports
+    family and regional consumption summed over every bucket that shares them.
+    """
+    family_buckets: Dict[Tuple[str, str], List[NodearrayBucketStatus]] = {}
+    regional_buckets: Dict[str, List[NodearrayBucketStatus]] = {}
+
+    for nodearray_status in bindings.nodearrays.values():
+        location = nodearray_status.nodearray["Region"]
+        for bucket in nodearray_status.buckets:
+            aux_info = vm_sizes.get_aux_vm_size_info(
+                location, bucket.definition.machine_type
+            )
+            family_buckets.setdefault((location, aux_info.vm_family), []).append(bucket)
+            regional_buckets.setdefault(location, []).append(bucket)
+
+    def consumed(buckets: List[NodearrayBucketStatus]) -> int:
+        return sum(len(b.active_nodes) * b.virtual_machine.vcpu_count for b in buckets)
+
+    regional_limits = {}
+    for location, buckets in regional_buckets.items():
+        regional_consumed = consumed(buckets)
+        regional_limits[location] = (
+            regional_consumed,
+            regional_consumed + _headroom(regional_consumed, quota_headroom),
+        )
+
+    for (location, _), buckets in family_buckets.items():
+        family_consumed = consumed(buckets)
+        family_quota = family_consumed + _headroom(family_consumed, quota_headroom)
+        regional_consumed, regional_quota = regional_limits[location]
+
+        for bucket in buckets:
+            vcpu_count = bucket.virtual_machine.vcpu_count
+            # at least one vm of this size always fits
+            bucket_family_quota = max(family_quota, family_consumed + vcpu_count)
+            bucket_regional_quota = max(regional_quota, regional_consumed + vcpu_count)
+
+            bucket.family_consumed_core_count = family_consumed
+            bucket.consumed_core_count = family_consumed
+            bucket.family_quota_core_count = bucket_family_quota
+            bucket.quota_core_count = bucket_family_quota
+            bucket.family_quota_count = bucket_family_quota // vcpu_count
+            bucket.quota_count = bucket.family_quota_count
+
+            bucket.regional_consumed_core_count = regional_consumed
+            bucket.regional_quota_core_count = bucket_regional_quota
+            bucket.regional_quota_count = bucket_regional_quota // vcpu_count
+
+            bucket.available_count = min(
+                bucket.max_count - len(bucket.active_nodes),
+                (bucket_family_quota - family_consumed) // vcpu_count,
+                (bucket_regional_quota - regional_consumed) // vcpu_count,
+            )
+            bucket.available_core_count = bucket.available_count * vcpu_count
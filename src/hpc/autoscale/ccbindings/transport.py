@@ -0,0 +1,272 @@
+"""
+HTTP transport for the CycleCloud REST bindings: a pooled keep-alive adapter with
+default connect/read timeouts, jittered exponential backoff that honors
+Retry-After, and per-endpoint latency stats.
+
+The adapter can be mounted on any requests.Session, so it works for sessions we
+create ourselves as well as the one owned by the cyclecloud client.
+
+Configured via the optional "transport" section of the autoscale config:
+
+    "transport": {
+        "pool_connections": 4,
+        "pool_maxsize": 16,
+        "connect_timeout": 10,
+        "read_timeout": 120,
+        "max_retries": 3,
+        "backoff_factor": 0.5,
+        "backoff_max": 30
+    }
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import hpc.autoscale.hpclogging as logging
+
+Timeout = Union[None, float, Tuple[float, float]]
+
+# safe to resend even if the server may have processed the first attempt
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+# the server explicitly did not process the request, so any method can be retried
+THROTTLED_STATUSES = frozenset([429, 503])
+RETRYABLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class TransportConfig:
+    def __init__(
+        self,
+        pool_connections: int = 4,
+        pool_maxsize: int = 16,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 120.0,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        backoff_max: float = 30.0,
+    ) -> None:
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+
+    @staticmethod
+    def from_dict(d: Optional[Dict]) -> "TransportConfig":
+        d = d or {}
+        ret = TransportConfig()
+        for key, value in d.items():
+            if not hasattr(ret, key):
+                raise RuntimeError(
+                    "Unknown transport setting '{}'. Expected one of {}".format(
+                        key, sorted(ret.to_dict().keys())
+                    )
+                )
+            setattr(ret, key, value)
+        return ret
+
+    def to_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+    def __repr__(self) -> str:
+        return "TransportConfig({})".format(self.to_dict())
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.calls if self.calls else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "total_seconds": self.total_seconds,
+            "mean_seconds": self.mean_seconds,
+            "max_seconds": self.max_seconds,
+        }
+
+    def __repr__(self) -> str:
+        return "EndpointStats({})".format(self.to_dict())
+
+
+class RetryingHTTPAdapter(HTTPAdapter):
+    def __init__(
+        self,
+        config: Optional[TransportConfig] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.transport_config = config or TransportConfig()
+        self.__sleep = sleep
+        self.__stats: Dict[str, EndpointStats] = {}
+        self.__stats_lock = threading.Lock()
+        # retries are handled here rather than by urllib3, so that we can honor
+        # Retry-After, jitter the backoff and keep stats.
+        super().__init__(
+            pool_connections=self.transport_config.pool_connections,
+            pool_maxsize=self.transport_config.pool_maxsize,
+            max_retries=0,
+        )
+
+    def send(  # type: ignore
+        self, request: requests.PreparedRequest, timeout: Timeout = None, **kwargs: Any
+    ) -> requests.Response:
+        if timeout is None:
+            timeout = (
+                self.transport_config.connect_timeout,
+                self.transport_config.read_timeout,
+            )
+
+        method = (request.method or "GET").upper()
+        endpoint = "{} {}".format(method, urlparse(request.url or "").path)
+        # streamed or file-like bodies can not be sent a second time
+        can_resend = request.body is None or isinstance(request.body, (bytes, str))
+
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                response = super().send(request, timeout=timeout, **kwargs)
+            except requests.exceptions.ConnectTimeout as e:
+                # nothing was sent, so this is safe regardless of the method
+                self._record(endpoint, start, error=True)
+                if not can_resend or attempt >= self.transport_config.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logging.warning(
+                    "%s: %s - retrying in %.2f seconds", endpoint, e, delay,
+                )
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                self._record(endpoint, start, error=True)
+                if (
+                    not can_resend
+                    or method not in IDEMPOTENT_METHODS
+                    or attempt >= self.transport_config.max_retries
+                ):
+                    raise
+                delay = self._backoff(attempt)
+                logging.warning(
+                    "%s: %s - retrying in %.2f seconds", endpoint, e, delay,
+                )
+            else:
+                retryable = response.status_code in RETRYABLE_STATUSES and (
+                    method in IDEMPOTENT_METHODS
+                    or response.status_code in THROTTLED_STATUSES
+                )
+                self._record(
+                    endpoint, start, error=response.status_code >= 400,
+                )
+                if (
+                    not retryable
+                    or not can_resend
+                    or attempt >= self.transport_config.max_retries
+                ):
+                    return response
+
+                retry_after = self._retry_after(response)
+                delay = (
+                    retry_after if retry_after is not None else self._backoff(attempt)
+                )
+                logging.warning(
+                    "%s: status %s - retrying in %.2f seconds",
+                    endpoint,
+                    response.status_code,
+                    delay,
+                )
+                # release the connection back to the pool before retrying
+                response.close()
+
+            attempt += 1
+            with self.__stats_lock:
+                self.__stats[endpoint].retries += 1
+            self.__sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        # "full jitter" - uniform between 0 and the exponential ceiling
+        ceiling = min(
+            self.transport_config.backoff_max,
+            self.transport_config.backoff_factor * 2 ** attempt,
+        )
+        return random.uniform(0, ceiling)
+
+    def _retry_after(self, response: requests.Response) -> Optional[float]:
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(self.transport_config.backoff_max, max(0.0, delay))
+
+    def _record(self, endpoint: str, start: float, error: bool) -> None:
+        elapsed = time.monotonic() - start
+        with self.__stats_lock:
+            stats = self.__stats.get(endpoint)
+            if stats is None:
+                stats = self.__stats[endpoint] = EndpointStats()
+            stats.calls += 1
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            if error:
+                stats.errors += 1
+
+    def stats(self) -> Dict[str, EndpointStats]:
+        with self.__stats_lock:
+            return dict(self.__stats)
+
+    def __repr__(self) -> str:
+        return "RetryingHTTPAdapter({})".format(self.transport_config)
+
+
+def mount(session: requests.Session, adapter: RetryingHTTPAdapter) -> None:
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def install(session: Any, config: Optional[Dict]) -> Optional[RetryingHTTPAdapter]:
+    """
+    Mounts a RetryingHTTPAdapter on session, or on any requests.Session that
+    session wraps, i.e. the one owned by the cyclecloud client's session.
+    """
+    targets: List[requests.Session] = []
+    if isinstance(session, requests.Session):
+        targets.append(session)
+    else:
+        for value in getattr(session, "__dict__", {}).values():
+            if isinstance(value, requests.Session):
+                targets.append(value)
+
+    if not targets:
+        logging.warning(
+            "Could not find a requests.Session on %s."
+            + " Using its default transport settings.",
+            type(session),
+        )
+        return None
+
+    adapter = RetryingHTTPAdapter(TransportConfig.from_dict(config))
+    for target in targets:
+        mount(target, adapter)
+    return adapter
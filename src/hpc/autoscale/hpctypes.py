@@ -72,6 +72,12 @@ class Memory:
         ), "Invalid magnitude {}, expected {}".format(
             magnitude, _MAG_CONVERSIONS.keys()
         )
+        # canonical size in bytes, computed once so that comparisons do not have to
+        # convert both sides every time. Whole byte counts are kept as ints.
+        size_in_bytes = value * _MAG_CONVERSIONS[magnitude]
+        if isinstance(size_in_bytes, float) and size_in_bytes.is_integer():
+            size_in_bytes = int(size_in_bytes)
+        self.__bytes = size_in_bytes
 
     @property
     def value(self) -> MemoryValue:
@@ -90,7 +96,7 @@ class Memory:
         return Memory(new_value, new_mag)
 
     def __float__(self) -> float:
-        return float(self.value) * _MAG_CONVERSIONS[self.magnitude]
+        return float(self.__bytes)
 
     @classmethod
     def value_of(cls, value: typing.Union[MemoryValue, "Memory", str]) -> "Memory":
@@ -116,20 +122,31 @@ class Memory:
     def __int__(self) -> int:
         return int(self.value)
 
+    def __bytes_of(self, other: typing.Union[MemoryValue, "Memory"]) -> MemoryValue:
+        if isinstance(other, Memory):
+            return other.__bytes
+        return float(other)
+
     def __add__(self, other: typing.Union[MemoryValue, "Memory"]) -> "Memory":
+        if isinstance(other, Memory) and other.__magnitude == self.__magnitude:
+            return Memory(float(self.__value) + other.__value, self.__magnitude)
         other = Memory.value_of(other)
-        b = float(self) + float(other)
+        b = self.__bytes + other.__bytes
         new_value = b / _MAG_CONVERSIONS[self.magnitude]
         return Memory(new_value, self.magnitude)
 
     def __sub__(self, other: typing.Union[MemoryValue, "Memory"]) -> "Memory":
+        if isinstance(other, Memory) and other.__magnitude == self.__magnitude:
+            return Memory(float(self.__value) - other.__value, self.__magnitude)
         other = Memory.value_of(other)
-        b = float(self) - float(other)
+        b = self.__bytes - other.__bytes
         new_value = b / _MAG_CONVERSIONS[self.magnitude]
         return Memory(new_value, self.magnitude)
 
     def __truediv__(self, other: typing.Union["Memory", MemoryValue]) -> "Memory":
         if isinstance(other, Memory):
+            if other.__magnitude == self.__magnitude:
+                return Memory(self.__value / other.__value, self.__magnitude)
             return Memory(
                 self.value / other.convert_to(self.magnitude).value, self.magnitude
             )
@@ -138,12 +155,17 @@ class Memory:
     def __floordiv__(self, other: typing.Tuple[float, "Memory"]) -> "Memory":
         as_float: float
         if isinstance(other, Memory):
-            as_float = other.convert_to(self.magnitude).value
+            if other.__magnitude == self.__magnitude:
+                as_float = other.__value
+            else:
+                as_float = other.convert_to(self.magnitude).value
         elif isinstance(other, (float, int)):
             as_float = other
         return Memory((self.value // as_float), self.magnitude)
 
     def __mul__(self, other: MemoryValue) -> "Memory":
+        if isinstance(other, (int, float)):
+            return Memory(float(self.__value) * other, self.__magnitude)
         b = float(self) * float(other)
         new_value = b / _MAG_CONVERSIONS[self.magnitude]
         return Memory(new_value, self.magnitude)
@@ -155,24 +177,24 @@ class Memory:
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, (int, float, Memory)):
             return False
-        other = Memory.value_of(other)
-        return self.__float_eq(float(self), float(other))
+        them = self.__bytes_of(other)
+        return self.__bytes == them or self.__float_eq(self.__bytes, them)
 
     def __gt__(self, other: MemoryValue) -> bool:
-        return float(self) > float(other)
+        return self.__bytes > self.__bytes_of(other)
 
     def __ge__(self, other: MemoryValue) -> bool:
-        me = float(self)
-        them = float(other)
-        return me > them or self.__float_eq(me, them)
+        me = self.__bytes
+        them = self.__bytes_of(other)
+        return me >= them or self.__float_eq(me, them)
 
     def __lt__(self, other: MemoryValue) -> bool:
-        return float(self) < float(other)
+        return self.__bytes < self.__bytes_of(other)
 
     def __le__(self, other: MemoryValue) -> bool:
-        me = float(self)
-        them = float(other)
-        return me < them or self.__float_eq(me, them)
+        me = self.__bytes
+        them = self.__bytes_of(other)
+        return me <= them or self.__float_eq(me, them)
 
     def __str__(self) -> str:
         return "{:.2f}{}".format(self.value, self.magnitude)
@@ -1,13 +1,21 @@
-from typing import Any, Dict, List, Optional, Tuple, Union
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import hpc.autoscale.hpclogging as logging
+from hpc.autoscale import hpctypes as ht
 from hpc.autoscale.codeanalysis import hpcwrapclass
 from hpc.autoscale.hpclogging import apitrace
 from hpc.autoscale.hpctypes import OperationId
 from hpc.autoscale.job.demand import DemandResult
-from hpc.autoscale.job.job import Job, PackingStrategy
+from hpc.autoscale.job.incremental import DemandJournal, new_demand_journal
+from hpc.autoscale.job.job import Job, PackingStrategy, PackingStrategyType
 from hpc.autoscale.job.nodequeue import NodeQueue
+from hpc.autoscale.job.packingsolver import PackingSolver, can_solve, new_packing_solver
+from hpc.autoscale.job.partition import DemandPartition, partition_jobs
 from hpc.autoscale.job.schedulernode import SchedulerNode
+from hpc.autoscale.node.limits import _SharedLimit
 from hpc.autoscale.node.node import Node
 from hpc.autoscale.node.nodehistory import (
     NodeHistory,
@@ -43,15 +51,31 @@ class DemandCalculator:
         node_history: NodeHistory = NullNodeHistory(),
         node_queue: Optional[NodeQueue] = None,
         singleton_lock: Optional[SingletonLock] = None,
+        packing_solver: Optional[PackingSolver] = None,
+        partition_workers: int = 0,
+        journal: Optional[DemandJournal] = None,
     ) -> None:
         assert isinstance(node_mgr, NodeManager)
         self.node_mgr = node_mgr
         self.node_history = node_history
+        # when set, new nodes for the jobs it can model are only chosen in finish()
+        self.packing_solver = packing_solver
+        # with more than 1, add_jobs allocates independent partitions in processes
+        self.partition_workers = partition_workers
+        # when set, allocations that still hold are carried over from the last cycle
+        self.journal = journal
+        if journal and packing_solver:
+            logging.warning("The demand journal is not used with a packing solver")
+            self.journal = None
+        self.__deferred_jobs: List[Job] = []
 
         if node_queue is None:
             node_queue = NodeQueue()
 
         self.__scheduler_nodes_queue: NodeQueue = node_queue
+        # the default never bails out, so don't pay for calling it on every node
+        if type(node_queue).early_bailout is not NodeQueue.early_bailout:
+            self.node_mgr.early_bailout = node_queue.early_bailout
 
         for node in self.node_mgr.get_non_failed_nodes():
             self.__scheduler_nodes_queue.push(node)
@@ -70,9 +94,149 @@ class DemandCalculator:
 
     @apitrace
     def add_jobs(self, jobs: List[Job]) -> None:
+        jobs = self._best_fit_decreasing(jobs)
+        if self.partition_workers > 1 and not self.packing_solver and not self.journal:
+            jobs = self._add_jobs_partitioned(jobs)
         for job in jobs:
             self._add_job(job)
 
+    def _add_jobs_partitioned(self, jobs: List[Job]) -> List[Job]:
+        """
+        Allocates each partition of jobs that shares no limits with the others,
+        except the regional and cluster limits, in its own process against a copy
+        of its buckets. The results are then applied in partition order, and a
+        partition whose new nodes no longer fit in the regional or cluster limits
+        is allocated here instead, so the outcome does not depend on timing.
+        Returns the jobs that still need to be allocated.
+        """
+        partitions, unmatched = partition_jobs(jobs, self.node_mgr.get_buckets())
+        # defaults that depend on the node itself can't be applied in a worker
+        partitions_to_run = [
+            p
+            for p in partitions
+            if not any(self.node_mgr._pending_defaults(b) for b in p.buckets)
+            # nor can placement group buckets be built on first use there
+            and not any(
+                self.node_mgr._has_lazy_placement_groups(j._constraints, j.colocated)
+                for j in p.jobs
+            )
+        ]
+        if len(partitions_to_run) < 2:
+            return jobs
+
+        logging.debug(
+            "Allocating %d partitions with %d workers: %s",
+            len(partitions_to_run),
+            self.partition_workers,
+            partitions_to_run,
+        )
+        # pickled up front, so the copies are of the buckets as they are now
+        payloads = [pickle.dumps((p.buckets, p.jobs)) for p in partitions_to_run]
+        with ProcessPoolExecutor(max_workers=self.partition_workers) as executor:
+            results = list(executor.map(_allocate_partition, payloads))
+
+        results_by_partition = {id(p): r for p, r in zip(partitions_to_run, results)}
+        for partition in partitions:
+            result = results_by_partition.get(id(partition))
+            if result is not None and self._apply_partition_result(partition, result):
+                continue
+            for job in partition.jobs:
+                self._add_job(job)
+
+        return unmatched
+
+    def _apply_partition_result(
+        self, partition: DemandPartition, result: "_PartitionResult"
+    ) -> bool:
+        buckets_by_key = {
+            (b.bucket_id, b.placement_group): b for b in partition.buckets
+        }
+
+        new_by_bucket: Dict[Tuple, List[Node]] = {}
+        # the regional and cluster limits are the only ones other partitions share
+        shared: Dict[int, Tuple[_SharedLimit, int, int]] = {}
+        for node in result.new_nodes:
+            if node.name in self.node_mgr._node_names:
+                return False
+            key = (node.bucket_id, node.placement_group)
+            new_by_bucket.setdefault(key, []).append(node)
+            limits = buckets_by_key[key].limits
+            for limit in [limits._regional_limits, limits._cluster_limits]:
+                _, node_count, core_count = shared.get(id(limit), (limit, 0, 0))
+                shared[id(limit)] = (
+                    limit,
+                    node_count + 1,
+                    core_count + node.vcpu_count,
+                )
+
+        for limit, node_count, core_count in shared.values():
+            if not limit._has_room(node_count, core_count):
+                logging.debug(
+                    "%s no longer has room for %s, allocating it serially",
+                    limit,
+                    partition,
+                )
+                return False
+
+        for key, new_nodes in new_by_bucket.items():
+            bucket = buckets_by_key[key]
+            bucket.decrement(len(new_nodes))
+            self.node_mgr._commit(bucket, [(n, n) for n in new_nodes])
+            for node in new_nodes:
+                self.__scheduler_nodes_queue.push(node)
+
+        nodes_by_name = {n.name: n for b in partition.buckets for n in b.nodes}
+        for updated in result.updated_nodes:
+            node = nodes_by_name[updated.name]
+            # all of it, i.e. an exclusive job also closes the node
+            node._restore(updated._state())
+            node.metadata.update(deepcopy(updated.metadata))
+
+        for job, iterations_remaining in zip(
+            partition.jobs, result.iterations_remaining
+        ):
+            job.iterations_remaining = iterations_remaining
+
+        return True
+
+    def _best_fit_decreasing(self, jobs: List[Job]) -> List[Job]:
+        """
+        Sorts every run of consecutive best_fit jobs largest first, by the largest
+        fraction of any resource (ncpus, memory, ngpus etc) of the biggest vm size
+        that one slot requests. Every other job keeps its position.
+        """
+        if not any(job.packing_strategy == PackingStrategy.BEST_FIT for job in jobs):
+            return jobs
+
+        largest: Dict[str, float] = {}
+        for bucket in self.node_mgr.get_buckets():
+            for attr, value in bucket.resources.items():
+                if isinstance(value, bool) or not isinstance(
+                    value, (int, float, ht.Memory)
+                ):
+                    continue
+                largest[attr] = max(largest.get(attr, 0.0), float(value))
+
+        def dominant_share(job: Job) -> float:
+            shares = [
+                value / largest[attr]
+                for attr, value in job.resource_requests().items()
+                if largest.get(attr)
+            ]
+            return max(shares or [0.0])
+
+        ret: List[Job] = []
+        best_fit_run: List[Job] = []
+        for job in jobs:
+            if job.packing_strategy == PackingStrategy.BEST_FIT:
+                best_fit_run.append(job)
+                continue
+            ret.extend(sorted(best_fit_run, key=dominant_share, reverse=True))
+            best_fit_run = []
+            ret.append(job)
+        ret.extend(sorted(best_fit_run, key=dominant_share, reverse=True))
+        return ret
+
     @apitrace
     def add_job(self, job: Job) -> None:
         assert isinstance(job, Job)
@@ -80,9 +244,40 @@ class DemandCalculator:
         self.__scheduler_nodes_queue.update()
 
     def _add_job(self, job: Job) -> Result:
+        if not self.journal:
+            return self._allocate_job(job)
+
+        if not self.journal.started:
+            self.journal.begin(self.node_mgr)
+
+        replayed = self.journal.replay(job, self.node_mgr)
+        if replayed is not None:
+            nodes, slots_allocated = replayed
+            if not nodes:
+                return AllocationResult(
+                    "Failed",
+                    reasons=["Could not allocate job {} last cycle".format(job.name)],
+                )
+            self._track_new_nodes(nodes)
+            return AllocationResult(
+                "success", nodes=nodes, slots_allocated=slots_allocated
+            )
+
+        self.journal.begin_allocate(job, self.node_mgr)
+        try:
+            return self._allocate_job(job)
+        finally:
+            self.journal.end_allocate(job, self.node_mgr)
+
+    def _allocate_job(self, job: Job) -> Result:
 
         if job.packing_strategy == PackingStrategy.SCATTER:
             result = self._add_scatter(job)
+        elif self.packing_solver and can_solve(job):
+            # fill existing nodes now, the solver picks new nodes for the rest
+            result = self._pack_job(job, allow_new=False)
+            if job.iterations_remaining > 0:
+                self.__deferred_jobs.append(job)
         else:
             result = self._pack_job(job)
         return result
@@ -114,7 +309,7 @@ class DemandCalculator:
                 "success", nodes=allocated_nodes, slots_allocated=slots_to_allocate
             )
 
-    def _pack_job(self, job: Job) -> Result:
+    def _pack_job(self, job: Job, allow_new: bool = True) -> Result:
         """
         1) will it ever fit? - check num nodes with any capacity
         2) does it have the proper resources? bucket.match(job.resources)
@@ -126,6 +321,10 @@ class DemandCalculator:
         slots_to_allocate = job.iterations_remaining
         assert job.iterations_remaining > 0
 
+        if job.colocated:
+            self.node_mgr._materialize_placement_groups(
+                job._constraints, colocated=True
+            )
         available_buckets = self.node_mgr.get_buckets()
         # I don't want to fill up the log with rejecting placement groups
         # so just filter them here
@@ -143,7 +342,7 @@ class DemandCalculator:
             return candidates_result
 
         failure_reasons = self._handle_allocate(
-            job, allocated_nodes, all_or_nothing=False
+            job, allocated_nodes, all_or_nothing=False, allow_new=allow_new
         )
 
         # we have allocated at least some tasks
@@ -156,22 +355,59 @@ class DemandCalculator:
         return AllocationResult("Failed", reasons=failure_reasons)
 
     def _handle_allocate(
-        self, job: Job, allocated_nodes_out: List[Node], all_or_nothing: bool,
+        self,
+        job: Job,
+        allocated_nodes_out: List[Node],
+        all_or_nothing: bool,
+        allow_new: bool = True,
     ) -> Optional[List[str]]:
         result = job.do_allocate(
-            self.node_mgr, all_or_nothing=all_or_nothing, allow_existing=True,
+            self.node_mgr,
+            all_or_nothing=all_or_nothing,
+            allow_existing=True,
+            allow_new=allow_new,
         )
 
         if not result:
             return result.reasons
 
-        for node in result.nodes:
+        self._track_new_nodes(result.nodes)
+        allocated_nodes_out.extend(result.nodes)
+
+        return None
+
+    def _track_new_nodes(self, nodes: List[Node]) -> None:
+        for node in nodes:
             if not node.exists and node.metadata.get("__demand_allocated") is None:
                 self.__scheduler_nodes_queue.push(node)
                 node.metadata["__demand_allocated"] = True
-        allocated_nodes_out.extend(result.nodes)
 
-        return None
+    def _solve_deferred_jobs(self) -> None:
+        assert self.packing_solver
+        jobs = [j for j in self.__deferred_jobs if j.iterations_remaining > 0]
+        self.__deferred_jobs = []
+        if not jobs:
+            return
+
+        plan = self.packing_solver.solve(jobs, self.node_mgr.get_buckets())
+        if plan:
+            logging.info(
+                "Packing %d jobs onto %d new nodes: %s",
+                len(jobs),
+                plan.node_count,
+                plan.bucket_counts(),
+            )
+            for bucket, job, slot_count in plan.assignments():
+                result = job.do_allocate_in_bucket(
+                    self.node_mgr, bucket.bucket_id, slot_count
+                )
+                if result:
+                    self._track_new_nodes(result.nodes)
+
+        # whatever the plan could not place, or all of it if there is no plan
+        for job in jobs:
+            if job.iterations_remaining > 0:
+                self._pack_job(job)
 
     def get_compute_nodes(self) -> List[Node]:
         return list(self.__scheduler_nodes_queue)
@@ -180,6 +416,11 @@ class DemandCalculator:
     def finish(self) -> DemandResult:
         # for nodearray, vm_size, count, placement_group_id in self.__set_buffer_delayed_invocations:
         #     self.__set_buffer(nodearray, vm_size, count, placement_group_id)
+        if self.packing_solver:
+            self._solve_deferred_jobs()
+            self.__scheduler_nodes_queue.update()
+        if self.journal:
+            self.journal.save()
         return self.get_demand()
 
     @apitrace
@@ -332,6 +573,106 @@ class DemandCalculator:
         return ret
 
 
+@hpcwrapclass
+class PackingComparison:
+    def __init__(
+        self,
+        greedy_new_nodes: int,
+        best_fit_new_nodes: int,
+        greedy_unplaced_slots: int,
+        best_fit_unplaced_slots: int,
+    ) -> None:
+        self.greedy_new_nodes = greedy_new_nodes
+        self.best_fit_new_nodes = best_fit_new_nodes
+        self.greedy_unplaced_slots = greedy_unplaced_slots
+        self.best_fit_unplaced_slots = best_fit_unplaced_slots
+
+    @property
+    def nodes_saved(self) -> int:
+        return self.greedy_new_nodes - self.best_fit_new_nodes
+
+    def to_dict(self) -> Dict:
+        return {
+            "greedy-new-nodes": self.greedy_new_nodes,
+            "best-fit-new-nodes": self.best_fit_new_nodes,
+            "greedy-unplaced-slots": self.greedy_unplaced_slots,
+            "best-fit-unplaced-slots": self.best_fit_unplaced_slots,
+            "nodes-saved": self.nodes_saved,
+        }
+
+    def __str__(self) -> str:
+        return "PackingComparison(nodes_saved={}, greedy={}, best_fit={})".format(
+            self.nodes_saved, self.greedy_new_nodes, self.best_fit_new_nodes
+        )
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+@apitrace
+def compare_packing(
+    demand_calculator_factory: Callable[[], DemandCalculator], jobs: List[Job]
+) -> PackingComparison:
+    """
+    Places copies of jobs twice, each time with a new DemandCalculator, once with
+    every pack and best_fit job as pack and once with them all as best_fit, and
+    reports how many more new nodes the greedy pack placement needed.
+    """
+
+    def place(strategy: PackingStrategyType) -> Tuple[int, int]:
+        copies = []
+        for job in jobs:
+            copy = Job.from_dict(job.to_dict())
+            if copy.packing_strategy != PackingStrategy.SCATTER:
+                copy.packing_strategy = strategy
+            copies.append(copy)
+
+        dcalc = demand_calculator_factory()
+        dcalc.add_jobs(copies)
+        unplaced = sum(j.iterations_remaining for j in copies if j.node_count <= 0)
+        return len(dcalc.get_demand().new_nodes), unplaced
+
+    greedy_new_nodes, greedy_unplaced = place(PackingStrategy.PACK)
+    best_fit_new_nodes, best_fit_unplaced = place(PackingStrategy.BEST_FIT)
+    return PackingComparison(
+        greedy_new_nodes, best_fit_new_nodes, greedy_unplaced, best_fit_unplaced
+    )
+
+
+class _PartitionResult:
+    def __init__(
+        self,
+        iterations_remaining: List[int],
+        new_nodes: List[Node],
+        updated_nodes: List[Node],
+    ) -> None:
+        self.iterations_remaining = iterations_remaining
+        self.new_nodes = new_nodes
+        self.updated_nodes = updated_nodes
+
+
+def _allocate_partition(payload: bytes) -> _PartitionResult:
+    buckets, jobs = pickle.loads(payload)
+    before = {n.name: n._state() for b in buckets for n in b.nodes}
+    # allocation never calls the cluster
+    node_mgr = NodeManager(None, buckets)
+    dcalc = DemandCalculator(node_mgr, singleton_lock=NullSingletonLock())
+    for job in jobs:
+        dcalc._add_job(job)
+
+    new_nodes = []
+    updated_nodes = []
+    for node in node_mgr.get_nodes():
+        if node.name not in before:
+            new_nodes.append(node)
+        elif node._state() != before[node.name]:
+            updated_nodes.append(node)
+
+    return _PartitionResult(
+        [job.iterations_remaining for job in jobs], new_nodes, updated_nodes
+    )
+
+
 @apitrace
 def new_demand_calculator(
     config: Union[str, dict],
@@ -341,6 +682,9 @@ def new_demand_calculator(
     disable_default_resources: bool = False,
     node_queue: Optional[NodeQueue] = None,
     singleton_lock: Optional[SingletonLock] = NullSingletonLock(),
+    packing_solver: Optional[PackingSolver] = None,
+    partition_workers: Optional[int] = None,
+    journal: Optional[DemandJournal] = None,
 ) -> DemandCalculator:
     config_dict = load_config(config)
 
@@ -361,7 +705,24 @@ def new_demand_calculator(
     if singleton_lock is None:
         singleton_lock = new_singleton_lock(config_dict)
 
-    dc = DemandCalculator(node_mgr, node_history, node_queue, singleton_lock)
+    if packing_solver is None and config_dict.get("packing_solver"):
+        packing_solver = new_packing_solver(config_dict["packing_solver"])
+
+    if partition_workers is None:
+        partition_workers = int(config_dict.get("partition_workers", 0))
+
+    if journal is None and config_dict.get("incremental_demand"):
+        journal = new_demand_journal(config_dict["incremental_demand"])
+
+    dc = DemandCalculator(
+        node_mgr,
+        node_history,
+        node_queue,
+        singleton_lock,
+        packing_solver,
+        partition_workers,
+        journal,
+    )
 
     dc.update_scheduler_nodes(existing_nodes)
     return dc
@@ -1,10 +1,24 @@
+import csv
+import functools
 import inspect
 import io
+import itertools
 import json
 import logging as logginglib
 import sys
 from datetime import datetime
-from typing import Any, Callable, Dict, List, Optional, Set, TextIO, Tuple
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+)
 
 from typing_extensions import Literal
 
@@ -14,7 +28,9 @@ from hpc.autoscale.hpctypes import Hostname
 from hpc.autoscale.job.demand import DemandResult
 from hpc.autoscale.node.node import Node
 
-OutputFormat = Literal["json", "table", "table_headerless"]
+OutputFormat = Literal["json", "jsonl", "csv", "table", "table_headerless"]
+
+ColumnAccessor = Callable[[Node], Any]
 
 
 @hpcwrapclass
@@ -24,7 +40,13 @@ class DemandPrinter:
         column_names: Optional[List[str]] = None,
         stream: Optional[TextIO] = None,
         output_format: OutputFormat = "table",
+        width_sample_size: Optional[int] = None,
     ) -> None:
+        """
+        width_sample_size - for table output, size the columns using only the first
+        N rows so that rows can be written as they are generated. Longer values
+        later on simply push the rest of their row to the right.
+        """
         column_names_list: List[str] = []
 
         if column_names:
@@ -43,6 +65,7 @@ class DemandPrinter:
 
         self.stream = stream or sys.stdout
         self.output_format = output_format
+        self.width_sample_size = width_sample_size
 
     def _calc_width(self, columns: List[str], rows: List[List[str]]) -> Tuple[int, ...]:
         maxes = [len(c) for c in columns]
@@ -53,14 +76,7 @@ class DemandPrinter:
 
     def _get_all_columns(self, compute_nodes: List[Node]) -> List[str]:
 
-        columns = []
-        for attr_name in dir(Node):
-            if not attr_name[0].isalpha():
-                continue
-            attr = getattr(Node, attr_name)
-            if hasattr(attr, "__call__"):
-                continue
-            columns.append(attr_name)
+        columns = list(_node_attribute_columns())
 
         if compute_nodes:
             all_available: Set[str] = set()
@@ -88,12 +104,11 @@ class DemandPrinter:
         self.stream.flush()
 
     def print_demand(self, demand_result: DemandResult) -> None:
-        rows = []
         columns = self.column_names
         if not columns:
             columns = self._get_all_columns(demand_result.compute_nodes)
 
-        if self.output_format == "json":
+        if self.output_format in ["json", "jsonl"]:
             columns = [c for c in columns if c not in ["hostname_required"]]
         else:
             columns = [
@@ -124,77 +139,94 @@ class DemandPrinter:
 
         ordered_nodes = sorted(demand_result.compute_nodes, key=sort_by_ip_or_name)
 
-        for node in ordered_nodes:
-            row: List[str] = []
-            rows.append(row)
-            for column in columns:
-                # TODO justify - this is a printing function, so this value could be lots of things etc.
-
-                value: Any = None
-                is_from_available = column.startswith("*")
-                is_ratio = column.startswith("/")
-                if is_from_available or is_ratio:
-                    column = column[1:]
-
-                if column == "hostname":
-                    hostname = node.hostname
-
-                    if not node.exists or not hostname:
-                        if node.private_ip:
-                            hostname = Hostname(str(node.private_ip))
-                        else:
-                            hostname = Hostname("tbd")
-                    value = hostname
-                elif column == "hostname_required":
-                    continue
-                elif column == "job_ids":
-                    value = node.assignments
-                elif hasattr(node, column):
-                    value = getattr(node, column)
-                else:
-                    if is_from_available:
-                        value = node.available.get(column)
-                    elif is_ratio:
-                        value = "{}/{}".format(
-                            node.available.get(column), node.resources.get(column)
-                        )
-                    else:
-                        value = node.resources.get(column)
-
-                if value is None:
-                    value = self.__defaults.get(column)
-
-                # convert sets to lists, as sets are not json serializable
-                if isinstance(value, set):
-                    value = list(value)
-                elif isinstance(value, datetime):
-                    value = value.isoformat()
-
-                # for json, we support lists, null, numbers etc.
-                # for table* we will output a string for every value.
-                if self.output_format != "json":
-                    if isinstance(value, list):
-                        value = ",".join(sorted(value))
-                    elif isinstance(value, set):
-                        value = ",".join(sorted(list(value)))
-                    elif value is None:
-                        value = ""
-                    elif isinstance(value, float):
-                        value = "{:.1f}".format(value)
-                    elif not isinstance(value, str):
-                        value = str(value)
-
-                else:
-                    if hasattr(value, "to_json"):
-                        value = value.to_json()
-                    elif hasattr(value, "keys"):
-                        value = dict(value)
-
-                row.append(value)
+        rows = self._generate_rows(columns, ordered_nodes)
 
         # remove /
         columns = [c.lstrip("/") for c in columns]
-        print_rows(columns, rows, self.stream, self.output_format)
+        print_rows(
+            columns,
+            rows,
+            self.stream,
+            self.output_format,
+            width_sample_size=self.width_sample_size,
+        )
+
+    def _generate_rows(
+        self, columns: List[str], nodes: Iterable[Node]
+    ) -> Iterator[List[Any]]:
+        # accessors are resolved once per node class rather than once per cell
+        accessors_by_class: Dict[type, List[ColumnAccessor]] = {}
+
+        for node in nodes:
+            accessors = accessors_by_class.get(node.__class__)
+            if accessors is None:
+                accessors = [
+                    self._compile_column(column, node.__class__) for column in columns
+                ]
+                accessors_by_class[node.__class__] = accessors
+            yield [accessor(node) for accessor in accessors]
+
+    def _compile_column(self, column: str, node_class: type) -> ColumnAccessor:
+        is_from_available = column.startswith("*")
+        is_ratio = column.startswith("/")
+        if is_from_available or is_ratio:
+            column = column[1:]
+
+        get_value: ColumnAccessor
+
+        if column == "hostname":
+
+            def get_value(node: Node) -> Any:
+                hostname = node.hostname
+
+                if not node.exists or not hostname:
+                    if node.private_ip:
+                        hostname = Hostname(str(node.private_ip))
+                    else:
+                        hostname = Hostname("tbd")
+                return hostname
+
+        elif column == "job_ids":
+
+            def get_value(node: Node) -> Any:
+                return node.assignments
+
+        elif hasattr(node_class, column):
+
+            def get_value(node: Node) -> Any:
+                return getattr(node, column)
+
+        elif is_from_available:
+
+            def get_value(node: Node) -> Any:
+                return node.available.get(column)
+
+        elif is_ratio:
+
+            def get_value(node: Node) -> Any:
+                return "{}/{}".format(
+                    node.available.get(column), node.resources.get(column)
+                )
+
+        else:
+
+            def get_value(node: Node) -> Any:
+                return node.resources.get(column)
+
+        default_value = self.__defaults.get(column)
+        format_value = (
+            _format_json_value
+            if self.output_format in ["json", "jsonl"]
+            else _format_text_value
+        )
+
+        def accessor(node: Node) -> Any:
+            value = get_value(node)
+            if value is None:
+                value = default_value
+            return format_value(value)
+
+        return accessor
 
     def __str__(self) -> str:
         return "DemandPrinter(columns={}, output_format={}, stream={})".format(
@@ -205,6 +237,49 @@ class DemandPrinter:
         return str(self)
 
 
+@functools.lru_cache(maxsize=1)
+def _node_attribute_columns() -> Tuple[str, ...]:
+    columns = []
+    for attr_name in dir(Node):
+        if not attr_name[0].isalpha():
+            continue
+        attr = getattr(Node, attr_name)
+        if hasattr(attr, "__call__"):
+            continue
+        columns.append(attr_name)
+    return tuple(columns)
+
+
+def _format_json_value(value: Any) -> Any:
+    # convert sets to lists, as sets are not json serializable
+    if isinstance(value, set):
+        value = list(value)
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+
+    # for json, we support lists, null, numbers etc.
+    if hasattr(value, "to_json"):
+        value = value.to_json()
+    elif hasattr(value, "keys"):
+        value = dict(value)
+    return value
+
+
+def _format_text_value(value: Any) -> str:
+    # for table* and csv we will output a string for every value.
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, set)):
+        return ",".join(sorted(value))
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return "{:.1f}".format(value)
+    if not isinstance(value, str):
+        return str(value)
+    return value
+
+
 def print_columns(
     demand_result: DemandResult,
     stream: Optional[TextIO] = None,
@@ -317,18 +392,41 @@ def calculate_column_widths(
 
 def print_rows(
     columns: List[str],
-    rows: List[List[str]],
+    rows: Iterable[List[Any]],
     stream: Optional[TextIO] = None,
     output_format: str = "table",
+    width_sample_size: Optional[int] = None,
 ) -> None:
+    """
+    Rows may be any iterable. jsonl and csv are written row by row, as is table
+    output when width_sample_size is set.
+    """
     stream = stream or sys.stdout
+    output_format = output_format.lower()
 
-    if output_format.lower() == "json":
+    if output_format == "json":
         json.dump(
             [dict(zip(columns, row)) for row in rows], stream, indent=2,
         )
+    elif output_format == "jsonl":
+        for row in rows:
+            stream.write(json.dumps(dict(zip(columns, row))))
+            stream.write("\n")
+    elif output_format == "csv":
+        writer = csv.writer(stream, lineterminator="\n")
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
     else:
-        widths = calculate_column_widths(columns, rows)
+        if width_sample_size is None:
+            rows = list(rows)
+            widths = calculate_column_widths(columns, rows)
+        else:
+            rows = iter(rows)
+            sample = list(itertools.islice(rows, width_sample_size))
+            widths = calculate_column_widths(columns, sample)
+            rows = itertools.chain(sample, rows)
+
         formats = " ".join(["{:%d}" % x for x in widths])
         if output_format == "table":
             print(formats.format(*[c.upper() for c in columns]), file=stream)
@@ -0,0 +1,434 @@
+"""
+Carries allocations forward from one autoscale cycle to the next. A DemandJournal
+records, for every job, each node decrement NodeManager.allocate made for it.
+The next cycle repeats those decrements directly, instead of searching the
+buckets again, for every job whose previous allocation still holds:
+
+    - the job is unchanged, including its remaining iterations
+    - the nodes and buckets of every nodearray the job could run on started the
+      cycle just as they did last cycle, and every earlier job that changed them
+      did so in the same order and in the same way
+    - the regional, cluster and vm family limits of those buckets, which other
+      nodearrays share, have the same cores left
+
+Every other job is allocated as usual. As the allocation of a job only depends on
+the above, the demand is the same as if every job had been allocated again.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+import hpc.autoscale.hpclogging as logging
+from hpc.autoscale import hpctypes as ht
+from hpc.autoscale.codeanalysis import hpcwrapclass
+from hpc.autoscale.job.job import Job
+from hpc.autoscale.node.bucket import NodeBucket
+from hpc.autoscale.node.limits import _SharedLimit, _SpotLimit
+from hpc.autoscale.node.node import Node
+from hpc.autoscale.node.nodemanager import NodeManager
+
+JOURNAL_VERSION = 1
+
+# (bucket key, node name, new, slots)
+_Step = Tuple[str, str, bool, int]
+
+
+class _JournalEntry:
+    def __init__(
+        self,
+        name: str,
+        key: str,
+        reads: List[str],
+        limits: Dict[str, List[int]],
+        steps: List[_Step],
+        iterations_remaining: int,
+    ) -> None:
+        self.name = name
+        self.key = key
+        # the nodearrays the job could run on
+        self.reads = reads
+        # the limits those share with other nodearrays, by name
+        self.limits = limits
+        self.steps = steps
+        self.iterations_remaining = iterations_remaining
+
+    @property
+    def writes(self) -> Set[str]:
+        return {_nodearray_of(bucket_key) for bucket_key, _, _, _ in self.steps}
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "key": self.key,
+            "reads": self.reads,
+            "limits": self.limits,
+            "steps": [list(step) for step in self.steps],
+            "iterations-remaining": self.iterations_remaining,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "_JournalEntry":
+        return _JournalEntry(
+            d["name"],
+            d["key"],
+            d["reads"],
+            d["limits"],
+            [(s[0], s[1], bool(s[2]), int(s[3])) for s in d["steps"]],
+            d["iterations-remaining"],
+        )
+
+
+class _Cycle:
+    def __init__(self, layout: str, start: Dict[str, str]) -> None:
+        self.layout = layout
+        self.start = start
+        self.entries: List[_JournalEntry] = []
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": JOURNAL_VERSION,
+            "layout": self.layout,
+            "start": self.start,
+            "entries": [e.to_dict() for e in self.entries],
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "_Cycle":
+        ret = _Cycle(d["layout"], d["start"])
+        ret.entries = [_JournalEntry.from_dict(e) for e in d["entries"]]
+        return ret
+
+
+@hpcwrapclass
+class DemandJournal:
+    """
+    Pass the same DemandJournal, or one with the same path, to the DemandCalculator
+    of each cycle. The cycle is recorded when DemandCalculator.finish is called.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.replayed_count = 0
+        self.allocated_count = 0
+        self.__previous: Optional[_Cycle] = None
+        self.__current: Optional[_Cycle] = None
+        self.__pending: Optional[
+            Tuple[Job, str, List[str], Dict[str, List[int]]]
+        ] = None
+        self.__by_name: Dict[str, Tuple[int, _JournalEntry]] = {}
+        self.__in_sync: Dict[str, bool] = {}
+        # per nodearray, the previous entries that changed it that are not
+        # repeated yet, last one first
+        self.__expected: Dict[str, List[int]] = {}
+        self.__buckets: Dict[str, NodeBucket] = {}
+        self.__buckets_by_id: Dict[Tuple, NodeBucket] = {}
+        self.__shared_limits: Dict[str, _SharedLimit] = {}
+        # the candidates only depend on the constraints and the bucket layout
+        self.__candidates: Dict[str, Tuple[List[str], List[_SharedLimit]]] = {}
+
+        if path and os.path.exists(path):
+            try:
+                with open(path) as fr:
+                    d = json.load(fr)
+                if d.get("version") == JOURNAL_VERSION:
+                    self.__previous = _Cycle.from_dict(d)
+            except (ValueError, KeyError) as e:
+                logging.warning("Ignoring demand journal %s: %s", path, e)
+
+    def begin(self, node_mgr: NodeManager) -> None:
+        """Takes the fingerprint of the buckets before any job is allocated."""
+        self.__current = _Cycle(_layout(node_mgr), _start(node_mgr))
+        self.replayed_count = 0
+        self.allocated_count = 0
+        self.__buckets = {}
+        self.__buckets_by_id = {}
+        self._add_buckets(node_mgr)
+        self.__shared_limits = {
+            limit._name: limit for limit in _shared_limits(node_mgr.get_buckets())
+        }
+        self.__candidates = {}
+
+        previous = self.__previous
+        self.__by_name = {}
+        self.__in_sync = {}
+        self.__expected = {}
+
+        if previous is None or previous.layout != self.__current.layout:
+            return
+
+        for nodearray, fingerprint in self.__current.start.items():
+            self.__in_sync[nodearray] = previous.start.get(nodearray) == fingerprint
+
+        for index, entry in enumerate(previous.entries):
+            self.__by_name[entry.name] = (index, entry)
+            for nodearray in sorted(entry.writes):
+                self.__expected.setdefault(nodearray, []).append(index)
+        for indices in self.__expected.values():
+            indices.reverse()
+
+    def _add_buckets(self, node_mgr: NodeManager) -> None:
+        for bucket in node_mgr.get_buckets():
+            self.__buckets[_bucket_key(bucket)] = bucket
+            self.__buckets_by_id[(bucket.bucket_id, bucket.placement_group)] = bucket
+
+    @property
+    def started(self) -> bool:
+        return self.__current is not None
+
+    def replay(
+        self, job: Job, node_mgr: NodeManager
+    ) -> Optional[Tuple[List[Node], int]]:
+        """
+        Repeats the previous allocation of the job, if it still holds, and returns
+        the nodes it was allocated to and the slots allocated. Returns None if the
+        job has to be allocated.
+        """
+        assert self.__current is not None
+        if job.node_count > 0:
+            # node_count allocations replace nodes in their bucket, so they are
+            # always allocated, but are still tracked by end_allocate.
+            return None
+
+        entry = self._valid_entry(job, _job_key(job))
+        if entry is None:
+            return None
+
+        # i.e. a placement group whose bucket is not built yet
+        if any(step[0] not in self.__buckets for step in entry.steps):
+            return None
+
+        nodes: List[Node] = []
+        total_slots = 0
+        for bucket_key, node_name, new, slots in entry.steps:
+            node = node_mgr._replay_allocation(
+                self.__buckets[bucket_key],
+                ht.NodeName(node_name),
+                new,
+                slots,
+                job._constraints,
+                job.name,
+            )
+            if node not in nodes:
+                nodes.append(node)
+            total_slots += slots
+
+        job.iterations_remaining = entry.iterations_remaining
+        self._consume(entry)
+        self.__current.entries.append(entry)
+        self.replayed_count += 1
+        return nodes, total_slots
+
+    def begin_allocate(self, job: Job, node_mgr: NodeManager) -> None:
+        """Call before the job is allocated as usual, then end_allocate after."""
+        key = _job_key(job)
+        constraints_key = _digest(
+            json.dumps(job.to_dict()["constraints"], sort_keys=True, default=str)
+        )
+        if constraints_key not in self.__candidates:
+            result = job.bucket_candidates(node_mgr.get_buckets())
+            candidates = result.candidates if result else []
+            self.__candidates[constraints_key] = (
+                sorted({b.nodearray for b in candidates}),
+                _shared_limits(candidates),
+            )
+        reads, shared_limits = self.__candidates[constraints_key]
+        limits = {limit._name: _limit_counts(limit) for limit in shared_limits}
+        self.__pending = (job, key, reads, limits)
+        node_mgr._allocation_log = []
+
+    def end_allocate(self, job: Job, node_mgr: NodeManager) -> None:
+        assert self.__current is not None and self.__pending is not None
+        pending_job, key, reads, limits = self.__pending
+        assert pending_job is job
+        self.__pending = None
+        log = node_mgr._allocation_log or []
+        node_mgr._allocation_log = None
+
+        steps: List[_Step] = []
+        for bucket_id, placement_group, node_name, new, slots in log:
+            if (bucket_id, placement_group) not in self.__buckets_by_id:
+                # built on first use, while allocating this job
+                self._add_buckets(node_mgr)
+            bucket = self.__buckets_by_id[(bucket_id, placement_group)]
+            # new nodes that were rolled back are not in the bucket
+            if new and not any(n.name == node_name for n in bucket.nodes):
+                continue
+            steps.append((_bucket_key(bucket), node_name, new, slots))
+
+        entry = _JournalEntry(
+            job.name, key, reads, limits, steps, job.iterations_remaining
+        )
+        self.__current.entries.append(entry)
+        self.allocated_count += 1
+
+        previous = self.__by_name.get(job.name)
+        # allocated again, but it changed the nodes just like last time
+        if (
+            previous is not None
+            and previous[1].key == key
+            and previous[1].steps == steps
+            and previous[1].limits == limits
+            and self._in_order(previous[0], previous[1])
+        ):
+            self._consume(previous[1])
+            return
+
+        for nodearray in entry.writes | (previous[1].writes if previous else set()):
+            self.__in_sync[nodearray] = False
+
+    def save(self) -> None:
+        """Makes this cycle the previous one, and writes it to path, if any."""
+        if self.__current is None:
+            return
+        logging.debug(
+            "Demand journal: replayed %d jobs and allocated %d",
+            self.replayed_count,
+            self.allocated_count,
+        )
+        self.__previous = self.__current
+        self.__current = None
+        if self.path:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as fw:
+                json.dump(self.__previous.to_dict(), fw, default=str)
+            os.replace(tmp_path, self.path)
+
+    def _valid_entry(self, job: Job, key: str) -> Optional[_JournalEntry]:
+        found = self.__by_name.get(job.name)
+        if found is None:
+            return None
+        index, entry = found
+        if entry.key != key or not self._in_order(index, entry):
+            return None
+
+        for name, counts in entry.limits.items():
+            limit = self.__shared_limits.get(name)
+            if limit is None or _limit_counts(limit) != counts:
+                return None
+        return entry
+
+    def _in_order(self, index: int, entry: _JournalEntry) -> bool:
+        for nodearray in set(entry.reads) | entry.writes:
+            if not self.__in_sync.get(nodearray):
+                return False
+            expected = self.__expected.get(nodearray)
+            # an earlier job that changed this nodearray was not repeated
+            if expected and expected[-1] < index:
+                return False
+        return True
+
+    def _consume(self, entry: _JournalEntry) -> None:
+        for nodearray in entry.writes:
+            expected = self.__expected.get(nodearray)
+            if expected:
+                expected.pop()
+
+    def __str__(self) -> str:
+        return "DemandJournal(path={}, replayed={}, allocated={})".format(
+            self.path, self.replayed_count, self.allocated_count
+        )
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+def new_demand_journal(config: Dict) -> Optional[DemandJournal]:
+    """
+    From the incremental_demand section of the autoscale config, i.e.
+
+        "incremental_demand": {"path": "demandjournal.json"}
+    """
+    if not config:
+        return None
+    if not isinstance(config, dict):
+        config = {}
+    return DemandJournal(config.get("path", "demandjournal.json"))
+
+
+def _bucket_key(bucket: NodeBucket) -> str:
+    # the nodearray is part of the key, so the steps know which nodearray they change
+    return "{}/{}/{}".format(
+        bucket.nodearray, bucket.vm_size, bucket.placement_group or ""
+    )
+
+
+def _nodearray_of(bucket_key: str) -> str:
+    return bucket_key.split("/", 1)[0]
+
+
+def _shared_limits(buckets: List[NodeBucket]) -> List[_SharedLimit]:
+    """The limits buckets share across nodearrays, i.e. regional, cluster and family"""
+    by_id: Dict[int, _SharedLimit] = {}
+    for bucket in buckets:
+        limits = bucket.limits
+        for limit in [
+            limits._regional_limits,
+            limits._cluster_limits,
+            limits._family_limits,
+        ]:
+            # spot family limits are the regional limit
+            if not isinstance(limit, _SpotLimit):
+                by_id[id(limit)] = limit
+    return list(by_id.values())
+
+
+def _limit_counts(limit: _SharedLimit) -> List[int]:
+    # with the max cores, the cores left for one core fully describe the limit
+    return [
+        limit._consumed_core_count,
+        limit._max_core_count,
+        limit._available_count(1),
+    ]
+
+
+def _job_key(job: Job) -> str:
+    return _digest(json.dumps(job.to_dict(), sort_keys=True, default=str))
+
+
+def _layout(node_mgr: NodeManager) -> str:
+    return _digest(
+        repr(
+            [
+                (_bucket_key(b), b.vm_size, sorted(b.resources.items()))
+                for b in node_mgr.get_buckets()
+            ]
+        )
+    )
+
+
+def _start(node_mgr: NodeManager) -> Dict[str, str]:
+    by_nodearray: Dict[str, List] = {}
+    for bucket in node_mgr.get_buckets():
+        limits = bucket.limits
+        by_nodearray.setdefault(bucket.nodearray, []).append(
+            (
+                _bucket_key(bucket),
+                limits.available_count,
+                limits.nodearray_available_count,
+                limits.placement_group_available_count,
+                [_node_state(n) for n in bucket.nodes],
+            )
+        )
+    return {
+        nodearray: _digest(repr(state)) for nodearray, state in by_nodearray.items()
+    }
+
+
+def _node_state(node: Node) -> Tuple:
+    return (
+        node.name,
+        node.hostname,
+        node.state,
+        node.exists,
+        node.closed,
+        node._allocated,
+        node.placement_group,
+        sorted(node.resources.items()),
+        sorted(node.available.items()),
+        sorted(node.assignments),
+    )
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
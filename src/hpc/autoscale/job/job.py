@@ -4,7 +4,11 @@ from typing import Any, Dict, Iterable, List, NewType, Optional, Union
 from hpc.autoscale import hpctypes as ht
 from hpc.autoscale.codeanalysis import hpcwrapclass
 from hpc.autoscale.node import nodemanager
-from hpc.autoscale.node.constraints import get_constraints
+from hpc.autoscale.node.constraints import (
+    NodePropertyConstraint,
+    get_constraints,
+    get_resource_requests,
+)
 from hpc.autoscale.results import AllocationResult, CandidatesResult
 
 if typing.TYPE_CHECKING:
@@ -17,10 +21,13 @@ PackingStrategyType = NewType("PackingStrategyType", str)
 class PackingStrategy:
     PACK = PackingStrategyType("pack")
     SCATTER = PackingStrategyType("scatter")
+    # like pack, but DemandCalculator.add_jobs places consecutive best_fit jobs
+    # largest first, each on the fullest existing node it fits before any new node.
+    BEST_FIT = PackingStrategyType("best_fit")
 
     @classmethod
     def is_valid(cls, strat: str) -> bool:
-        return strat in [cls.PACK, cls.SCATTER]
+        return strat in [cls.PACK, cls.SCATTER, cls.BEST_FIT]
 
 
 _default_job_id = 0
@@ -126,6 +133,7 @@ class Job:
         node_mgr: nodemanager.NodeManager,
         allow_existing: bool,
         all_or_nothing: bool,
+        allow_new: bool = True,
     ) -> AllocationResult:
         if self.__node_count > 0:
 
@@ -135,6 +143,7 @@ class Job:
                 allow_existing=allow_existing,
                 all_or_nothing=self.__colocated,
                 assignment_id=self.name,
+                allow_new=allow_new,
             )
 
         assert self.iterations_remaining > 0
@@ -146,6 +155,33 @@ class Job:
             # colocated is always all or nothing
             all_or_nothing=all_or_nothing or self.colocated,
             assignment_id=self.name,
+            best_fit=self.packing_strategy == PackingStrategy.BEST_FIT,
+            allow_new=allow_new,
+        )
+        if result:
+            self.iterations_remaining -= result.total_slots
+        return result
+
+    def do_allocate_in_bucket(
+        self,
+        node_mgr: nodemanager.NodeManager,
+        bucket_id: ht.BucketId,
+        slot_count: int,
+    ) -> AllocationResult:
+        """
+        Allocates up to slot_count of the remaining iterations, best fit, to the
+        bucket outside of any placement group.
+        """
+        constraints = list(self._constraints) + [
+            NodePropertyConstraint("bucket_id", bucket_id),
+            NodePropertyConstraint("placement_group", None, ""),
+        ]
+        result = node_mgr.allocate(
+            constraints,
+            slot_count=min(slot_count, self.iterations_remaining),
+            allow_existing=True,
+            assignment_id=self.name,
+            best_fit=True,
         )
         if result:
             self.iterations_remaining -= result.total_slots
@@ -156,6 +192,9 @@ class Job:
 
         return bucket.bucket_candidates(candidates, self._constraints)
 
+    def resource_requests(self) -> Dict[str, float]:
+        return get_resource_requests(self._constraints)
+
     def add_constraint(self, constraint: typing.Any) -> None:
         if not isinstance(constraint, list):
             constraint = [constraint]
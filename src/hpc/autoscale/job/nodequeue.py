@@ -22,6 +22,10 @@ class NodeQueue:
         return node.available.get("ncpus", 0)
 
     def early_bailout(self, node: Node) -> EarlyBailoutResult:
+        """
+        Override to skip existing nodes that can take no more work, before any
+        constraint is checked. The DemandCalculator hands it to its NodeManager.
+        """
         return EarlyBailoutResult("success")
 
     def push(self, node: Node) -> None:
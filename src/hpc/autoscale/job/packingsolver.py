@@ -0,0 +1,551 @@
+"""
+An optional global stage for DemandCalculator.finish: the slots that did not fit on
+existing nodes are packed onto new nodes all at once, choosing how many nodes of
+each bucket to add so that their total cost - vcpus by default - is as low as
+possible, within every bucket's available_count and the regional, cluster,
+nodearray, family and placement group limits the buckets share.
+
+This is a heuristic rather than an exact ILP. A packing is built best fit
+decreasing, opening each new node in the bucket with the lowest cost per slot of
+the job being placed, and every node is then moved to the cheapest bucket that
+still holds its slots. Other job orderings are tried until the time budget runs
+out and the cheapest packing wins. If not even the first packing is done in time,
+solve returns None and the slots are allocated greedily instead.
+"""
+import json
+import math
+import random
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, Union
+
+from hpc.autoscale import hpclogging as logging
+from hpc.autoscale import hpctypes as ht
+from hpc.autoscale.codeanalysis import hpcwrapclass
+from hpc.autoscale.node import constraints as constraintslib
+from hpc.autoscale.node.bucket import NodeBucket
+from hpc.autoscale.node.limits import _SharedLimit, _SpotLimit
+
+if TYPE_CHECKING:
+    from hpc.autoscale.job.job import Job  # noqa: F401
+
+
+BucketCost = Callable[[NodeBucket], float]
+
+# constraints whose answer for a new node only depends on its bucket, or that
+# only consume resources, so the solver can model them.
+_MODELED_CONSTRAINTS = (
+    constraintslib.MinResourcePerNode,
+    constraintslib.NodeResourceConstraint,
+    constraintslib.NodePropertyConstraint,
+)
+
+
+def vcpu_cost(bucket: NodeBucket) -> float:
+    return float(bucket.vcpu_count)
+
+
+def can_solve(job: "Job") -> bool:
+    """
+    Only jobs with a slot count whose constraints are plain resource requests and
+    node filters. Colocated, scatter and exclusive jobs are always greedy.
+    """
+    from hpc.autoscale.job.job import PackingStrategy
+
+    if job.node_count > 0 or job.colocated:
+        return False
+    if job.packing_strategy == PackingStrategy.SCATTER:
+        return False
+    return all(_is_modeled(c) for c in job._constraints)
+
+
+def _is_modeled(constraint: constraintslib.NodeConstraint) -> bool:
+    if isinstance(constraint, constraintslib.And):
+        return all(_is_modeled(c) for c in constraint.get_children())
+    return isinstance(constraint, _MODELED_CONSTRAINTS)
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class _Demand:
+    """
+    The slots of every job with the same resource requests and candidate buckets,
+    packed as one, in submission order.
+    """
+
+    def __init__(
+        self, index: int, requests: Dict[str, float], buckets: List[NodeBucket],
+    ) -> None:
+        self.index = index
+        self.requests = requests
+        self.buckets = buckets
+        self.jobs: List[Tuple["Job", int]] = []
+        self.slots = 0
+
+    def add_job(self, job: "Job", slots: int) -> None:
+        self.jobs.append((job, slots))
+        self.slots += slots
+
+
+class _Bin:
+    """A new node, as the slots placed on it and what it has left."""
+
+    def __init__(self, bucket: NodeBucket, capacity: Dict[str, float]) -> None:
+        self.bucket = bucket
+        self.capacity = capacity
+        self.remaining = dict(capacity)
+        self.slots: Dict[int, int] = {}
+        self.share_left = self._share_left()
+
+    def fit(self, demand: _Demand) -> int:
+        return _fit(self.remaining, demand.requests, demand.slots)
+
+    def add(self, demand: _Demand, count: int) -> None:
+        for attr, value in demand.requests.items():
+            self.remaining[attr] = self.remaining.get(attr, 0.0) - value * count
+        self.slots[demand.index] = self.slots.get(demand.index, 0) + count
+        self.share_left = self._share_left()
+
+    def is_full(self, smallest: Dict[str, float]) -> bool:
+        """No demand fits, as every one requests at least smallest."""
+        return _fit(self.remaining, smallest, 1) <= 0
+
+    def _share_left(self) -> float:
+        return sum(
+            self.remaining.get(attr, 0.0) / total
+            for attr, total in self.capacity.items()
+            if total > 0
+        )
+
+
+def _fit(remaining: Dict[str, float], requests: Dict[str, float], slots: int) -> int:
+    ret = slots
+    for attr, value in requests.items():
+        if value <= 0:
+            continue
+        # a little slack for floating point memory math
+        ret = min(ret, int(math.floor(remaining.get(attr, 0.0) / value + 1e-9)))
+        if ret <= 0:
+            return 0
+    return ret
+
+
+class _Limits:
+    """Counts the nodes a packing adds against each bucket's limits."""
+
+    def __init__(self) -> None:
+        self.bucket_counts: Dict[int, int] = {}
+        self.shared: Dict[int, Tuple[int, int]] = {}
+
+    def can_add(self, bucket: NodeBucket) -> bool:
+        if bucket.available_count - self.bucket_counts.get(id(bucket), 0) < 1:
+            return False
+
+        vcpu_count = bucket.vcpu_count
+        for limit in bucket.limits.shared_limits():
+            cores, nodes = self.shared.get(id(limit), (0, 0))
+            if cores + vcpu_count > _cores_left(limit):
+                return False
+            if nodes + 1 > limit._available_count(1):
+                return False
+        return True
+
+    def add(self, bucket: NodeBucket, count: int = 1) -> None:
+        self.bucket_counts[id(bucket)] = self.bucket_counts.get(id(bucket), 0) + count
+        for limit in bucket.limits.shared_limits():
+            cores, nodes = self.shared.get(id(limit), (0, 0))
+            self.shared[id(limit)] = (
+                cores + count * bucket.vcpu_count,
+                nodes + count,
+            )
+
+    def remove(self, bucket: NodeBucket) -> None:
+        self.add(bucket, -1)
+
+
+def _cores_left(limit: Union[_SharedLimit, _SpotLimit]) -> int:
+    return limit._max_core_count - limit._consumed_core_count
+
+
+@hpcwrapclass
+class PackingPlan:
+    def __init__(
+        self, bins: List[_Bin], order: List[_Demand], cost: float, unplaced: int,
+    ) -> None:
+        self.__bins = bins
+        self.__order = order
+        self.cost = cost
+        self.unplaced = unplaced
+
+    @property
+    def node_count(self) -> int:
+        return len(self.__bins)
+
+    def bucket_counts(self) -> Dict[ht.BucketId, int]:
+        ret: Dict[ht.BucketId, int] = {}
+        for b in self.__bins:
+            ret[b.bucket.bucket_id] = ret.get(b.bucket.bucket_id, 0) + 1
+        return ret
+
+    def assignments(self) -> List[Tuple[NodeBucket, "Job", int]]:
+        """
+        The slots of each job to allocate in each bucket, bucket by bucket and in
+        the order they were packed, so that allocating them best fit reproduces
+        the plan.
+        """
+        rank = {d.index: n for n, d in enumerate(self.__order)}
+        by_index = {d.index: d for d in self.__order}
+        by_bucket: Dict[int, Tuple[NodeBucket, Dict[int, int]]] = {}
+        for b in self.__bins:
+            _, slots = by_bucket.setdefault(id(b.bucket), (b.bucket, {}))
+            for index, count in b.slots.items():
+                slots[index] = slots.get(index, 0) + count
+
+        # the slots of a demand go to its jobs in submission order
+        job_slots = {d.index: [slots for _, slots in d.jobs] for d in self.__order}
+        ret = []
+        for bucket, slots in by_bucket.values():
+            for index in sorted(slots, key=lambda i: rank[i]):
+                count = slots[index]
+                left = job_slots[index]
+                for n, (job, _) in enumerate(by_index[index].jobs):
+                    taken = min(count, left[n])
+                    if taken > 0:
+                        ret.append((bucket, job, taken))
+                        left[n] -= taken
+                        count -= taken
+        return ret
+
+    def __str__(self) -> str:
+        return "PackingPlan(nodes={}, cost={}, unplaced={})".format(
+            self.node_count, self.cost, self.unplaced
+        )
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+@hpcwrapclass
+class PackingSolver:
+    def __init__(
+        self,
+        time_budget: float = 1.0,
+        cost: Optional[BucketCost] = None,
+        seed: int = 0,
+        max_attempts: int = 16,
+    ) -> None:
+        """
+        time_budget is in seconds. cost is the cost of a new node of the bucket,
+        vcpu_cost by default.
+        """
+        self.time_budget = time_budget
+        self.cost: BucketCost = cost or vcpu_cost
+        self.seed = seed
+        self.max_attempts = max_attempts
+
+    def solve(
+        self, jobs: List["Job"], buckets: List[NodeBucket]
+    ) -> Optional[PackingPlan]:
+        deadline = time.monotonic() + self.time_budget
+        demands = self._demands(jobs, buckets)
+        if not demands:
+            return None
+
+        capacities = _capacities(demands)
+        smallest = _smallest_requests(demands)
+        costs = {id(b): self.cost(b) for d in demands for b in d.buckets}
+        largest: Dict[str, float] = {}
+        for capacity in capacities.values():
+            for attr, value in capacity.items():
+                largest[attr] = max(largest.get(attr, 0.0), value)
+
+        def dominant_share(d: _Demand) -> float:
+            return max(
+                [v / largest[a] for a, v in d.requests.items() if largest.get(a)]
+                or [0.0]
+            )
+
+        orderings: List[Callable[[_Demand], Tuple]] = [
+            lambda d: (-dominant_share(d), d.index),
+            lambda d: (-sum(d.requests.values()), d.index),
+            lambda d: (len(d.buckets), -dominant_share(d), d.index),
+        ]
+        for attr in sorted(largest):
+            orderings.append(_by_resource(attr))
+
+        rng = random.Random(self.seed)
+        best: Optional[PackingPlan] = None
+        attempt = 0
+        try:
+            while attempt < self.max_attempts:
+                if attempt < len(orderings):
+                    order = sorted(demands, key=orderings[attempt])
+                else:
+                    # dominant share, with a little noise
+                    noise = {d.index: rng.random() * 0.25 for d in demands}
+                    order = sorted(
+                        demands, key=lambda d: -dominant_share(d) - noise[d.index]
+                    )
+                attempt += 1
+
+                plan = self._pack(order, demands, capacities, costs, smallest, deadline)
+                if best is None or (plan.unplaced, plan.cost) < (
+                    best.unplaced,
+                    best.cost,
+                ):
+                    best = plan
+        except _OutOfTime:
+            if best is None:
+                logging.warning(
+                    "Packing solver ran out of time (%.2fs) before finding a packing"
+                    + " for %d jobs, falling back to greedy allocation.",
+                    self.time_budget,
+                    sum(len(d.jobs) for d in demands),
+                )
+                return None
+
+        logging.debug("Packing solver chose %s after %d attempts", best, attempt)
+        return best
+
+    def _demands(self, jobs: List["Job"], buckets: List[NodeBucket]) -> List[_Demand]:
+        candidates = [b for b in buckets if not b.placement_group]
+        # job arrays share their constraints, so only match each set once
+        matched: Dict[str, List[NodeBucket]] = {}
+        by_key: Dict[Tuple, _Demand] = {}
+        ret: List[_Demand] = []
+        for job in jobs:
+            if job.iterations_remaining <= 0:
+                continue
+            constraints_key = json.dumps(
+                [c.to_dict() for c in job._constraints], sort_keys=True, default=str
+            )
+            if constraints_key not in matched:
+                result = job.bucket_candidates(candidates)
+                matched[constraints_key] = result.candidates if result else []
+            job_buckets = matched[constraints_key]
+            if not job_buckets:
+                continue
+            requests = job.resource_requests()
+            key = (
+                tuple(sorted(requests.items())),
+                tuple(id(b) for b in job_buckets),
+            )
+            if key not in by_key:
+                by_key[key] = _Demand(len(ret), requests, job_buckets)
+                ret.append(by_key[key])
+            by_key[key].add_job(job, job.iterations_remaining)
+        return ret
+
+    def _pack(
+        self,
+        order: List[_Demand],
+        demands: List[_Demand],
+        capacities: Dict[int, Dict[str, float]],
+        costs: Dict[int, float],
+        smallest: Dict[str, float],
+        deadline: float,
+    ) -> PackingPlan:
+        limits = _Limits()
+        bins: List[_Bin] = []
+        # nodes that some demand could still fit on
+        open_by_bucket: Dict[int, List[_Bin]] = {}
+        unplaced = 0
+
+        # the resources still to be placed that each bucket could host
+        pending: Dict[int, Dict[str, float]] = {}
+        for demand in demands:
+            _add_pending(pending, demand, demand.slots)
+
+        for demand in order:
+            if time.monotonic() > deadline:
+                raise _OutOfTime()
+
+            remaining = demand.slots
+            open_bins = [
+                b
+                for bucket in demand.buckets
+                for b in open_by_bucket.get(id(bucket), [])
+            ]
+            # best fit - the fullest node first
+            open_bins.sort(key=lambda b: b.share_left)
+            filled = set()
+            for b in open_bins:
+                count = min(remaining, b.fit(demand))
+                if count > 0:
+                    b.add(demand, count)
+                    _add_pending(pending, demand, -count)
+                    remaining -= count
+                    if b.is_full(smallest):
+                        filled.add(id(b.bucket))
+                    if remaining <= 0:
+                        break
+
+            for bucket_id in filled:
+                open_by_bucket[bucket_id] = [
+                    b for b in open_by_bucket[bucket_id] if not b.is_full(smallest)
+                ]
+
+            while remaining > 0:
+                bucket = self._cheapest_bucket(
+                    demand, remaining, capacities, costs, limits, pending
+                )
+                if bucket is None:
+                    unplaced += remaining
+                    _add_pending(pending, demand, -remaining)
+                    break
+                new_bin = _Bin(bucket, capacities[id(bucket)])
+                count = min(remaining, new_bin.fit(demand))
+                new_bin.add(demand, count)
+                _add_pending(pending, demand, -count)
+                remaining -= count
+                limits.add(bucket)
+                bins.append(new_bin)
+                if not new_bin.is_full(smallest):
+                    open_by_bucket.setdefault(id(bucket), []).append(new_bin)
+
+        self._right_size(bins, demands, capacities, costs, limits, deadline)
+        cost = sum(costs[id(b.bucket)] for b in bins)
+        return PackingPlan(bins, order, cost, unplaced)
+
+    def _cheapest_bucket(
+        self,
+        demand: _Demand,
+        remaining: int,
+        capacities: Dict[int, Dict[str, float]],
+        costs: Dict[int, float],
+        limits: _Limits,
+        pending: Dict[int, Dict[str, float]],
+    ) -> Optional[NodeBucket]:
+        """
+        The lowest cost per slot, counting the slots of this job a new node would
+        hold if the other pending jobs it could host were just like this one. Ties
+        go to the bigger node, then to bucket weight order.
+        """
+        best: Optional[NodeBucket] = None
+        best_key = (0.0, 0)
+        for bucket in demand.buckets:
+            if not limits.can_add(bucket):
+                continue
+            capacity = capacities[id(bucket)]
+            expected = max(
+                remaining, _fit(pending[id(bucket)], demand.requests, 2 ** 31)
+            )
+            per_node = _fit(capacity, demand.requests, expected)
+            if per_node <= 0:
+                continue
+            key = (costs[id(bucket)] / per_node, -per_node)
+            if best is None or key < best_key:
+                best = bucket
+                best_key = key
+        return best
+
+    def _right_size(
+        self,
+        bins: List[_Bin],
+        demands: List[_Demand],
+        capacities: Dict[int, Dict[str, float]],
+        costs: Dict[int, float],
+        limits: _Limits,
+        deadline: float,
+    ) -> None:
+        """Moves every node to the cheapest bucket that still holds its slots."""
+        for b in bins:
+            if time.monotonic() > deadline:
+                return
+
+            eligible: Optional[List[NodeBucket]] = None
+            for index in b.slots:
+                buckets = demands[index].buckets
+                eligible = (
+                    list(buckets)
+                    if eligible is None
+                    else [e for e in eligible if e in buckets]
+                )
+
+            current_cost = costs[id(b.bucket)]
+            limits.remove(b.bucket)
+            for bucket in eligible or []:
+                if costs[id(bucket)] >= current_cost or not limits.can_add(bucket):
+                    continue
+                capacity = capacities[id(bucket)]
+                used = {
+                    attr: b.capacity.get(attr, 0.0) - b.remaining.get(attr, 0.0)
+                    for attr in b.capacity
+                }
+                if all(used[attr] <= capacity.get(attr, 0.0) + 1e-9 for attr in used):
+                    b.bucket = bucket
+                    b.capacity = capacity
+                    b.remaining = {
+                        attr: capacity.get(attr, 0.0) - used.get(attr, 0.0)
+                        for attr in capacity
+                    }
+                    current_cost = costs[id(bucket)]
+            limits.add(b.bucket)
+
+
+def _add_pending(
+    pending: Dict[int, Dict[str, float]], demand: _Demand, slots: int
+) -> None:
+    for bucket in demand.buckets:
+        bucket_pending = pending.setdefault(id(bucket), {})
+        for attr, value in demand.requests.items():
+            bucket_pending[attr] = bucket_pending.get(attr, 0.0) + value * slots
+
+
+def _smallest_requests(demands: List[_Demand]) -> Dict[str, float]:
+    """What every demand requests at least, per resource."""
+    ret = dict(demands[0].requests)
+    for d in demands[1:]:
+        ret = {
+            attr: min(value, d.requests.get(attr, 0.0)) for attr, value in ret.items()
+        }
+    return {attr: value for attr, value in ret.items() if value > 0}
+
+
+def _by_resource(attr: str) -> Callable[[_Demand], Tuple]:
+    return lambda d: (-d.requests.get(attr, 0.0), d.index)
+
+
+def _capacities(demands: List[_Demand]) -> Dict[int, Dict[str, float]]:
+    attrs = sorted({attr for d in demands for attr in d.requests})
+    ret: Dict[int, Dict[str, float]] = {}
+    for d in demands:
+        for bucket in d.buckets:
+            if id(bucket) in ret:
+                continue
+            available = bucket.example_node.available
+            capacity = {}
+            for attr in attrs:
+                value = available.get(attr)
+                if isinstance(value, bool) or not isinstance(
+                    value, (int, float, ht.Memory)
+                ):
+                    value = 0
+                capacity[attr] = float(value)
+            ret[id(bucket)] = capacity
+    return ret
+
+
+def new_packing_solver(config: Union[bool, Dict]) -> PackingSolver:
+    """
+    From the packing_solver section of the autoscale config, i.e.
+
+        "packing_solver": {"time_budget": 2.0, "cost_weights": {"Standard_NC24": 4}}
+
+    A cost weight multiplies the vcpu count of a vm size or nodearray, default 1.
+    """
+    if not isinstance(config, dict):
+        config = {}
+
+    weights: Dict[str, float] = config.get("cost_weights", {})
+
+    def weighted_vcpu_cost(bucket: NodeBucket) -> float:
+        weight = weights.get(bucket.vm_size, weights.get(bucket.nodearray, 1.0))
+        return float(bucket.vcpu_count) * float(weight)
+
+    return PackingSolver(
+        time_budget=float(config.get("time_budget", 1.0)),
+        cost=weighted_vcpu_cost if weights else None,
+        seed=int(config.get("seed", 0)),
+    )
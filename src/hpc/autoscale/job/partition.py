@@ -0,0 +1,96 @@
+"""
+Splits a batch of jobs into groups that can be allocated independently of each
+other. Two buckets are in the same group if a job could run on both, or if they
+share a nodearray, vm family or placement group limit. Only the regional and
+cluster limits are shared between groups, so a DemandCalculator can allocate each
+group against its own copy of the buckets and reconcile those two limits after.
+"""
+from typing import Dict, List, Tuple
+
+from hpc.autoscale.codeanalysis import hpcwrapclass
+from hpc.autoscale.job.job import Job
+from hpc.autoscale.node.bucket import NodeBucket
+from hpc.autoscale.node.limits import _SpotLimit
+
+
+@hpcwrapclass
+class DemandPartition:
+    def __init__(self, buckets: List[NodeBucket], jobs: List[Job]) -> None:
+        self.buckets = buckets
+        self.jobs = jobs
+
+    def __str__(self) -> str:
+        return "DemandPartition(buckets={}, jobs={})".format(
+            len(self.buckets), len(self.jobs)
+        )
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+class _DisjointSets:
+    def __init__(self, size: int) -> None:
+        self.parents = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parents[i] != i:
+            self.parents[i] = self.parents[self.parents[i]]
+            i = self.parents[i]
+        return i
+
+    def union(self, a: int, b: int) -> None:
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parents[max(a, b)] = min(a, b)
+
+
+def partition_jobs(
+    jobs: List[Job], buckets: List[NodeBucket]
+) -> Tuple[List[DemandPartition], List[Job]]:
+    """
+    Returns the partitions, ordered by their first job, each with its jobs in the
+    order given, and the jobs that no bucket can run. Buckets no job can run are
+    left out.
+    """
+    index_of = {id(b): n for n, b in enumerate(buckets)}
+    sets = _DisjointSets(len(buckets))
+
+    first_by_limit: Dict[int, int] = {}
+    for n, bucket in enumerate(buckets):
+        limits = bucket.limits
+        shared = [limits._nodearray_limits, limits._placement_group_limits]
+        # spot family limits are the regional limit
+        if not isinstance(limits._family_limits, _SpotLimit):
+            shared.append(limits._family_limits)
+        for limit in shared:
+            if limit is None:
+                continue
+            sets.union(first_by_limit.setdefault(id(limit), n), n)
+
+    job_buckets: List[Tuple[Job, List[int]]] = []
+    unmatched: List[Job] = []
+    for job in jobs:
+        result = job.bucket_candidates(buckets)
+        if not result:
+            unmatched.append(job)
+            continue
+        indices = [index_of[id(b)] for b in result.candidates]
+        for i in indices[1:]:
+            sets.union(indices[0], i)
+        job_buckets.append((job, indices))
+
+    by_root: Dict[int, DemandPartition] = {}
+    ret: List[DemandPartition] = []
+    for job, indices in job_buckets:
+        root = sets.find(indices[0])
+        if root not in by_root:
+            by_root[root] = DemandPartition([], [])
+            ret.append(by_root[root])
+        by_root[root].jobs.append(job)
+
+    for n, bucket in enumerate(buckets):
+        root = sets.find(n)
+        if root in by_root:
+            by_root[root].buckets.append(bucket)
+
+    return ret, unmatched
@@ -1,6 +1,6 @@
 import typing
 from copy import deepcopy
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from immutabledict import ImmutableOrderedDict
 
@@ -8,6 +8,7 @@ from hpc.autoscale import hpctypes as ht
 from hpc.autoscale import util
 from hpc.autoscale.codeanalysis import hpcwrapclass
 from hpc.autoscale.node import constraints as constraintslib  # noqa: F401
+from hpc.autoscale.node import undolog
 from hpc.autoscale.node.delayednodeid import DelayedNodeId
 from hpc.autoscale.node.limits import BucketLimits
 from hpc.autoscale.results import CandidatesResult, Result
@@ -17,6 +18,65 @@ if typing.TYPE_CHECKING:
     from hpc.autoscale.node.node import Node
 
 
+class _NodeList(list):
+    """
+    The nodes of a bucket. Every change bumps version, so an index over them, like
+    CapacityIndex, knows it is stale even when a node was replaced by another. So
+    does any resource an indexed node gains, see node._AvailableResources.
+    """
+
+    # copies are built without calling __init__
+    version = 0
+
+    def __changed(self) -> None:
+        self.version += 1
+
+    def append(self, node: "Node") -> None:
+        list.append(self, node)
+        self.__changed()
+
+    def extend(self, nodes: typing.Iterable["Node"]) -> None:
+        list.extend(self, nodes)
+        self.__changed()
+
+    def insert(self, index: int, node: "Node") -> None:  # type: ignore
+        list.insert(self, index, node)
+        self.__changed()
+
+    def remove(self, node: "Node") -> None:
+        list.remove(self, node)
+        self.__changed()
+
+    def pop(self, index: int = -1) -> "Node":  # type: ignore
+        self.__changed()
+        return list.pop(self, index)
+
+    def clear(self) -> None:
+        list.clear(self)
+        self.__changed()
+
+    def sort(self, *args: Any, **kwargs: Any) -> None:
+        list.sort(self, *args, **kwargs)
+        self.__changed()
+
+    def reverse(self) -> None:
+        list.reverse(self)
+        self.__changed()
+
+    def __setitem__(self, index: Any, value: Any) -> None:
+        list.__setitem__(self, index, value)
+        self.__changed()
+
+    def __delitem__(self, index: Any) -> None:
+        list.__delitem__(self, index)
+        self.__changed()
+
+    def __iadd__(self, nodes: typing.Iterable["Node"]) -> "_NodeList":  # type: ignore
+        list.extend(self, nodes)
+        self.__changed()
+        return self
+
+
 @hpcwrapclass
 class NodeDefinition:
     """
@@ -127,11 +187,20 @@ class NodeBucket:
             keep_alive=False,
         )
 
+    @property
+    def nodes(self) -> List["Node"]:
+        return self.__nodes
+
+    @nodes.setter
+    def nodes(self, nodes: List["Node"]) -> None:
+        self.__nodes = nodes if isinstance(nodes, _NodeList) else _NodeList(nodes)
+
     def decrement(self, count: int = 1) -> None:
         assert (
             self.available_count - count >= 0
         ), "Requested too many nodes: %s > %s" % (count, self.available_count)
         assert self.family_available_count >= 0
+        undolog.touch(self)
         self.__decrement_counter += count
         # self.limits.decrement(self.vcpu_count, count)
 
@@ -139,32 +208,26 @@ class NodeBucket:
         return self.decrement(-count)
 
     def commit(self) -> None:
+        undolog.touch(self)
         to_dec = self.__decrement_counter
         self.__decrement_counter = 0
         self.limits.decrement(to_dec)
 
     def rollback(self) -> None:
+        undolog.touch(self)
         self.__decrement_counter = 0
 
+    def _state(self) -> Tuple[int, int]:
+        return (self.__decrement_counter, len(self.nodes))
+
+    def _restore(self, state: Tuple[int, int]) -> None:
+        self.__decrement_counter, node_count = state
+        # add_nodes only appends
+        del self.nodes[node_count:]
+
     @property
     def available_count(self) -> int:
-        # non-pg buckets return -1
-        pg_available = self.limits.placement_group_available_count
-
-        if pg_available < 0:
-            pg_available = 2 ** 32
-
-        return (
-            min(
-                self.limits.available_count,
-                self.limits.regional_available_count,
-                self.limits.cluster_available_count,
-                self.limits.nodearray_available_count,
-                self.limits.family_available_count,
-                pg_available,
-            )
-            - self.__decrement_counter
-        )
+        return self.limits.min_available_count - self.__decrement_counter
 
     @available_count.setter
     def available_count(self, value: int) -> None:
@@ -244,6 +307,7 @@ class NodeBucket:
         return self.__definition.software_configuration
 
     def add_nodes(self, nodes: List["Node"]) -> None:
+        undolog.touch(self)
         new_by_id = partition(nodes, lambda n: n.delayed_node_id.transient_id)
         cur_by_id = partition(self.nodes, lambda n: n.delayed_node_id.transient_id)
 
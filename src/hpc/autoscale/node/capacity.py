@@ -0,0 +1,305 @@
+"""
+An index of the most of each resource any of a bucket's nodes has left, so
+NodeManager can skip the nodes that can not satisfy the MinResourcePerNode
+constraints of a request, and stop scanning once none of the rest can. An index
+of how many nodes each placement group can still hold, so colocated requests go
+straight to one that fits. Also the results of NodeManager.query_capacity.
+"""
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from hpc.autoscale.codeanalysis import hpcwrapclass
+from hpc.autoscale.node import constraints as constraintslib
+from hpc.autoscale.node.bucket import NodeBucket
+from hpc.autoscale.node.node import Node, _AvailableResources
+
+_NEGATIVE_INF = float("-inf")
+_INF = float("inf")
+
+
+class CapacityIndex:
+    """
+    A max segment tree over the nodes, per resource, built on first use. Values
+    may only be too high, never too low: decrements leave them as they are until
+    update is called, and any node gaining a resource makes the index stale.
+
+    Staleness is tracked by the version of the nodes, so they have to be a
+    bucket's nodes (see NodeBucket.nodes), not a plain list.
+    """
+
+    def __init__(self, nodes: List[Node]) -> None:
+        self.nodes = nodes
+        self.size = len(nodes)
+        self.__leaves = 1
+        while self.__leaves < self.size:
+            self.__leaves *= 2
+        self.__positions = {id(n): i for i, n in enumerate(nodes)}
+        self.__trees: Dict[str, List[float]] = {}
+
+        self.version = _nodes_version(nodes)
+        if self.version is not None:
+            for node in nodes:
+                if isinstance(node.available, _AvailableResources):
+                    node.available._nodes = nodes
+
+    def is_current(self, nodes: List[Node]) -> bool:
+        return (
+            nodes is self.nodes
+            and len(nodes) == self.size
+            and _nodes_version(nodes) == self.version
+        )
+
+    def candidates(self, requests: Dict[str, float]) -> Iterator[Node]:
+        """The nodes, in order, that may have at least the requested amounts left"""
+        if not requests:
+            yield from self.nodes
+            return
+
+        trees = [(self._tree(attr), value) for attr, value in requests.items()]
+        stack = [1]
+        while stack:
+            i = stack.pop()
+            if any(tree[i] < value for tree, value in trees):
+                continue
+            if i >= self.__leaves:
+                position = i - self.__leaves
+                if position < self.size:
+                    yield self.nodes[position]
+                continue
+            stack.append(2 * i + 1)
+            stack.append(2 * i)
+
+    def update(self, node: Node) -> None:
+        """Call after the node's resources went down"""
+        position = self.__positions.get(id(node))
+        if position is None:
+            return
+        for attr, tree in self.__trees.items():
+            i = position + self.__leaves
+            tree[i] = _value(node, attr)
+            i //= 2
+            while i:
+                tree[i] = max(tree[2 * i], tree[2 * i + 1])
+                i //= 2
+
+    def _tree(self, attr: str) -> List[float]:
+        if attr not in self.__trees:
+            tree = [_NEGATIVE_INF] * (2 * self.__leaves)
+            for n, node in enumerate(self.nodes):
+                tree[self.__leaves + n] = _value(node, attr)
+            for i in range(self.__leaves - 1, 0, -1):
+                tree[i] = max(tree[2 * i], tree[2 * i + 1])
+            self.__trees[attr] = tree
+        return self.__trees[attr]
+
+    def __str__(self) -> str:
+        return "CapacityIndex(nodes={}, resources={})".format(
+            self.size, list(self.__trees.keys())
+        )
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+class PlacementGroupIndex:
+    """
+    The placement group buckets of one bucket_id, ordered by how many more nodes
+    each could hold on its own: the fewest its bucket and placement group limits
+    allow, plus its unallocated nodes. The regional, cluster, family etc. limits
+    are the same for all of them, so checking those is left to the caller.
+    """
+
+    def __init__(self, buckets: List[NodeBucket]) -> None:
+        self.buckets = buckets
+        # per bucket, (signature, key) as of when it was keyed
+        self.__entries: List[
+            Tuple[Tuple[int, int, int, Optional[int]], Tuple[int, int]]
+        ] = []
+        for position, bucket in enumerate(buckets):
+            self.__entries.append(
+                (_signature(bucket), (_own_capacity(bucket), position))
+            )
+        # sorted (capacity, position)
+        self.__keys = sorted(entry[1] for entry in self.__entries)
+
+    def fits(self, count: int) -> Iterator[NodeBucket]:
+        """
+        The buckets that may hold count more nodes, tightest first. Lazy, so the
+        first costs a bisect. Calling fits again re-keys, so stop iterating this.
+        """
+        self.__rekey()
+        keys = self.__keys
+        for i in range(bisect_left(keys, (count, -1)), len(keys)):
+            yield self.buckets[keys[i][1]]
+
+    def __rekey(self) -> None:
+        # any change to a bucket's own limits, including a rollback, gives them
+        # a new version
+        for position, bucket in enumerate(self.buckets):
+            signature = _signature(bucket)
+            old_signature, old_key = self.__entries[position]
+            if signature == old_signature:
+                continue
+            del self.__keys[bisect_left(self.__keys, old_key)]
+            key = (_own_capacity(bucket), position)
+            insort(self.__keys, key)
+            self.__entries[position] = (signature, key)
+
+    def __str__(self) -> str:
+        return "PlacementGroupIndex(buckets={})".format(len(self.buckets))
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+def _signature(bucket: NodeBucket) -> Tuple[int, int, int, Optional[int]]:
+    pg_limits = bucket.limits._placement_group_limits
+    return (
+        bucket.limits._version,
+        pg_limits._version if pg_limits else 0,
+        len(bucket.nodes),
+        _nodes_version(bucket.nodes),
+    )
+
+
+def _own_capacity(bucket: NodeBucket) -> int:
+    count = bucket.limits.available_count
+    pg_available = bucket.limits.placement_group_available_count
+    if pg_available >= 0:
+        count = min(count, pg_available)
+    return max(count, 0) + sum(1 for n in bucket.nodes if not n._allocated)
+
+
+@hpcwrapclass
+class BucketCapacity:
+    """
+    How many slots fit on the existing nodes of a bucket, and how many new nodes
+    it can still add, each fitting slots_per_new_node slots.
+    """
+
+    def __init__(
+        self,
+        bucket: NodeBucket,
+        existing_slots: int,
+        slots_per_new_node: int,
+        new_node_count: int,
+    ) -> None:
+        self.bucket = bucket
+        self.existing_slots = existing_slots
+        self.slots_per_new_node = slots_per_new_node
+        self.new_node_count = new_node_count
+
+    @property
+    def new_slots(self) -> int:
+        return self.slots_per_new_node * self.new_node_count
+
+    @property
+    def total_slots(self) -> int:
+        return self.existing_slots + self.new_slots
+
+    def __str__(self) -> str:
+        return "BucketCapacity({}, {}, existing_slots={}, new_nodes={}x{})".format(
+            self.bucket.nodearray,
+            self.bucket.vm_size,
+            self.existing_slots,
+            self.new_node_count,
+            self.slots_per_new_node,
+        )
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+@hpcwrapclass
+class CapacityEstimate:
+    """
+    Per candidate bucket, in the order allocate would use them. New nodes of one
+    bucket count against the regional, cluster, family etc. limits of the rest.
+    With a slot_count, only the slots and new nodes needed for it are counted.
+    """
+
+    def __init__(
+        self, buckets: List[BucketCapacity], slot_count: Optional[int] = None
+    ) -> None:
+        self.buckets = buckets
+        self.slot_count = slot_count
+
+    @property
+    def existing_slots(self) -> int:
+        return sum(b.existing_slots for b in self.buckets)
+
+    @property
+    def new_node_count(self) -> int:
+        return sum(b.new_node_count for b in self.buckets)
+
+    @property
+    def total_slots(self) -> int:
+        return sum(b.total_slots for b in self.buckets)
+
+    def __bool__(self) -> bool:
+        if self.slot_count is None:
+            return self.total_slots > 0
+        return self.total_slots >= self.slot_count
+
+    def __str__(self) -> str:
+        return "CapacityEstimate(slots={}, new_nodes={}, buckets={})".format(
+            self.total_slots, self.new_node_count, self.buckets
+        )
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+def minimum_requests(
+    constraints: Iterable[constraintslib.NodeConstraint],
+) -> Dict[str, float]:
+    """
+    The least of each resource a node needs left to satisfy the numeric
+    MinResourcePerNode constraints, including those in an And. Or and XOr are
+    ignored, as which of their children applies depends on the node.
+    """
+    ret: Dict[str, float] = {}
+    for constraint in constraints:
+        if isinstance(constraint, constraintslib.MinResourcePerNode):
+            value = constraint.value
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                ret[constraint.attr] = max(ret.get(constraint.attr, value), value)
+        elif isinstance(constraint, constraintslib.And):
+            for attr, value in minimum_requests(constraint.get_children()).items():
+                ret[attr] = max(ret.get(attr, value), value)
+    return ret
+
+
+def only_resources(constraints: Iterable[constraintslib.NodeConstraint]) -> bool:
+    """
+    Whether minimum_space alone says if a node satisfies the constraints, as
+    they only ask for a positive amount of some resources.
+    """
+    for constraint in constraints:
+        if not isinstance(constraint, constraintslib.MinResourcePerNode):
+            return False
+        value = constraint.value
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return False
+        if value <= 0:
+            return False
+    return True
+
+
+def _nodes_version(nodes: List[Node]) -> Optional[int]:
+    # a bucket's nodes count their changes, see NodeBucket.nodes
+    return getattr(nodes, "version", None)
+
+
+def _value(node: Node, attr: str) -> float:
+    if node.closed:
+        return _NEGATIVE_INF
+    # nothing tells the index when this node gains resources
+    if not isinstance(node.available, _AvailableResources):
+        return _INF
+    value = node.available.get(attr)
+    if value is None:
+        return _NEGATIVE_INF
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return _INF
@@ -39,6 +39,16 @@ class NodeConstraint(ABC):
     def do_decrement(self, node: "Node") -> bool:
         raise RuntimeError()
 
+    def do_decrement_n(self, node: "Node", count: int) -> bool:
+        """
+        Equivalent to calling do_decrement count times, stopping at the first
+        failure. Override this when the constraint can decrement in a single step.
+        """
+        for _ in range(count):
+            if not self.do_decrement(node):
+                return False
+        return True
+
     def minimum_space(self, node: "Node") -> int:
         return -1
 
@@ -209,6 +219,33 @@ class MinResourcePerNode(BaseNodeConstraint):
         node.available[self.attr] = remaining - self.value
         return True
 
+    def do_decrement_n(self, node: "Node", count: int) -> bool:
+        if count <= 0:
+            return True
+
+        if isinstance(self.value, float):
+            # repeated float subtraction does not always equal a single subtraction
+            # of the product, so keep the exact semantics.
+            return super().do_decrement_n(node, count)
+
+        if self.attr not in node.available:
+            msg = "Resource[name={}] not in Node[name={}, hostname={}] for constraint {}".format(
+                self.attr, node.name, node.hostname, str(self)
+            )
+            raise RuntimeError(msg)
+
+        remaining = node.available[self.attr]
+        total = self.value * count
+
+        if remaining < total:
+            raise RuntimeError(
+                "Attempted to allocate more {} than is available for {}: {} < {} ({} x {})".format(
+                    self.attr, node.name, remaining, total, count, str(self),
+                )
+            )
+        node.available[self.attr] = remaining - total
+        return True
+
     def minimum_space(self, node: "Node") -> int:
         if self.attr not in node.available:
             return 0
@@ -269,6 +306,12 @@ class ExclusiveNode(BaseNodeConstraint):
             node.closed = True
         return True
 
+    def do_decrement_n(self, node: "Node", count: int) -> bool:
+        # only the first decrement changes the node
+        if count <= 0:
+            return True
+        return self.do_decrement(node)
+
     def minimum_space(self, node: "Node") -> int:
         assert self.assignment_id
         assert node.vcpu_count > 0
@@ -306,6 +349,11 @@ class InAPlacementGroup(BaseNodeConstraint):
     def do_decrement(self, node: "Node") -> bool:
         return bool(node.placement_group)
 
+    def do_decrement_n(self, node: "Node", count: int) -> bool:
+        if count <= 0:
+            return True
+        return self.do_decrement(node)
+
     def to_dict(self) -> dict:
         return ConstraintDict({"class": InAPlacementGroup.__class__.__name__})
 
@@ -361,6 +409,19 @@ class Or(BaseNodeConstraint):
 
         return False
 
+    def do_decrement_n(self, node: "Node", count: int) -> bool:
+        if count <= 0:
+            return True
+
+        for c in self.constraints:
+            if c.satisfied_by_node(node):
+                # the same child will be chosen every time as long as it has room
+                if _has_space_for(c, node, count):
+                    return c.do_decrement_n(node, count)
+                break
+
+        return super().do_decrement_n(node, count)
+
     def minimum_space(self, node: "Node") -> int:
         for c in self.constraints:
             result = c.satisfied_by_node(node)
@@ -433,6 +494,21 @@ class XOr(BaseNodeConstraint):
 
         return False
 
+    def do_decrement_n(self, node: "Node", count: int) -> bool:
+        if count <= 0:
+            return True
+
+        matched = [c for c in self.constraints if c.satisfied_by_node(node)]
+        if len(matched) > 1:
+            raise AssertionError(
+                "XOr expression is invalid but do_decrement_n was still called."
+            )
+
+        if matched and _has_space_for(matched[0], node, count):
+            return matched[0].do_decrement_n(node, count)
+
+        return super().do_decrement_n(node, count)
+
     def minimum_space(self, node: "Node") -> int:
         xor_result: Optional[SatisfiedResult] = None
         successful_constraint: Optional[NodeConstraint] = None
@@ -486,6 +562,19 @@ class And(BaseNodeConstraint):
                 assert c.do_decrement(node)
         return True
 
+    def do_decrement_n(self, node: "Node", count: int) -> bool:
+        for c in self.constraints:
+            if c.satisfied_by_node(node) and _has_space_for(c, node, count):
+                assert c.do_decrement_n(node, count)
+                continue
+
+            # like do_decrement, skip the child once it is no longer satisfied
+            for _ in range(count):
+                if not c.satisfied_by_node(node):
+                    break
+                assert c.do_decrement(node)
+        return True
+
     def get_children(self) -> Iterable[NodeConstraint]:
         return self.constraints
 
@@ -681,6 +770,11 @@ class ReadOnlyAlias(BaseNodeConstraint):
         node.available[self.alias] = node.resources[self.resource_name]
         return True
 
+    def do_decrement_n(self, node: "Node", count: int) -> bool:
+        if count <= 0:
+            return True
+        return self.do_decrement(node)
+
     def minimum_space(self, node: "Node") -> int:
         return -1
 
@@ -691,6 +785,28 @@ class ReadOnlyAlias(BaseNodeConstraint):
         return {"class": self.__class__.__name__, self.alias: self.resource_name}
 
 
+def _has_space_for(constraint: NodeConstraint, node: "Node", count: int) -> bool:
+    space = constraint.minimum_space(node)
+    return space == -1 or space >= count
+
+
+def get_resource_requests(constraints: Iterable[NodeConstraint]) -> Dict[str, float]:
+    """
+    The amount of each resource a single slot consumes, with memory in bytes.
+    Or and XOr are ignored, as which of their children applies depends on the node.
+    """
+    ret: Dict[str, float] = {}
+    for constraint in constraints:
+        if isinstance(constraint, MinResourcePerNode):
+            ret[constraint.attr] = ret.get(constraint.attr, 0.0) + float(
+                constraint.value
+            )
+        elif isinstance(constraint, And):
+            for attr, value in get_resource_requests(constraint.get_children()).items():
+                ret[attr] = ret.get(attr, 0.0) + value
+    return ret
+
+
 def _parse_node_property_constraint(
     attr: str, value: Union[ResourceType, Constraint]
 ) -> NodePropertyConstraint:
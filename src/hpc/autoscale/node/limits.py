@@ -1,6 +1,12 @@
-from typing import Optional, Union
+from itertools import count
+from typing import Dict, List, Optional, Tuple, Union
 
 from hpc.autoscale import hpclogging as logging
+from hpc.autoscale.node import undolog
+
+# every change to a limit takes a new version from here, so a version is never
+# seen twice, even after a restore. See BucketLimits.min_available_count
+_VERSIONS = count(1)
 
 
 class _SharedLimit:
@@ -37,6 +43,7 @@ class _SharedLimit:
 
         self.__max_count = max_count
         self.__consumed_count = consumed_count
+        self._version = next(_VERSIONS)
 
     def _max_count(self, core_count: int) -> int:
         ret = int(self._max_core_count / core_count)
@@ -47,13 +54,22 @@ class _SharedLimit:
     def _active_count(self, core_count: int) -> int:
         return self._max_count(core_count) - self._available_count(core_count)
 
-    def _available_count(self, core_count: int) -> int:
+    def _available_count(self, core_count: int, nodes: int = 0, cores: int = 0) -> int:
+        """nodes and cores are consumed on top of what already is, see query_capacity"""
         # do not round down, round up
-        ret = (self._max_core_count - self._consumed_core_count) // core_count
+        ret = (self._max_core_count - self._consumed_core_count - cores) // core_count
         if self.__max_count is not None and self.__consumed_count is not None:
-            return min(ret, self.__max_count - self.__consumed_count)
+            return min(ret, self.__max_count - self.__consumed_count - nodes)
         return ret
 
+    def _has_room(self, nodes: int, cores: int) -> bool:
+        """Whether nodes, of any vm sizes, with cores in total still fit."""
+        if self._consumed_core_count + cores > self._max_core_count:
+            return False
+        if self.__max_count is not None and self.__consumed_count is not None:
+            return self.__consumed_count + nodes <= self.__max_count
+        return True
+
     def _decrement(self, nodes: int, cores_per_node: int) -> None:
         new_core_count = self._consumed_core_count + (nodes * cores_per_node)
         if new_core_count > self._max_core_count:
@@ -66,9 +82,12 @@ class _SharedLimit:
                     self._max_core_count,
                 )
             )
-        new_node_count = self._consumed_core_count / cores_per_node + nodes
-
-        if new_node_count > self._max_count(cores_per_node):
+        # without a node count limit, the core count check above is the limit. Any
+        # estimate of the node count from the cores is wrong for mixed vm sizes.
+        if (
+            self.__consumed_count is not None
+            and self.__consumed_count + nodes > self._max_count(cores_per_node)
+        ):
             raise RuntimeError(
                 "OutOfCapacity: Asked for {} * {} nodes, which would be over the {} limit ({}/{})".format(
                     nodes,
@@ -83,6 +102,19 @@ class _SharedLimit:
         if self.__max_count is not None and self.__consumed_count is not None:
             assert self.__consumed_count + nodes <= self.__max_count
             self.__consumed_count += nodes
+        self._version = next(_VERSIONS)
+
+    def _state(self) -> Tuple[int, Optional[int]]:
+        return (self._consumed_core_count, self.__consumed_count)
+
+    def __setstate__(self, state: Dict) -> None:
+        # versions only have to be unique within a process
+        self.__dict__.update(state)
+        self._version = next(_VERSIONS)
+
+    def _restore(self, state: Tuple[int, Optional[int]]) -> None:
+        self._consumed_core_count, self.__consumed_count = state
+        self._version = next(_VERSIONS)
 
     def __str__(self) -> str:
         return "{}({}/{} cores)".format(
@@ -118,6 +150,10 @@ class _SpotLimit:
     def _consumed_core_count(self) -> int:
         return self._regional_limits._consumed_core_count
 
+    @property
+    def _version(self) -> int:
+        return self._regional_limits._version
+
     @property
     def _max_core_count(self) -> int:
         return self._regional_limits._max_core_count
@@ -194,11 +230,17 @@ class BucketLimits:
         assert max_count is not None
         self.__max_count = max_count
 
+        self._version = next(_VERSIONS)
+        # (versions of this and every shared limit, min_available_count)
+        self.__min_available: Optional[Tuple[Tuple[int, ...], int]] = None
+
     def decrement(self, count: int = 1) -> None:
+        undolog.touch(self, lambda: LimitsSnapshot([self]).restore)
         self.__active_core_count += count * self.__vcpu_count
         self.__active_count += count
         self.__available_core_count -= self.__vcpu_count * count
         self.__available_count -= count
+        self._version = next(_VERSIONS)
 
         self._regional_limits._decrement(count, self.__vcpu_count)
         self._cluster_limits._decrement(count, self.__vcpu_count)
@@ -210,6 +252,79 @@ class BucketLimits:
     def increment(self, count: int = 1) -> None:
         return self.decrement(-count)
 
+    def _versions(self) -> Tuple[int, ...]:
+        return (
+            self._version,
+            self._regional_limits._version,
+            self._cluster_limits._version,
+            self._nodearray_limits._version,
+            self._family_limits._version,
+            self._placement_group_limits._version
+            if self._placement_group_limits
+            else 0,
+        )
+
+    @property
+    def min_available_count(self) -> int:
+        """
+        The fewest nodes any of the limits allows. Cached until this bucket or one
+        of its shared limits changes.
+        """
+        versions = self._versions()
+        if self.__min_available is None or self.__min_available[0] != versions:
+            pg_available = self.placement_group_available_count
+            if pg_available < 0:
+                pg_available = 2 ** 32
+            self.__min_available = (
+                versions,
+                min(
+                    self.available_count,
+                    self.regional_available_count,
+                    self.cluster_available_count,
+                    self.nodearray_available_count,
+                    self.family_available_count,
+                    pg_available,
+                ),
+            )
+        return self.__min_available[1]
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._version = next(_VERSIONS)
+        self.__min_available = None
+
+    def _state(self) -> Tuple[int, int, int, int]:
+        return (
+            self.__active_core_count,
+            self.__active_count,
+            self.__available_core_count,
+            self.__available_count,
+        )
+
+    def _restore(self, state: Tuple[int, int, int, int]) -> None:
+        (
+            self.__active_core_count,
+            self.__active_count,
+            self.__available_core_count,
+            self.__available_count,
+        ) = state
+        self._version = next(_VERSIONS)
+
+    def shared_limits(self) -> List[Union[_SharedLimit, _SpotLimit]]:
+        """
+        The limits this bucket shares with others - regional, cluster, nodearray,
+        family and placement group.
+        """
+        ret: List[Union[_SharedLimit, _SpotLimit]] = [
+            self._regional_limits,
+            self._cluster_limits,
+            self._nodearray_limits,
+            self._family_limits,
+        ]
+        if self._placement_group_limits:
+            ret.append(self._placement_group_limits)
+        return ret
+
     @property
     def active_core_count(self) -> int:
         return self.__active_core_count
@@ -341,6 +456,29 @@ class BucketLimits:
         return str(self)
 
 
+class LimitsSnapshot:
+    """
+    The consumed counts of every limit of the given buckets. restore puts them
+    back, for what-if allocations. Nodes are not part of it.
+    """
+
+    def __init__(self, bucket_limits: List[BucketLimits]) -> None:
+        self.__bucket_states = [(limits, limits._state()) for limits in bucket_limits]
+        shared: Dict[int, _SharedLimit] = {}
+        for limits in bucket_limits:
+            for limit in limits.shared_limits():
+                # spot family limits are the regional limit
+                if isinstance(limit, _SharedLimit):
+                    shared[id(limit)] = limit
+        self.__shared_states = [(limit, limit._state()) for limit in shared.values()]
+
+    def restore(self) -> None:
+        for limits, state in self.__bucket_states:
+            limits._restore(state)
+        for limit, shared_state in self.__shared_states:
+            limit._restore(shared_state)
+
+
 def null_bucket_limits(num_nodes: int, vcpu_count: int) -> BucketLimits:
     cores = num_nodes * vcpu_count
     return BucketLimits(
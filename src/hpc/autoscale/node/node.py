@@ -2,7 +2,7 @@ import re
 from abc import ABC
 from copy import deepcopy
 from datetime import datetime
-from typing import Any, Callable, Dict, List, Optional, Set
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from uuid import uuid4
 
 from immutabledict import ImmutableOrderedDict
@@ -10,7 +10,7 @@ from immutabledict import ImmutableOrderedDict
 import hpc.autoscale.hpclogging as logging
 from hpc.autoscale import hpctypes as ht
 from hpc.autoscale.codeanalysis import hpcwrap
-from hpc.autoscale.node import vm_sizes
+from hpc.autoscale.node import undolog, vm_sizes
 from hpc.autoscale.node.constraints import NodeConstraint
 from hpc.autoscale.node.delayednodeid import DelayedNodeId
 from hpc.autoscale.results import MatchResult
@@ -34,6 +34,44 @@ def nodeproperty(function: Callable) -> property:
     return property(function)
 
 
+class _AvailableResources(dict):
+    """
+    Node.available. Once a CapacityIndex covers the node, any resource it gains
+    bumps the version of the indexed bucket nodes, so that only that index knows
+    it may be too low.
+    """
+
+    # the indexed nodes of the bucket, see NodeBucket.nodes
+    _nodes: Optional[Any] = None
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if self._nodes is not None and not _is_lower(self.get(key), value):
+            self._nodes.version += 1
+        dict.__setitem__(self, key, value)
+
+    def __reduce__(self) -> Tuple:
+        # copies, i.e. in a partition worker, are not covered by the index
+        return (_AvailableResources, (dict(self),))
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+def _is_lower(old: Any, new: Any) -> bool:
+    if old is None:
+        return False
+    try:
+        return bool(new <= old)
+    except TypeError:
+        return False
+
+
 class Node(ABC):
     def __init__(
         self,
@@ -72,7 +110,7 @@ class Node(ABC):
         self.__infiniband = infiniband
 
         self._resources = resources or ht.ResourceDict({})
-        self.__available = deepcopy(self._resources)
+        self.__available = _AvailableResources(deepcopy(self._resources))
 
         self.__state = state
         self.__exists = exists
@@ -421,21 +459,40 @@ class Node(ABC):
 
         to_pack = min(iterations, min_space)
 
+        undolog.touch(self)
         for constraint in constraints:
-            for i in range(to_pack):
-                assert constraint.do_decrement(
-                    self
-                ), "calculated minimum space of {} but failed at index {} {} {}".format(
-                    to_pack, i, constraint, constraint.satisfied_by_node(self),
-                )
+            assert constraint.do_decrement_n(
+                self, to_pack
+            ), "calculated minimum space of {} but failed {} {}".format(
+                to_pack, constraint, constraint.satisfied_by_node(self),
+            )
 
         self._allocated = True
         self.__assignments.add(assignment_id)
         return MatchResult("success", node=self, slots=to_pack)
 
     def assign(self, assignment_id: str) -> None:
+        undolog.touch(self)
         self.__assignments.add(assignment_id)
 
+    def _state(self) -> Tuple[Dict, Set[str], bool, bool]:
+        return (
+            dict(self.available),
+            set(self.__assignments),
+            self._allocated,
+            self.__closed,
+        )
+
+    def _restore(self, state: Tuple[Dict, Set[str], bool, bool]) -> None:
+        available, assignments, self._allocated, self.__closed = state
+        for key in [k for k in self.available if k not in available]:
+            del self.available[key]
+        # through __setitem__, so that capacity indices see what goes back up
+        for key, value in available.items():
+            self.available[key] = value
+        self.__assignments.clear()
+        self.__assignments.update(assignments)
+
     @property
     def assignments(self) -> Set[str]:
         return self.__assignments
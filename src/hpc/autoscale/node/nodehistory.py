@@ -170,12 +170,13 @@ class SQLiteNodeHistory(NodeHistory):
             self._execute(stmt)
 
         if to_delete:
-            to_delete_expr = " OR ".join(
-                ['node_id="{}"'.format(node_id) for node_id in to_delete]
-            )
+            # IN, unlike a chain of ORs, is not limited to 1000 terms
+            to_delete_expr = ",".join(["'{}'".format(node_id) for node_id in to_delete])
             now = datetime.datetime.utcnow().timestamp()
             self._execute(
-                "UPDATE nodes set delete_time={} where {}".format(now, to_delete_expr)
+                "UPDATE nodes set delete_time={} where node_id IN ({})".format(
+                    now, to_delete_expr
+                )
             )
 
         self.retire_records(commit=True)
@@ -226,15 +227,13 @@ class SQLiteNodeHistory(NodeHistory):
             nodes = []
 
         nodes = [n for n in nodes if n.exists]
-        equalities = [
-            " (node_id == '{}') ".format(n.delayed_node_id.node_id) for n in nodes
-        ]
+        node_ids = ["'{}'".format(n.delayed_node_id.node_id) for n in nodes]
 
-        if not equalities:
+        if not node_ids:
             return
 
-        stmt = "select node_id, last_match_time, create_time, delete_time from nodes where {}".format(
-            "{}".format(" OR ".join(equalities))
+        stmt = "select node_id, last_match_time, create_time, delete_time from nodes where node_id IN ({})".format(
+            ",".join(node_ids)
         )
 
         rows = self._execute(stmt)
@@ -1,10 +1,29 @@
-import functools
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import deepcopy
-from typing import Callable, Dict, List, Optional, Tuple, TypeVar, Union
+from functools import partial
+from types import MappingProxyType, MethodType
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from cyclecloud.model.ClusterStatusModule import ClusterStatus
 from cyclecloud.model.NodearrayBucketStatusModule import NodearrayBucketStatus
 from cyclecloud.model.NodeCreationResultModule import NodeCreationResult
+from cyclecloud.model.NodeListModule import NodeList
 from cyclecloud.model.NodeManagementResultModule import NodeManagementResult
 from cyclecloud.model.NodeManagementResultNodeModule import NodeManagementResultNode
 from cyclecloud.model.PlacementGroupStatusModule import PlacementGroupStatus
@@ -13,18 +32,32 @@ from typing_extensions import Literal
 
 import hpc.autoscale.hpclogging as logging
 from hpc.autoscale import hpctypes as ht
-from hpc.autoscale.ccbindings import new_cluster_bindings
-from hpc.autoscale.ccbindings.interface import ClusterBindingInterface
+from hpc.autoscale.ccbindings import new_async_cluster_bindings, new_cluster_bindings
+from hpc.autoscale.ccbindings.asyncbindings import AsyncClusterBindingAdapter
+from hpc.autoscale.ccbindings.interface import (
+    AsyncClusterBindingInterface,
+    ClusterBindingInterface,
+    MergedNodeCreationResult,
+)
+from hpc.autoscale.ccbindings.statuscache import ClusterStatusDelta
 from hpc.autoscale.codeanalysis import hpcwrapclass
 from hpc.autoscale.hpclogging import apitrace
 from hpc.autoscale.node import constraints as constraintslib
-from hpc.autoscale.node import vm_sizes
+from hpc.autoscale.node import undolog, vm_sizes
 from hpc.autoscale.node.bucket import (
     NodeBucket,
     NodeDefinition,
     bucket_candidates,
     node_from_bucket,
 )
+from hpc.autoscale.node.capacity import (
+    BucketCapacity,
+    CapacityEstimate,
+    CapacityIndex,
+    PlacementGroupIndex,
+    minimum_requests,
+    only_resources,
+)
 from hpc.autoscale.node.constraints import NodeConstraint
 from hpc.autoscale.node.delayednodeid import DelayedNodeId
 from hpc.autoscale.node.limits import (
@@ -34,13 +67,14 @@ from hpc.autoscale.node.limits import (
     null_bucket_limits,
 )
 from hpc.autoscale.node.node import Node, UnmanagedNode, minimum_space
+from hpc.autoscale.node.undolog import Savepoint
 from hpc.autoscale.results import (
     AllocationResult,
     BootupResult,
     DeallocateResult,
     DeleteResult,
+    EarlyBailoutResult,
     RemoveResult,
-    SatisfiedResult,
     ShutdownResult,
     StartResult,
     TerminateResult,
@@ -51,6 +85,8 @@ logger = logging.getLogger("cyclecloud.buckets")
 
 
 DefaultValueFunc = Callable[[Node], ht.ResourceTypeAtom]
+NodesOperation = Callable[[List[Node]], NodeManagementResult]
+AsyncNodesOperation = Callable[[List[Node]], Awaitable[NodeManagementResult]]
 ResourceModifier = Literal["add", "subtract", "multiply", "divide", "divide_floor"]
 
 
@@ -71,9 +107,17 @@ class NodeManager:
     """
 
     def __init__(
-        self, cluster_bindings: ClusterBindingInterface, node_buckets: List[NodeBucket],
+        self,
+        cluster_bindings: Optional[ClusterBindingInterface],
+        node_buckets: List[NodeBucket],
     ) -> None:
+        """
+        Without cluster_bindings, the NodeManager can only allocate, i.e. to
+        allocate a partition of jobs in another process. See
+        DemandCalculator.partition_workers
+        """
         self.__cluster_bindings = cluster_bindings
+        self.__async_cluster_bindings: Optional[AsyncClusterBindingInterface] = None
         self.__node_buckets = node_buckets
         self._node_names = {}
         for node_bucket in node_buckets:
@@ -81,6 +125,52 @@ class NodeManager:
                 self._node_names[node.name] = True
 
         self.__default_resources: List[_DefaultResource] = []
+        self.__default_resources_deferred = 0
+        self.__default_resources_pending = False
+        # defaults that the example node of a bucket did not resolve, keyed by
+        # (bucket_id, placement_group). See _apply_bucket_defaults
+        self.__bucket_pending_defaults: Dict[
+            Tuple[ht.BucketId, Optional[ht.PlacementGroup]], List[_DefaultResource]
+        ] = {}
+
+        # node management requests (deallocate, terminate etc) are split into
+        # chunks of at most this many nodes, issued concurrently.
+        self.node_operation_batch_size = 500
+        self.node_operation_concurrency = 4
+
+        # when a list, every node decrement made while allocating is appended as
+        # (bucket_id, placement_group, node name, new, slots). See _replay_allocation
+        self._allocation_log: Optional[
+            List[
+                Tuple[ht.BucketId, Optional[ht.PlacementGroup], ht.NodeName, bool, int]
+            ]
+        ] = None
+
+        # when set, existing nodes it fails are skipped when allocating.
+        # See NodeQueue.early_bailout
+        self.early_bailout: Optional[Callable[[Node], EarlyBailoutResult]] = None
+
+        # parsed constraints and candidate buckets, see query_capacity. Cleared
+        # whenever buckets, their resources or their limits change.
+        self.__query_candidates: Dict[
+            Tuple, Tuple[List, List[constraintslib.NodeConstraint], List[NodeBucket]]
+        ] = {}
+
+        # per (bucket_id, placement_group), built on first use. See _capacity_index
+        self.__capacity_indices: Dict[
+            Tuple[ht.BucketId, Optional[ht.PlacementGroup]], CapacityIndex
+        ] = {}
+
+        # per bucket_id with placement groups. See _colocated_candidates
+        self.__placement_group_indices: Dict[ht.BucketId, PlacementGroupIndex] = {}
+
+        # per bucket_id, the placement groups whose buckets are not built yet, and
+        # the last one that was. See _materialize_placement_groups
+        self.__lazy_placement_groups: Dict[
+            ht.BucketId, List["_LazyPlacementGroup"]
+        ] = {}
+        self.__spare_placement_groups: Dict[ht.BucketId, NodeBucket] = {}
+        self.__limits_builder: Optional["_LimitsBuilder"] = None
 
         # list of nodes a user has 'allocated'.
         # self.new_nodes = []  # type: List[Node]
@@ -91,6 +181,8 @@ class NodeManager:
 
     def _add_bucket(self, bucket: NodeBucket) -> None:
         self.__node_buckets.append(bucket)
+        self.__query_candidates.clear()
+        self.__placement_group_indices.clear()
 
     @apitrace
     def allocate(
@@ -101,7 +193,14 @@ class NodeManager:
         allow_existing: bool = True,
         all_or_nothing: bool = False,
         assignment_id: Optional[str] = None,
+        best_fit: bool = False,
+        allow_new: bool = True,
     ) -> AllocationResult:
+        """
+        best_fit only applies to slot_count: the slots go to the existing nodes, in
+        any candidate bucket, with the least of the requested resources left before
+        any new node is added. allow_new=False never adds a node.
+        """
 
         if int(node_count or 0) <= 0 and int(slot_count or 0) <= 0:
             return AllocationResult(
@@ -115,6 +214,7 @@ class NodeManager:
             constraints = [constraints]
 
         parsed_constraints = constraintslib.get_constraints(constraints)
+        self._materialize_placement_groups(parsed_constraints)
 
         candidates_result = bucket_candidates(self.get_buckets(), parsed_constraints)
         if not candidates_result:
@@ -125,70 +225,104 @@ class NodeManager:
         allocated_nodes = {}
         total_slots_allocated = 0
 
-        additional_reasons = []
-
-        for candidate in candidates_result.candidates:
-            if slot_count:
+        additional_reasons: List[str] = []
 
-                result = self._allocate_slots(
-                    candidate,
-                    slot_count - total_slots_allocated,
-                    parsed_constraints,
-                    allow_existing,
-                    all_or_nothing,
-                    assignment_id,
+        # rolled back if anything raises and, as a request spread over several
+        # buckets is only kept if all of it fits, when all_or_nothing falls short
+        with self.transaction() as savepoint:
+            candidates: Iterable[Tuple[NodeBucket, bool]] = [
+                (c, allow_new) for c in candidates_result.candidates
+            ]
+            if node_count and all_or_nothing and allow_existing:
+                # every node comes from one bucket, so only try those that fit
+                candidates = (
+                    (c, allow_new)
+                    for c in self._colocated_candidates(
+                        candidates_result.candidates, node_count, additional_reasons
+                    )
                 )
+            elif (
+                best_fit
+                and allow_new
+                and slot_count
+                and not all_or_nothing
+                and len(candidates_result.candidates) > 1
+            ):
+                # a first pass that only fills existing nodes, in every bucket
+                candidates = [(c, False) for c in candidates_result.candidates] + [
+                    (c, allow_new) for c in candidates_result.candidates
+                ]
 
-                if not result:
-                    continue
+            for candidate, allow_new in candidates:
+                if slot_count:
+
+                    result = self._allocate_slots(
+                        candidate,
+                        slot_count - total_slots_allocated,
+                        parsed_constraints,
+                        allow_existing,
+                        all_or_nothing,
+                        assignment_id,
+                        best_fit=best_fit,
+                        allow_new=allow_new,
+                    )
 
-                for node in result.nodes:
-                    allocated_nodes[node.name] = node
+                    if not result:
+                        continue
 
-                assert result.total_slots > 0
-                total_slots_allocated += result.total_slots
+                    for node in result.nodes:
+                        allocated_nodes[node.name] = node
 
-                if total_slots_allocated >= slot_count:
-                    break
-            else:
-                assert node_count is not None
+                    assert result.total_slots > 0
+                    total_slots_allocated += result.total_slots
 
-                node_count_floored = self._get_node_count(
-                    candidate,
-                    node_count - len(allocated_nodes),
-                    all_or_nothing=all_or_nothing,
-                    allow_existing=allow_existing,
-                )
+                    if total_slots_allocated >= slot_count:
+                        break
+                else:
+                    assert node_count is not None
+
+                    node_count_floored = self._get_node_count(
+                        candidate,
+                        node_count - len(allocated_nodes),
+                        all_or_nothing=all_or_nothing,
+                        allow_existing=allow_existing,
+                    )
 
-                if node_count_floored < 1:
-                    additional_reasons.append(
-                        "Bucket {} does not have capacity: Required={} Available={}".format(
-                            candidate, node_count, candidate.available_count
+                    if node_count_floored < 1:
+                        additional_reasons.append(
+                            "Bucket {} does not have capacity: Required={} Available={}".format(
+                                candidate, node_count, candidate.available_count
+                            )
                         )
+                        continue
+
+                    result = self._allocate_nodes(
+                        candidate,
+                        node_count_floored,
+                        -1,
+                        parsed_constraints,
+                        allow_existing,
+                        assignment_id,
+                        allow_new=allow_new,
                     )
-                    continue
 
-                result = self._allocate_nodes(
-                    candidate,
-                    node_count_floored,
-                    -1,
-                    parsed_constraints,
-                    allow_existing,
-                    assignment_id,
-                )
+                    if not result:
+                        if hasattr(result, "reasons"):
+                            additional_reasons.extend(result.reasons)
+                        continue
 
-                if not result:
-                    if hasattr(result, "reasons"):
-                        additional_reasons.extend(result.reasons)
-                    continue
+                    for node in result.nodes:
+                        allocated_nodes[node.name] = node
 
-                for node in result.nodes:
-                    allocated_nodes[node.name] = node
+                    total_slots_allocated = len(allocated_nodes)
 
-                total_slots_allocated = len(allocated_nodes)
+                    if total_slots_allocated >= node_count:
+                        break
 
-                if total_slots_allocated >= node_count:
-                    break
+            requested = slot_count or node_count or 0
+            if all_or_nothing and total_slots_allocated < requested:
+                savepoint.rollback()
+                allocated_nodes = {}
 
         if allocated_nodes:
             assert total_slots_allocated
@@ -216,51 +350,60 @@ class NodeManager:
         allow_existing: bool = False,
         all_or_nothing: bool = False,
         assignment_id: Optional[str] = None,
+        best_fit: bool = False,
+        allow_new: bool = True,
     ) -> AllocationResult:
         remaining = slot_count
         allocated_nodes: Dict[str, Tuple[Node, Node]] = {}
+        with self.transaction() as savepoint:
+            while remaining > 0:
+                min_count = minimum_space(constraints, bucket.example_node)
+                assert min_count, "%s -> %s" % (
+                    constraints,
+                    bucket.example_node.resources,
+                )
+                # -1 is returned when the constraints have no say in how many could fit
+                # like, say, if the only constraint was that a flag was true
+                if min_count <= -1:
+                    min_count = remaining
+                elif min_count == 0:
+                    break
 
-        while remaining > 0:
-            min_count = minimum_space(constraints, bucket.example_node)
-            assert min_count, "%s -> %s" % (constraints, bucket.example_node.resources)
-            # -1 is returned when the constraints have no say in how many could fit
-            # like, say, if the only constraint was that a flag was true
-            if min_count <= -1:
-                min_count = remaining
-            elif min_count == 0:
-                break
-
-            alloc_result = self._allocate_nodes(
-                bucket,
-                1,
-                # min(remaining, min_count),
-                remaining,
-                constraints,
-                allow_existing=True,
-                assignment_id=assignment_id,
-                commit=False,
-            )
+                alloc_result = self._allocate_nodes(
+                    bucket,
+                    1,
+                    # min(remaining, min_count),
+                    remaining,
+                    constraints,
+                    allow_existing=True,
+                    assignment_id=assignment_id,
+                    commit=False,
+                    best_fit=best_fit,
+                    allow_new=allow_new,
+                )
 
-            if not alloc_result:
-                break
+                if not alloc_result:
+                    break
 
-            for node in alloc_result.nodes:
-                allocated_nodes[node.name] = (node, node)
+                for node in alloc_result.nodes:
+                    allocated_nodes[node.name] = (node, node)
 
-            remaining -= alloc_result.total_slots
+                remaining -= alloc_result.total_slots
 
-        if all_or_nothing and remaining > 0:
-            self._rollback(bucket)
-            return AllocationResult("OutOfCapacity", reasons=["TODO"])
+            if all_or_nothing and remaining > 0:
+                savepoint.rollback()
+                return AllocationResult("OutOfCapacity", reasons=["TODO"])
 
-        # allocated at least one slot
-        if remaining < slot_count:
-            commited_nodes = self._commit(bucket, list(allocated_nodes.values()))
-            return AllocationResult(
-                "success", nodes=commited_nodes, slots_allocated=slot_count - remaining,
-            )
-        self._rollback(bucket)
-        return AllocationResult("Failed", reasons=["TODO"])
+            # allocated at least one slot
+            if remaining < slot_count:
+                commited_nodes = self._commit(bucket, list(allocated_nodes.values()))
+                return AllocationResult(
+                    "success",
+                    nodes=commited_nodes,
+                    slots_allocated=slot_count - remaining,
+                )
+            savepoint.rollback()
+            return AllocationResult("Failed", reasons=["TODO"])
 
     def _allocate_nodes(
         self,
@@ -271,16 +414,24 @@ class NodeManager:
         allow_existing: bool = False,
         assignment_id: Optional[str] = None,
         commit: bool = True,
+        best_fit: bool = False,
+        allow_new: bool = True,
     ) -> AllocationResult:
-        ret = self.__allocate_nodes(
-            bucket,
-            count,
-            total_iterations,
-            constraints,
-            allow_existing,
-            assignment_id,
-            commit,
-        )
+        # a failed attempt may have decremented nodes and the bucket already
+        with self.transaction() as savepoint:
+            ret = self.__allocate_nodes(
+                bucket,
+                count,
+                total_iterations,
+                constraints,
+                allow_existing,
+                assignment_id,
+                commit,
+                best_fit,
+                allow_new,
+            )
+            if not ret:
+                savepoint.rollback()
         assert bucket.available_count >= 0, bucket
         return ret
 
@@ -293,6 +444,8 @@ class NodeManager:
         allow_existing: bool = False,
         assignment_id: Optional[str] = None,
         commit: bool = True,
+        best_fit: bool = False,
+        allow_new: bool = True,
     ) -> AllocationResult:
 
         for node in bucket.nodes:
@@ -355,7 +508,9 @@ class NodeManager:
 
         assert remaining_slots() > 0
 
-        if remaining_nodes() > available_count_total:
+        # nodes that are already allocated may still have room, and they are the
+        # only candidates when no new nodes are allowed.
+        if allow_new and remaining_nodes() > available_count_total:
             return AllocationResult(
                 "NoCapacity",
                 reasons=[
@@ -367,58 +522,51 @@ class NodeManager:
                 ],
             )
 
-        for node in bucket.nodes:
+        # only the nodes that may still fit, and none once the rest can not
+        capacity_index = self._capacity_index(bucket)
+        existing_nodes: Iterable[Node] = capacity_index.candidates(
+            minimum_requests(constraints)
+        )
+        if best_fit:
+            requests = constraintslib.get_resource_requests(constraints)
+            existing_nodes = sorted(
+                existing_nodes, key=lambda n: _remaining_share(n, requests)
+            )
+
+        for node in existing_nodes:
 
             if node.closed:
                 continue
 
-            satisfied: Union[SatisfiedResult, bool]
-
-            if constraints:
-                for c in constraints:
-
-                    result = c.satisfied_by_node(node)
-                    if not result:
-                        satisfied = result
+            if self.early_bailout and not self.early_bailout(node):
+                continue
 
-                satisfied: bool = functools.reduce(lambda a, b: bool(a) and bool(b), [c.satisfied_by_node(node) for c in constraints])  # type: ignore
+            if not all(c.satisfied_by_node(node) for c in constraints):
+                capacity_index.update(node)
             else:
-                satisfied = True
-
-            if satisfied:
-                temp_node = node.clone()
                 per_node = _per_node(node, constraints)
                 match_result = node.decrement(
                     constraints, per_node, assignment_id=assignment_id
                 )
                 assert match_result
+                capacity_index.update(node)
+                self._log_allocation(bucket, node, False, match_result.total_slots)
                 slots_allocated += match_result.total_slots
-                allocated_nodes[node.name] = (node, temp_node)
+                allocated_nodes[node.name] = (node, node)
 
                 if remaining_slots() <= 0:
                     break
 
-        while remaining_slots() > 0 and bucket.available_count > 0:
-
-            node_name = self._next_node_name(bucket)
-            new_node = node_from_bucket(
-                bucket,
-                exists=False,
-                state=ht.NodeStatus("Off"),
-                # TODO what about deallocated? Though this is a 'new' node...
-                power_state=ht.NodeStatus("Off"),
-                placement_group=bucket.placement_group,
-                new_node_name=node_name,
-            )
-            self._apply_defaults(new_node)
+        while allow_new and remaining_slots() > 0 and bucket.available_count > 0:
 
-            assert new_node.vcpu_count == bucket.vcpu_count
+            new_node = self._new_node(bucket)
 
             per_node = _per_node(new_node, constraints)
 
             match_result = new_node.decrement(constraints, per_node, assignment_id)
 
             assert match_result
+            self._log_allocation(bucket, new_node, True, match_result.total_slots)
             slots_allocated += match_result.total_slots
 
             new_nodes.append(new_node)
@@ -460,6 +608,176 @@ class NodeManager:
             "success", allocated_result_nodes, slots_allocated=slots_allocated
         )
 
+    def _colocated_candidates(
+        self, candidates: List[NodeBucket], node_count: int, reasons: List[str],
+    ) -> Iterator[NodeBucket]:
+        """
+        In place of the placement group buckets of a bucket_id, only those that can
+        hold all node_count nodes, tightest first, where the first of them was.
+        The rest keep their order. Lazy, as allocate stops at the first that fits.
+        """
+        by_bucket_id = partition(
+            [c for c in candidates if c.placement_group], lambda c: c.bucket_id
+        )
+
+        for candidate in candidates:
+            if not candidate.placement_group:
+                yield candidate
+                continue
+
+            pg_candidates = by_bucket_id.pop(candidate.bucket_id, None)
+            if pg_candidates is None:
+                continue
+
+            allowed = set([id(c) for c in pg_candidates])
+            index = self._placement_group_index(candidate.bucket_id)
+            found = False
+            for bucket in index.fits(node_count):
+                # the index leaves out the regional, family etc. limits
+                if (
+                    id(bucket) in allowed
+                    and self._availabe_count(bucket, True) >= node_count
+                ):
+                    found = True
+                    yield bucket
+
+            if not found:
+                reasons.append(
+                    "No placement group of {}/{} can hold {} nodes".format(
+                        candidate.nodearray, candidate.vm_size, node_count
+                    )
+                )
+
+    def _placement_group_index(self, bucket_id: ht.BucketId) -> PlacementGroupIndex:
+        index = self.__placement_group_indices.get(bucket_id)
+        if index is None:
+            index = self.__placement_group_indices[bucket_id] = PlacementGroupIndex(
+                [
+                    b
+                    for b in self.__node_buckets
+                    if b.bucket_id == bucket_id and b.placement_group
+                ]
+            )
+        return index
+
+    def _add_lazy_placement_groups(
+        self,
+        lazy_placement_groups: List["_LazyPlacementGroup"],
+        limits_builder: "_LimitsBuilder",
+    ) -> None:
+        if not lazy_placement_groups:
+            return
+        for lazy in lazy_placement_groups:
+            self.__lazy_placement_groups.setdefault(lazy.bucket_id, []).append(lazy)
+        # the shared limits of the buckets built so far, for those built later
+        self.__limits_builder = limits_builder
+
+    def _has_lazy_placement_groups(
+        self, constraints: List[constraintslib.NodeConstraint], colocated: bool = False
+    ) -> bool:
+        """Whether _materialize_placement_groups may add buckets for these"""
+        if not self.__lazy_placement_groups:
+            return False
+        any_placement_group, names = _placement_group_request(constraints)
+        return any_placement_group or colocated or bool(names)
+
+    def _materialize_placement_groups(
+        self, constraints: List[constraintslib.NodeConstraint], colocated: bool = False
+    ) -> None:
+        """
+        Builds the buckets of the lazy placement groups the constraints name. If
+        they may use any placement group, also builds one more per bucket_id,
+        unless the last one built is still empty - all empty placement groups are
+        alike, so one at a time is enough.
+        """
+        if not self.__lazy_placement_groups:
+            return
+
+        any_placement_group, names = _placement_group_request(constraints)
+        any_placement_group = any_placement_group or colocated
+        if not any_placement_group and not names:
+            return
+
+        assert self.__limits_builder
+        for bucket_id in list(self.__lazy_placement_groups):
+            lazy = self.__lazy_placement_groups[bucket_id]
+            chosen = [pg for pg in lazy if pg.name in names]
+            if any_placement_group and not chosen:
+                spare = self.__spare_placement_groups.get(bucket_id)
+                if spare is None or spare.nodes:
+                    chosen = [lazy[0]]
+
+            for pg in chosen:
+                lazy.remove(pg)
+                bucket = pg.materialize(self.__limits_builder)
+                self._add_bucket(bucket)
+                self._apply_defaults(bucket.example_node)
+                bucket.resources.update(bucket.example_node.available)
+                self.__spare_placement_groups[bucket_id] = bucket
+                logging.debug("Built %s for %s", bucket, constraints)
+
+            if not lazy:
+                self.__lazy_placement_groups.pop(bucket_id)
+
+    def _capacity_index(self, bucket: NodeBucket) -> CapacityIndex:
+        key = (bucket.bucket_id, bucket.placement_group)
+        index = self.__capacity_indices.get(key)
+        if index is None or not index.is_current(bucket.nodes):
+            index = self.__capacity_indices[key] = CapacityIndex(bucket.nodes)
+        return index
+
+    def _new_node(self, bucket: NodeBucket) -> Node:
+        node_name = self._next_node_name(bucket)
+        new_node = node_from_bucket(
+            bucket,
+            exists=False,
+            state=ht.NodeStatus("Off"),
+            # TODO what about deallocated? Though this is a 'new' node...
+            power_state=ht.NodeStatus("Off"),
+            placement_group=bucket.placement_group,
+            new_node_name=node_name,
+        )
+        self._apply_bucket_defaults(bucket, new_node)
+
+        assert new_node.vcpu_count == bucket.vcpu_count
+        return new_node
+
+    def _log_allocation(
+        self, bucket: NodeBucket, node: Node, new: bool, slots: int
+    ) -> None:
+        if self._allocation_log is not None:
+            self._allocation_log.append(
+                (bucket.bucket_id, bucket.placement_group, node.name, new, slots)
+            )
+            undolog.record(self._allocation_log.pop)
+
+    def _replay_allocation(
+        self,
+        bucket: NodeBucket,
+        node_name: ht.NodeName,
+        new: bool,
+        slots: int,
+        constraints: List[constraintslib.NodeConstraint],
+        assignment_id: str,
+    ) -> Node:
+        """
+        Repeats one node decrement from an _allocation_log. The caller makes sure
+        the bucket is in the same state it was in when the decrement was logged.
+        """
+        if new:
+            node = self._new_node(bucket)
+            assert node.name == node_name, "{} != {}".format(node.name, node_name)
+        else:
+            node = next(n for n in bucket.nodes if n.name == node_name)
+
+        match_result = node.decrement(constraints, slots, assignment_id)
+        assert match_result and match_result.total_slots == slots, match_result
+        self._log_allocation(bucket, node, new, slots)
+        if new:
+            bucket.decrement(1)
+        self._commit(bucket, [(node, node)])
+        return node
+
     def _commit(
         self, bucket: NodeBucket, allocated_nodes: List[Tuple[Node, Node]]
     ) -> List[Node]:
@@ -473,9 +791,10 @@ class NodeManager:
                 by_name[new_node.name] = [new_node]
 
         for node in new_nodes:
-            self._node_names[node.name] = True
+            self._set_node_name(node.name, True)
 
         for old_node, new_node in allocated_nodes:
+            undolog.touch(old_node)
             old_node._allocated = True
             if old_node is not new_node:
                 assert old_node.bucket_id == new_node.bucket_id
@@ -484,17 +803,166 @@ class NodeManager:
                 if old_node in bucket.nodes:
                     index = bucket.nodes.index(old_node)
                     bucket.nodes[index] = new_node
+                    undolog.record(partial(bucket.nodes.__setitem__, index, old_node))
                 else:
+                    undolog.touch(bucket)
                     bucket.nodes.append(new_node)
+                self.__capacity_indices.pop(
+                    (bucket.bucket_id, bucket.placement_group), None
+                )
 
         bucket.commit()
         return [n[1] for n in allocated_nodes]
 
-    def _rollback(self, bucket: NodeBucket) -> None:
-        bucket.rollback()
-        for name in list(self._node_names.keys()):
-            if not self._node_names[name]:
-                self._node_names.pop(name)
+    def savepoint(self) -> Savepoint:
+        """
+        Everything allocated after this can be rolled back, in time proportional
+        to what was allocated. Savepoints nest; roll back or release the innermost
+        first. Nodes, buckets and limits go back to how they were, and the nodes
+        allocate returned since are no longer allocated.
+        """
+        return Savepoint()
+
+    @contextmanager
+    def transaction(self) -> Iterator[Savepoint]:
+        """
+        A savepoint that is rolled back if the block raises, and otherwise released
+        unless the block already rolled it back.
+
+            with node_mgr.transaction() as savepoint:
+                if not node_mgr.allocate(...):
+                    savepoint.rollback()
+        """
+        savepoint = self.savepoint()
+        try:
+            yield savepoint
+        except BaseException:
+            if savepoint.is_open:
+                savepoint.rollback()
+            raise
+        if savepoint.is_open:
+            savepoint.release()
+
+    def _set_node_name(self, name: ht.NodeName, committed: bool) -> None:
+        if undolog.recording():
+            if name in self._node_names:
+                undolog.record(
+                    partial(self._node_names.__setitem__, name, self._node_names[name])
+                )
+            else:
+                undolog.record(partial(self._node_names.pop, name))
+        self._node_names[name] = committed
+
+    # not apitraced, as it is meant to be called thousands of times per cycle
+    def query_capacity(
+        self,
+        constraints: Union[List[constraintslib.Constraint], constraintslib.Constraint],
+        slot_count: Optional[int] = None,
+    ) -> CapacityEstimate:
+        """
+        How many slots of the constraints fit right now, on existing nodes and on
+        new nodes, and how many new nodes of each bucket that takes. Nothing is
+        allocated. Like allocate, each bucket's existing nodes come before its new
+        nodes. Nodes whose slots the constraints do not limit count as one slot.
+        """
+        parsed_constraints, candidates = self._query_candidates(constraints)
+        requests = minimum_requests(parsed_constraints)
+        check_nodes = not only_resources(parsed_constraints)
+        # nodes and cores that earlier buckets' new nodes take from each limit
+        consumed: Dict[int, Tuple[int, int]] = {}
+        remaining = slot_count
+        ret: List[BucketCapacity] = []
+
+        for bucket in candidates:
+            if remaining is not None and remaining <= 0:
+                break
+
+            existing_slots = 0
+            for node in self._capacity_index(bucket).candidates(requests):
+                if remaining is not None and existing_slots >= remaining:
+                    break
+                if node.closed:
+                    continue
+                if check_nodes and not all(
+                    c.satisfied_by_node(node) for c in parsed_constraints
+                ):
+                    continue
+                node_slots = minimum_space(parsed_constraints, node)
+                if node_slots:
+                    existing_slots += max(1, node_slots)
+
+            if remaining is not None:
+                existing_slots = min(existing_slots, remaining)
+                remaining -= existing_slots
+
+            slots_per_new_node = minimum_space(parsed_constraints, bucket.example_node)
+            if slots_per_new_node == 0:
+                ret.append(BucketCapacity(bucket, existing_slots, 0, 0))
+                continue
+            slots_per_new_node = max(1, slots_per_new_node)
+
+            shared_limits = [
+                limit
+                for limit in bucket.limits.shared_limits()
+                if isinstance(limit, _SharedLimit)
+            ]
+            new_node_count = bucket.available_count
+            for limit in shared_limits:
+                nodes, cores = consumed.get(id(limit), (0, 0))
+                new_node_count = min(
+                    new_node_count,
+                    limit._available_count(bucket.vcpu_count, nodes, cores),
+                )
+            new_node_count = max(0, new_node_count)
+
+            if remaining is not None:
+                # rounded up
+                new_node_count = min(
+                    new_node_count, -(-remaining // slots_per_new_node)
+                )
+                remaining -= min(remaining, new_node_count * slots_per_new_node)
+
+            for limit in shared_limits:
+                nodes, cores = consumed.get(id(limit), (0, 0))
+                consumed[id(limit)] = (
+                    nodes + new_node_count,
+                    cores + new_node_count * bucket.vcpu_count,
+                )
+
+            ret.append(
+                BucketCapacity(
+                    bucket, existing_slots, slots_per_new_node, new_node_count
+                )
+            )
+
+        return CapacityEstimate(ret, slot_count)
+
+    def _query_candidates(
+        self,
+        constraints: Union[List[constraintslib.Constraint], constraintslib.Constraint],
+    ) -> Tuple[List[constraintslib.NodeConstraint], List[NodeBucket]]:
+        if not isinstance(constraints, list):
+            constraints = [constraints]
+
+        key: Tuple
+        try:
+            key = ("json", json.dumps(constraints, sort_keys=True))
+        except TypeError:
+            # parsed constraints. The cache keeps them, so their ids stay unique
+            key = ("id",) + tuple(id(c) for c in constraints)
+
+        if key not in self.__query_candidates:
+            parsed_constraints = constraintslib.get_constraints(constraints)
+            self._materialize_placement_groups(parsed_constraints)
+            result = bucket_candidates(self.get_buckets(), parsed_constraints)
+            self.__query_candidates[key] = (
+                list(constraints),
+                parsed_constraints,
+                result.candidates if result else [],
+            )
+
+        _, parsed_constraints, candidates = self.__query_candidates[key]
+        return parsed_constraints, candidates
 
     @apitrace
     def allocate_at_least(
@@ -544,7 +1012,7 @@ class NodeManager:
         while True:
             name = ht.NodeName("{}-{}".format(bucket.nodearray, index))
             if name not in self._node_names:
-                self._node_names[name] = False
+                self._set_node_name(name, False)
                 return name
             index += 1
 
@@ -558,7 +1026,11 @@ class NodeManager:
             lambda n: n.bucket_id,
         )
 
-        buckets = partition_single(self.__node_buckets, lambda b: b.bucket_id)
+        # placement group buckets share the bucket_id of their bucket
+        buckets = partition_single(
+            [b for b in self.__node_buckets if not b.placement_group],
+            lambda b: b.bucket_id,
+        )
 
         for key, nodes_list in by_key.items():
             if key in buckets:
@@ -589,7 +1061,7 @@ class NodeManager:
                 node_def, limits, len(nodes_list), nodes_list, artificial=True
             )
 
-            self.__node_buckets.append(bucket)
+            self._add_bucket(bucket)
             bucket.add_nodes(nodes_list)
 
         self._apply_defaults_all()
@@ -623,16 +1095,71 @@ class NodeManager:
         return partition_single(self.get_buckets(), lambda b: b.bucket_id)
 
     @apitrace
-    def get_nodes_by_operation(self, operation_id: ht.OperationId) -> List[Node]:
-        relevant_node_list = self.__cluster_bindings.get_nodes(
-            operation_id=operation_id
-        )
-        relevant_node_names = [n["Name"] for n in relevant_node_list.nodes]
-        updated_cluster_status = self.__cluster_bindings.get_cluster_status(True)
+    def get_nodes_by_operation(
+        self, operation_id: ht.OperationId, full_refresh: bool = False
+    ) -> List[Node]:
+        """
+        Updates and returns the nodes affected by an operation. By default the
+        state comes from the operation's node list. full_refresh=True also fetches
+        the full cluster status, i.e. to detect nodes that have since been removed.
+        """
+        return self._refresh_nodes_by_operations([operation_id], full_refresh)
+
+    def _refresh_nodes_by_operations(
+        self, operation_ids: List[ht.OperationId], full_refresh: bool = False
+    ) -> List[Node]:
+        relevant_cc_nodes = []
+        for operation_id in operation_ids:
+            relevant_node_list = self.cluster_bindings.get_nodes(
+                operation_id=operation_id
+            )
+            relevant_cc_nodes.extend(relevant_node_list.nodes)
+
+        updated_cc_nodes = None
+        if full_refresh or _missing_status(relevant_cc_nodes):
+            updated_cc_nodes = self.cluster_bindings.get_cluster_status(True).nodes
+
+        return self._apply_refreshed_nodes(relevant_cc_nodes, updated_cc_nodes)
+
+    async def _refresh_nodes_by_operations_async(
+        self, operation_ids: List[ht.OperationId], full_refresh: bool = False
+    ) -> List[Node]:
+        bindings = self.async_cluster_bindings
+        semaphore = asyncio.Semaphore(max(1, self.node_operation_concurrency))
 
-        updated_cc_nodes = partition_single(
-            updated_cluster_status.nodes, lambda n: n["Name"]
+        async def get_nodes(operation_id: ht.OperationId) -> NodeList:
+            async with semaphore:
+                return await bindings.get_nodes(operation_id=operation_id)
+
+        relevant_node_lists = await asyncio.gather(
+            *[get_nodes(op_id) for op_id in operation_ids]
         )
+        relevant_cc_nodes = []
+        for relevant_node_list in relevant_node_lists:
+            relevant_cc_nodes.extend(relevant_node_list.nodes)
+
+        updated_cc_nodes = None
+        if full_refresh or _missing_status(relevant_cc_nodes):
+            updated_cc_nodes = (await bindings.get_cluster_status(True)).nodes
+
+        return self._apply_refreshed_nodes(relevant_cc_nodes, updated_cc_nodes)
+
+    def _apply_refreshed_nodes(
+        self, relevant_cc_nodes: List[Dict], updated_cc_node_list: Optional[List[Dict]]
+    ) -> List[Node]:
+        """
+        Updates the state and node id of our nodes named in relevant_cc_nodes.
+        updated_cc_node_list is every node in the cluster, or None to use
+        relevant_cc_nodes themselves.
+        """
+        relevant_node_names = [n["Name"] for n in relevant_cc_nodes]
+
+        if updated_cc_node_list is None:
+            updated_cc_nodes = {n["Name"]: n for n in relevant_cc_nodes}
+        else:
+            updated_cc_nodes = partition_single(
+                updated_cc_node_list, lambda n: n["Name"]
+            )
 
         nodes_by_name = partition_single(self.get_nodes(), lambda n: n.name)
 
@@ -659,6 +1186,173 @@ class NodeManager:
 
         return ret
 
+    @apitrace
+    def refresh(self) -> bool:
+        """
+        Polls the cluster status and applies only what changed since the previous
+        poll. See apply_cluster_status_changes.
+        """
+        return self.apply_cluster_status_changes(
+            self.cluster_bindings.get_cluster_status_changes()
+        )
+
+    async def refresh_async(self) -> bool:
+        delta = await self.async_cluster_bindings.get_cluster_status_changes()
+        return self.apply_cluster_status_changes(delta)
+
+    def apply_cluster_status_changes(self, delta: ClusterStatusDelta) -> bool:
+        """
+        Applies new, changed and removed nodes and the new limits to the existing
+        buckets. Changes to a node's state or node id are applied in place, any
+        other change replaces the node.
+
+        Anything allocated since the previous poll is discarded: nodes that were
+        never created are dropped, the managed nodes get back all of their
+        resources and lose their assignments, and the bucket counters and limits
+        are reset to what CycleCloud reports. Unmanaged nodes are left as they are.
+
+        Returns False, without changing anything, if the nodearrays or buckets
+        themselves changed - create a new NodeManager instead.
+        """
+        cluster_status = delta.cluster_status
+        if delta.structure_changed and not self._matches_structure(cluster_status):
+            logging.info(
+                "Nodearrays or buckets changed, a new NodeManager is required."
+            )
+            return False
+
+        buckets_by_key = partition_single(
+            self.__node_buckets, lambda b: (b.bucket_id, b.placement_group)
+        )
+        nodes_by_name = {n.name: n for n in self.get_nodes()}
+
+        in_place: List[Tuple[Node, Dict]] = []
+        replace: List[Tuple[Dict, NodeBucket, NodearrayBucketStatus]] = []
+        status_buckets_by_node: Optional[Dict[str, NodearrayBucketStatus]] = None
+
+        # resolve where every record goes before changing anything
+        for record in delta.added_nodes + delta.changed_nodes:
+            existing = nodes_by_name.get(record["Name"])
+            if existing and _refreshable_in_place(existing, record):
+                in_place.append((existing, record))
+                continue
+
+            if status_buckets_by_node is None:
+                status_buckets_by_node = {}
+                for nodearray_status in cluster_status.nodearrays:
+                    for bucket_status in nodearray_status.buckets:
+                        for name in bucket_status.active_nodes or []:
+                            status_buckets_by_node[name] = bucket_status
+
+            bucket_status = status_buckets_by_node.get(record["Name"])
+            key = (
+                bucket_status.bucket_id if bucket_status else None,
+                record.get("PlacementGroupId"),
+            )
+            if key not in buckets_by_key:
+                logging.info(
+                    "No bucket for %s %s, a new NodeManager is required.",
+                    record["Name"],
+                    key,
+                )
+                return False
+            assert bucket_status
+            replace.append((record, buckets_by_key[key], bucket_status))
+
+        in_status = set([record["Name"] for record in cluster_status.nodes or []])
+        removed = set(delta.removed_nodes)
+        for bucket in self.__node_buckets:
+            bucket.rollback()
+            kept = []
+            for node in bucket.nodes:
+                if not node.managed:
+                    kept.append(node)
+                    continue
+                if node.name in in_status:
+                    _reset_node(node)
+                    kept.append(node)
+                    continue
+                # removed from CycleCloud, or allocated but never created
+                if node.name in removed:
+                    node.exists = False
+                    node.state = ht.NodeStatus("Off")
+                self._node_names.pop(node.name, None)
+            if len(kept) < len(bucket.nodes):
+                bucket.nodes = kept
+
+        for node, record in in_place:
+            # i.e. a node booted up since the previous poll
+            node.exists = True
+            node.state = ht.NodeStatus(str(record.get("Status")))
+            node.delayed_node_id.node_id = record["NodeId"]
+
+        for record, bucket, bucket_status in replace:
+            if record["Name"] in nodes_by_name:
+                self._remove_node_internally(nodes_by_name[record["Name"]])
+            node = _node_from_cc_node(record, bucket_status, bucket.location)
+            bucket.nodes.append(node)
+            self._node_names[node.name] = True
+            # unlike a node created from the bucket, it has none of the defaults
+            self._apply_defaults(node)
+
+        self._reset_limits(cluster_status)
+        return True
+
+    def _matches_structure(self, cluster_status: ClusterStatus) -> bool:
+        nodearrays_by_bucket_id = {}
+        for nodearray_status in cluster_status.nodearrays:
+            for bucket_status in nodearray_status.buckets:
+                nodearrays_by_bucket_id[bucket_status.bucket_id] = nodearray_status
+
+        buckets = [b for b in self.__node_buckets if not b._artificial]
+        if set(nodearrays_by_bucket_id) != set([b.bucket_id for b in buckets]):
+            return False
+
+        for bucket in buckets:
+            nodearray = nodearrays_by_bucket_id[bucket.bucket_id].nodearray
+            if (
+                bucket.location != nodearray["Region"]
+                or bucket.subnet != nodearray["SubnetId"]
+                or bucket.spot != nodearray.get("Interruptible", False)
+                or dict(bucket.software_configuration)
+                != nodearray.get("Configuration", {})
+            ):
+                return False
+
+        return True
+
+    def _reset_limits(self, cluster_status: ClusterStatus) -> None:
+        limits_builder = _LimitsBuilder(
+            self.cluster_bindings.cluster_name, cluster_status
+        )
+        by_bucket_id = {}
+        for nodearray_status in cluster_status.nodearrays:
+            for bucket_status in nodearray_status.buckets:
+                by_bucket_id[bucket_status.bucket_id] = (
+                    nodearray_status,
+                    bucket_status,
+                )
+
+        self.__query_candidates.clear()
+        if self.__limits_builder:
+            self.__limits_builder = limits_builder
+        for lazy_placement_groups in self.__lazy_placement_groups.values():
+            for lazy in lazy_placement_groups:
+                lazy.nodearray_status, lazy.bucket = by_bucket_id[lazy.bucket_id]
+
+        for bucket in self.__node_buckets:
+            if bucket.bucket_id not in by_bucket_id:
+                # i.e. unmanaged nodes
+                continue
+            nodearray_status, bucket_status = by_bucket_id[bucket.bucket_id]
+            pg_status = None
+            for pg in bucket_status.placement_groups or []:
+                if pg.name == bucket.placement_group:
+                    pg_status = pg
+            bucket.limits = limits_builder.bucket_limits(
+                nodearray_status, bucket_status, bucket.placement_group, pg_status
+            )
+
     @apitrace
     def bootup(
         self,
@@ -667,14 +1361,34 @@ class NodeManager:
     ) -> BootupResult:
         nodes = nodes or self.new_nodes
         if not nodes:
-            return BootupResult(
-                "success",
-                ht.OperationId(""),
-                request_id,
-                reasons=["No new nodes required or created."],
-            )
-        result: NodeCreationResult = self.__cluster_bindings.create_nodes(nodes)
+            return _nothing_to_bootup(request_id)
+
+        result: NodeCreationResult = self.cluster_bindings.create_nodes(nodes)
+        operation_ids, node_operations = self._creation_operations(nodes, result)
+        created_nodes = self._refresh_nodes_by_operations(operation_ids)
+        return self._bootup_result(
+            nodes, result, operation_ids, node_operations, created_nodes, request_id
+        )
 
+    async def bootup_async(
+        self,
+        nodes: Optional[List[Node]] = None,
+        request_id: Optional[ht.RequestId] = None,
+    ) -> BootupResult:
+        nodes = nodes or self.new_nodes
+        if not nodes:
+            return _nothing_to_bootup(request_id)
+
+        result = await self.async_cluster_bindings.create_nodes(nodes)
+        operation_ids, node_operations = self._creation_operations(nodes, result)
+        created_nodes = await self._refresh_nodes_by_operations_async(operation_ids)
+        return self._bootup_result(
+            nodes, result, operation_ids, node_operations, created_nodes, request_id
+        )
+
+    def _creation_operations(
+        self, nodes: List[Node], result: NodeCreationResult
+    ) -> Tuple[List[ht.OperationId], Dict[ht.NodeName, Tuple[ht.OperationId, int]]]:
         for s in result.sets:
             if s.message:
                 logging.info(s.message)
@@ -685,22 +1399,50 @@ class NodeManager:
             if creation_set.message:
                 logging.warn(result.message)
 
-        created_nodes = self.get_nodes_by_operation(result.operation_id)
+        if isinstance(result, MergedNodeCreationResult):
+            # one operation per creation set
+            return result.operation_ids, result.node_operations
+
+        return (
+            [result.operation_id],
+            {
+                node.name: (result.operation_id, offset)
+                for offset, node in enumerate(nodes)
+            },
+        )
 
+    def _bootup_result(
+        self,
+        nodes: List[Node],
+        result: NodeCreationResult,
+        operation_ids: List[ht.OperationId],
+        node_operations: Dict[ht.NodeName, Tuple[ht.OperationId, int]],
+        created_nodes: List[Node],
+        request_id: Optional[ht.RequestId],
+    ) -> BootupResult:
         new_node_mappings: Dict[str, Node] = partition_single(
             created_nodes, lambda n: n.name
         )
 
         started_nodes = []
-        for offset, node in enumerate(nodes):
-            node.delayed_node_id.operation_id = result.operation_id
-            node.delayed_node_id.operation_offset = offset
+        for node in nodes:
+            if node.name in node_operations:
+                operation_id, offset = node_operations[node.name]
+                node.delayed_node_id.operation_id = operation_id
+                node.delayed_node_id.operation_offset = offset
+
             if node.name in new_node_mappings:
                 started_nodes.append(node)
             else:
                 node.state = ht.NodeStatus("Unknown")
 
-        return BootupResult("success", result.operation_id, request_id, started_nodes)
+        return BootupResult(
+            "success",
+            result.operation_id,
+            request_id,
+            started_nodes,
+            operation_ids=operation_ids,
+        )
 
     @property
     def cluster_max_core_count(self) -> int:
@@ -820,16 +1562,18 @@ class NodeManager:
         constraints = constraintslib.get_constraints(selection)
 
         default_value_expr = str(default_value)
-        if not hasattr(default_value, "__call__"):
+        if (
+            isinstance(default_value, str)
+            and len(default_value) > 1
+            and default_value.startswith("`")
+            and default_value.endswith("`")
+        ):
+            # compiled once here, so syntax errors are reported at registration
+            default_value_func: DefaultValueFunc = NodeExpression(default_value[1:-1])
+
+        elif not hasattr(default_value, "__call__"):
 
             def default_value_func(node: Node) -> ht.ResourceTypeAtom:
-                # already checked if it has a call
-                if isinstance(default_value, str):
-                    if default_value.startswith("`") and default_value.endswith("`"):
-                        expr = default_value[1:-1]
-                        return eval(
-                            "(lambda: {})()".format(expr), {"node": node.clone()}
-                        )
                 return default_value  # type: ignore
 
         else:
@@ -844,71 +1588,207 @@ class NodeManager:
             modifier_magnitude,
         )
         self.__default_resources.append(dr)
+
+        if self.__default_resources_deferred:
+            self.__default_resources_pending = True
+            return
+
         self._apply_defaults_all()
 
+    @contextmanager
+    def batch_default_resources(self) -> Iterator[None]:
+        """
+        Defers applying default resources until the outermost batch exits, at which
+        point every registered default is applied once to each bucket and node.
+
+            with node_mgr.batch_default_resources():
+                node_mgr.add_default_resource({}, "ncpus", "node.vcpu_count")
+                node_mgr.add_default_resource({}, "ngpus", "node.gpu_count")
+        """
+        self.__default_resources_deferred += 1
+        try:
+            yield
+        finally:
+            self.__default_resources_deferred -= 1
+
+        if not self.__default_resources_deferred and self.__default_resources_pending:
+            self._apply_defaults_all()
+
     def _apply_defaults_all(self) -> None:
+        self.__default_resources_pending = False
+        self.__bucket_pending_defaults.clear()
+        # which buckets satisfy a query depends on their resources
+        self.__query_candidates.clear()
 
-        for dr in self.__default_resources:
-            for bucket in self.get_buckets():
-                dr.apply_default(bucket.example_node)
-                bucket.resources.update(bucket.example_node.available)
+        for bucket in self.get_buckets():
+            self._apply_defaults(bucket.example_node)
+            bucket.resources.update(bucket.example_node.available)
 
-            for node in self.get_nodes():
-                dr.apply_default(node)
+        for node in self.get_nodes():
+            self._apply_defaults(node)
 
-    def _apply_defaults(self, node: Node) -> None:
-        for dr in self.__default_resources:
-            dr.apply_default(node)
+    def _apply_defaults(
+        self, node: Node, defaults: Optional[List["_DefaultResource"]] = None
+    ) -> None:
+        pending = self.__default_resources if defaults is None else defaults
+        # a default may select on a resource that a later default defines, so
+        # keep sweeping until a sweep resolves nothing new.
+        while pending:
+            unresolved = [dr for dr in pending if not dr.apply_default(node)]
+            if len(unresolved) == len(pending):
+                break
+            pending = unresolved
+
+    def _apply_bucket_defaults(self, bucket: NodeBucket, node: Node) -> None:
+        """
+        Nodes created from a bucket start with the bucket's resources, which already
+        include every default its example node resolved, so only the defaults the
+        example node did not select need to be evaluated per node.
+        """
+        pending = self._pending_defaults(bucket)
+        if pending:
+            self._apply_defaults(node, pending)
+
+    def _pending_defaults(self, bucket: NodeBucket) -> List["_DefaultResource"]:
+        key = (bucket.bucket_id, bucket.placement_group)
+        pending = self.__bucket_pending_defaults.get(key)
+
+        if pending is None:
+            example_resources = bucket.example_node._resources
+            pending = [
+                dr
+                for dr in self.__default_resources
+                if example_resources.get(dr.resource_name) is None
+            ]
+            self.__bucket_pending_defaults[key] = pending
+        return pending
 
     @apitrace
     def deallocate_nodes(self, nodes: List[Node]) -> DeallocateResult:
         return self._nodes_operation(
-            nodes, self.__cluster_bindings.deallocate_nodes, DeallocateResult
+            nodes, self.cluster_bindings.deallocate_nodes, DeallocateResult
         )
 
     @apitrace
     def delete(self, nodes: List[Node]) -> DeleteResult:
         return self._nodes_operation(
-            nodes, self.__cluster_bindings.delete_nodes, DeleteResult
+            nodes, self.cluster_bindings.delete_nodes, DeleteResult
         )
 
     @apitrace
     def remove_nodes(self, nodes: List[Node]) -> RemoveResult:
         return self._nodes_operation(
-            nodes, self.__cluster_bindings.shutdown_nodes, RemoveResult
+            nodes, self.cluster_bindings.shutdown_nodes, RemoveResult
         )
 
     @apitrace
     def shutdown_nodes(self, nodes: List[Node]) -> ShutdownResult:
         return self._nodes_operation(
-            nodes, self.__cluster_bindings.shutdown_nodes, ShutdownResult
+            nodes, self.cluster_bindings.shutdown_nodes, ShutdownResult
         )
 
     @apitrace
     def start_nodes(self, nodes: List[Node]) -> StartResult:
         return self._nodes_operation(
-            nodes, self.__cluster_bindings.start_nodes, StartResult
+            nodes, self.cluster_bindings.start_nodes, StartResult
         )
 
     @apitrace
     def terminate_nodes(self, nodes: List[Node]) -> TerminateResult:
         return self._nodes_operation(
-            nodes, self.__cluster_bindings.terminate_nodes, TerminateResult
+            nodes, self.cluster_bindings.terminate_nodes, TerminateResult
         )
 
     @property
     def cluster_bindings(self) -> ClusterBindingInterface:
+        if self.__cluster_bindings is None:
+            raise RuntimeError(
+                "This NodeManager has no cluster bindings, it can only allocate."
+            )
         return self.__cluster_bindings
 
+    @property
+    def async_cluster_bindings(self) -> AsyncClusterBindingInterface:
+        """
+        Used by the *_async methods. Unless set explicitly, i.e. by
+        new_node_manager_async, the cluster_bindings are called in the event
+        loop's default executor.
+        """
+        if self.__async_cluster_bindings is None:
+            self.__async_cluster_bindings = AsyncClusterBindingAdapter(
+                self.cluster_bindings
+            )
+        return self.__async_cluster_bindings
+
+    @async_cluster_bindings.setter
+    def async_cluster_bindings(self, value: AsyncClusterBindingInterface) -> None:
+        self.__async_cluster_bindings = value
+
+    async def deallocate_nodes_async(self, nodes: List[Node]) -> DeallocateResult:
+        return await self._nodes_operation_async(
+            nodes, self.async_cluster_bindings.deallocate_nodes, DeallocateResult
+        )
+
+    async def delete_async(self, nodes: List[Node]) -> DeleteResult:
+        return await self._nodes_operation_async(
+            nodes, self.async_cluster_bindings.delete_nodes, DeleteResult
+        )
+
+    async def remove_nodes_async(self, nodes: List[Node]) -> RemoveResult:
+        return await self._nodes_operation_async(
+            nodes, self.async_cluster_bindings.shutdown_nodes, RemoveResult
+        )
+
+    async def shutdown_nodes_async(self, nodes: List[Node]) -> ShutdownResult:
+        return await self._nodes_operation_async(
+            nodes, self.async_cluster_bindings.shutdown_nodes, ShutdownResult
+        )
+
+    async def start_nodes_async(self, nodes: List[Node]) -> StartResult:
+        return await self._nodes_operation_async(
+            nodes, self.async_cluster_bindings.start_nodes, StartResult
+        )
+
+    async def terminate_nodes_async(self, nodes: List[Node]) -> TerminateResult:
+        return await self._nodes_operation_async(
+            nodes, self.async_cluster_bindings.terminate_nodes, TerminateResult
+        )
+
     def _nodes_operation(
-        self,
-        nodes: List[Node],
-        function: Callable[[List[Node]], NodeManagementResult],
-        ctor: Callable[[str, ht.OperationId, Optional[ht.RequestId], List[Node]], T],
+        self, nodes: List[Node], function: NodesOperation, ctor: Callable[..., T],
+    ) -> T:
+        op_name = function.__name__
+        managed_nodes = self._managed_nodes(nodes, op_name)
+        if not managed_nodes:
+            return ctor("success", ht.OperationId(""), None, [])
+
+        results, failures = self._chunked_nodes_operation(managed_nodes, function)
+
+        # force the node.state to be updated
+        self._refresh_nodes_by_operations([r.operation_id for r in results])
+
+        return self._nodes_operation_result(nodes, results, failures, op_name, ctor)
+
+    async def _nodes_operation_async(
+        self, nodes: List[Node], function: AsyncNodesOperation, ctor: Callable[..., T],
     ) -> T:
+        op_name = function.__name__
+        managed_nodes = self._managed_nodes(nodes, op_name)
+        if not managed_nodes:
+            return ctor("success", ht.OperationId(""), None, [])
+
+        results, failures = await self._chunked_nodes_operation_async(
+            managed_nodes, function
+        )
+
+        # force the node.state to be updated
+        await self._refresh_nodes_by_operations_async([r.operation_id for r in results])
+
+        return self._nodes_operation_result(nodes, results, failures, op_name, ctor)
+
+    def _managed_nodes(self, nodes: List[Node], op_name: str) -> List[Node]:
         managed_nodes = [node for node in nodes if node.managed]
         unmanaged_node_names = [node.name for node in nodes if not node.managed]
-        op_name = function.__name__
 
         if unmanaged_node_names:
             logging.warning(
@@ -919,19 +1799,26 @@ class NodeManager:
 
         if not managed_nodes:
             logging.warning("No nodes to {}".format(op_name))
-            return ctor("success", ht.OperationId(""), None, [])
 
-        result: NodeManagementResult = function(managed_nodes)
+        return managed_nodes
+
+    def _nodes_operation_result(
+        self,
+        nodes: List[Node],
+        results: List[NodeManagementResult],
+        failures: List[str],
+        op_name: str,
+        ctor: Callable[..., T],
+    ) -> T:
+        operation_ids = [ht.OperationId(r.operation_id) for r in results]
 
         by_name = partition_single(nodes, lambda n: n.name, strict=False)
-        mgmt_by_name: Dict[ht.NodeName, NodeManagementResultNode]
-        mgmt_by_name = partition_single(result.nodes, lambda n: n.name)
+        mgmt_by_name: Dict[ht.NodeName, NodeManagementResultNode] = {}
+        for result in results:
+            mgmt_by_name.update(partition_single(result.nodes, lambda n: n.name))
 
         affected_nodes: List[Node] = []
 
-        # force the node.state to be updated
-        self.get_nodes_by_operation(result.operation_id)
-
         for name, mgmt_node in mgmt_by_name.items():
             assert isinstance(mgmt_node, NodeManagementResultNode)
 
@@ -940,7 +1827,7 @@ class NodeManager:
 
             node = by_name[name]
             if mgmt_node.status != "OK":
-                logging.warning("%s was unaffected by call %s", node, function.__name__)
+                logging.warning("%s was unaffected by call %s", node, op_name)
                 continue
 
             affected_nodes.append(node)
@@ -948,10 +1835,112 @@ class NodeManager:
             if node.state in ["Terminating", "Off"]:
                 self._remove_node_internally(node)
 
+        # some chunks failed. The result is falsy, though nodes is still what the
+        # other chunks affected.
+        status = "partial" if failures else "success"
         return ctor(
-            "success", ht.OperationId(result.operation_id), None, affected_nodes
+            status,
+            operation_ids[0],
+            None,
+            affected_nodes,
+            reasons=failures,
+            operation_ids=operation_ids,
+        )
+
+    def _node_chunks(self, nodes: List[Node]) -> List[List[Node]]:
+        batch_size = max(1, self.node_operation_batch_size)
+        return [
+            nodes[i : i + batch_size]  # noqa: E203
+            for i in range(0, len(nodes), batch_size)
+        ]
+
+    def _chunked_nodes_operation(
+        self, nodes: List[Node], function: NodesOperation,
+    ) -> Tuple[List[NodeManagementResult], List[str]]:
+        """
+        Splits nodes into chunks of node_operation_batch_size and calls function on
+        each, concurrently. Returns the successful results, in chunk order, and a
+        reason for every chunk that failed. If every chunk fails, the first error
+        is raised.
+        """
+        chunks = self._node_chunks(nodes)
+
+        if len(chunks) == 1:
+            return [function(chunks[0])], []
+
+        op_name = function.__name__
+        workers = max(1, min(self.node_operation_concurrency, len(chunks)))
+        logging.debug(
+            "Calling %s on %d nodes in %d chunks with %d workers",
+            op_name,
+            len(nodes),
+            len(chunks),
+            workers,
+        )
+
+        results: List[NodeManagementResult] = []
+        failures: List[str] = []
+        first_error: Optional[Exception] = None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(function, chunk) for chunk in chunks]
+
+            for n, future in enumerate(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    first_error = first_error or e
+                    failures.append(_chunk_failure(op_name, n, chunks, e))
+
+        if not results:
+            assert first_error
+            raise first_error
+
+        return results, failures
+
+    async def _chunked_nodes_operation_async(
+        self, nodes: List[Node], function: AsyncNodesOperation,
+    ) -> Tuple[List[NodeManagementResult], List[str]]:
+        """
+        See _chunked_nodes_operation - at most node_operation_concurrency chunks
+        are awaited at once.
+        """
+        chunks = self._node_chunks(nodes)
+
+        if len(chunks) == 1:
+            return [await function(chunks[0])], []
+
+        op_name = function.__name__
+        semaphore = asyncio.Semaphore(max(1, self.node_operation_concurrency))
+
+        async def call(chunk: List[Node]) -> NodeManagementResult:
+            async with semaphore:
+                return await function(chunk)
+
+        outcomes = await asyncio.gather(
+            *[call(chunk) for chunk in chunks], return_exceptions=True
         )
 
+        results: List[NodeManagementResult] = []
+        failures: List[str] = []
+        first_error: Optional[Exception] = None
+
+        for n, outcome in enumerate(outcomes):
+            if isinstance(outcome, Exception):
+                first_error = first_error or outcome
+                failures.append(_chunk_failure(op_name, n, chunks, outcome))
+            elif isinstance(outcome, BaseException):
+                # i.e. CancelledError
+                raise outcome
+            else:
+                results.append(outcome)
+
+        if not results:
+            assert first_error
+            raise first_error
+
+        return results, failures
+
     def _remove_node_internally(self, node: Node) -> None:
         by_bucket_id_and_pg = partition_single(
             self.__node_buckets, lambda b: (b.bucket_id, b.placement_group)
@@ -983,15 +1972,16 @@ class NodeManager:
         bucket.nodes.remove(node)
 
     def set_system_default_resources(self) -> None:
-        self.add_default_resource({}, "ncpus", "node.vcpu_count")
-        self.add_default_resource({}, "pcpus", "node.pcpu_count")
-        self.add_default_resource({}, "ngpus", "node.gpu_count")
-        self.add_default_resource({}, "memb", MemoryDefault("b"))
-        self.add_default_resource({}, "memkb", MemoryDefault("k"))
-        self.add_default_resource({}, "memmb", MemoryDefault("m"))
-        self.add_default_resource({}, "memgb", MemoryDefault("g"))
-        self.add_default_resource({}, "memtb", MemoryDefault("t"))
-        self.add_default_resource({}, "nodearray", "node.nodearray")
+        with self.batch_default_resources():
+            self.add_default_resource({}, "ncpus", "node.vcpu_count")
+            self.add_default_resource({}, "pcpus", "node.pcpu_count")
+            self.add_default_resource({}, "ngpus", "node.gpu_count")
+            self.add_default_resource({}, "memb", MemoryDefault("b"))
+            self.add_default_resource({}, "memkb", MemoryDefault("k"))
+            self.add_default_resource({}, "memmb", MemoryDefault("m"))
+            self.add_default_resource({}, "memgb", MemoryDefault("g"))
+            self.add_default_resource({}, "memtb", MemoryDefault("t"))
+            self.add_default_resource({}, "nodearray", "node.nodearray")
 
     def example_node(self, location: str, vm_size: str) -> Node:
         aux_info = vm_sizes.get_aux_vm_size_info(location, vm_size)
@@ -1069,6 +2059,101 @@ class GetFromBaseNode:
         return "node.{}".format(self.attr)
 
 
+class NodeExpression:
+    """
+    A backtick default value, i.e. `node.vcpu_count - 1`. The expression is
+    compiled once and evaluated against a read-only view of each node, rather than
+    a clone of it. Evaluation errors are logged once per expression and the
+    default is left undefined for the failing node.
+    """
+
+    def __init__(self, expr: str) -> None:
+        self.expr = expr
+        try:
+            self.__code = compile(expr.strip(), "<default_resources>", "eval")
+        except SyntaxError as e:
+            raise RuntimeError(
+                "Invalid default resource expression `{}`: {}".format(expr, e)
+            )
+        self.__reported = False
+
+    def __call__(self, node: Node) -> ht.ResourceTypeAtom:
+        try:
+            return eval(self.__code, {"node": _ReadOnlyNode(node)})
+        except Exception as e:
+            if not self.__reported:
+                self.__reported = True
+                logging.error(
+                    "Could not evaluate default resource expression `%s` for %s: %s."
+                    + " Further errors for this expression will be logged at debug.",
+                    self.expr,
+                    node,
+                    e,
+                )
+            else:
+                logging.debug(
+                    "Could not evaluate default resource expression `%s` for %s: %s",
+                    self.expr,
+                    node,
+                    e,
+                )
+            raise _DefaultValueUnavailable()
+
+    def __repr__(self) -> str:
+        return "`{}`".format(self.expr)
+
+
+class _DefaultValueUnavailable(Exception):
+    pass
+
+
+class _ReadOnlyNode:
+    """
+    Exposes the attributes of a node to a default resource expression without
+    letting the expression modify it. Containers are returned as read-only views
+    and methods, which may modify the node, are not exposed.
+    """
+
+    __slots__ = ("_ReadOnlyNode__node",)
+
+    def __init__(self, node: Node) -> None:
+        object.__setattr__(self, "_ReadOnlyNode__node", node)
+
+    def __getattr__(self, attr: str) -> Any:
+        value = getattr(self.__node, attr)
+
+        if isinstance(value, dict):
+            return MappingProxyType(value)
+
+        if isinstance(value, list):
+            return tuple(value)
+
+        if isinstance(value, set):
+            return frozenset(value)
+
+        if isinstance(value, MethodType):
+            raise AttributeError(
+                "node.{}() is not available in default resource expressions".format(
+                    attr
+                )
+            )
+
+        return value
+
+    def __setattr__(self, attr: str, value: Any) -> None:
+        raise AttributeError(
+            "Default resource expressions can not modify node.{}".format(attr)
+        )
+
+    def __delattr__(self, attr: str) -> None:
+        raise AttributeError(
+            "Default resource expressions can not modify node.{}".format(attr)
+        )
+
+    def __repr__(self) -> str:
+        return repr(self.__node)
+
+
 class MemoryDefault:
     def __init__(self, mag: ht.MemoryMagnitude):
         self.mag = mag
@@ -1080,6 +2165,56 @@ class MemoryDefault:
         return "node.memory[{}]".format(self.mag)
 
 
+def _remaining_share(node: Node, requests: Dict[str, float]) -> float:
+    """
+    The sum of the fraction left of each requested resource, i.e. 0 for a node that
+    is full and len(requests) for an empty one.
+    """
+    ret = 0.0
+    # node.resources copies the dict on every call
+    resources = node._resources
+    for attr in requests:
+        total = resources.get(attr)
+        available = node.available.get(attr)
+        if isinstance(total, bool) or not isinstance(total, (int, float, ht.Memory)):
+            continue
+        if not isinstance(available, (int, float, ht.Memory)) or float(total) <= 0:
+            continue
+        ret += float(available) / float(total)
+    return ret
+
+
+def _missing_status(cc_nodes: List[Dict]) -> bool:
+    # the operation's node records already carry the Status and NodeId, so
+    # only fetch every node in the cluster if we have to.
+    return any([n.get("Status") is None for n in cc_nodes])
+
+
+def _nothing_to_bootup(request_id: Optional[ht.RequestId]) -> BootupResult:
+    return BootupResult(
+        "success",
+        ht.OperationId(""),
+        request_id,
+        reasons=["No new nodes required or created."],
+    )
+
+
+def _chunk_failure(
+    op_name: str, n: int, chunks: List[List[Node]], error: Exception
+) -> str:
+    chunk = chunks[n]
+    msg = "{} failed for chunk {}/{} ({} nodes: {}): {}".format(
+        op_name,
+        n + 1,
+        len(chunks),
+        len(chunk),
+        ",".join([node.name for node in chunk]),
+        error,
+    )
+    logging.error(msg)
+    return msg
+
+
 @apitrace
 def new_node_manager(
     config: dict,
@@ -1091,42 +2226,80 @@ def new_node_manager(
 
     ret = _new_node_manager_79(new_cluster_bindings(config), config)
     existing_nodes = existing_nodes or []
+    _configure_node_manager(ret, config, disable_default_resources)
+    return ret
 
-    if not disable_default_resources:
-        ret.set_system_default_resources()
 
-    for entry in config.get("default_resources", []):
+async def new_node_manager_async(
+    config: dict,
+    existing_nodes: Optional[List[UnmanagedNode]] = None,
+    disable_default_resources: bool = False,
+) -> NodeManager:
+    """
+    Same as new_node_manager, except the cluster status and node list are fetched
+    concurrently without blocking the event loop, and the returned NodeManager's
+    *_async methods use the same async bindings.
+    """
+    logging.initialize_logging(config)
 
-        try:
-            assert isinstance(entry["select"], dict)
-            assert isinstance(entry["name"], str)
-            assert isinstance(entry["value"], (str, int, float, bool))
-        except AssertionError as e:
-            raise RuntimeError(
-                "default_resources: Expected select=dict name=str value=str|int|float|bool: {}".format(
-                    e
-                )
-            )
-        modifier = None
-        for op in ["add", "subtract", "multiply", "divide", "divide_floor"]:
-            if op in entry:
-                if modifier:
-                    raise RuntimeError(
-                        "Can not support more than one modifier for default resources at this time. {}".format(
-                            entry
-                        )
-                    )
-                modifier = op
+    bindings = new_async_cluster_bindings(config)
+    cluster_status, nodes_list = await asyncio.gather(
+        bindings.get_cluster_status(nodes=True), bindings.get_nodes()
+    )
+    ret = _new_node_manager_79(
+        bindings.sync_bindings, config, cluster_status, nodes_list
+    )
+    ret.async_cluster_bindings = bindings
+    existing_nodes = existing_nodes or []
+    _configure_node_manager(ret, config, disable_default_resources)
+    return ret
 
-        ret.add_default_resource(
-            entry["select"],
-            entry["name"],
-            entry["value"],
-            modifier,
-            entry.get(modifier, None),
-        )
 
-    return ret
+def _configure_node_manager(
+    ret: NodeManager, config: dict, disable_default_resources: bool
+) -> None:
+    ret.node_operation_batch_size = int(
+        config.get("node_operation_batch_size", ret.node_operation_batch_size)
+    )
+    ret.node_operation_concurrency = int(
+        config.get("node_operation_concurrency", ret.node_operation_concurrency)
+    )
+
+    # register every default first so they are applied in a single pass
+    with ret.batch_default_resources():
+        if not disable_default_resources:
+            ret.set_system_default_resources()
+
+        for entry in config.get("default_resources", []):
+
+            try:
+                assert isinstance(entry["select"], dict)
+                assert isinstance(entry["name"], str)
+                assert isinstance(entry["value"], (str, int, float, bool))
+            except AssertionError as e:
+                raise RuntimeError(
+                    "default_resources: Expected select=dict name=str value=str|int|float|bool: {}".format(
+                        e
+                    )
+                )
+            modifier = None
+            for op in ["add", "subtract", "multiply", "divide", "divide_floor"]:
+                if op in entry:
+                    if modifier:
+                        raise RuntimeError(
+                            "Can not support more than one modifier for default resources at this time. {}".format(
+                                entry
+                            )
+                        )
+                    modifier = op
+
+            ret.add_default_resource(
+                entry["select"],
+                entry["name"],
+                entry["value"],
+                modifier,
+                entry.get(modifier, None),
+            )
 
 
 def _cluster_limits(cluster_name: str, cluster_status: ClusterStatus) -> _SharedLimit:
@@ -1150,14 +2323,35 @@ def _cluster_limits(cluster_name: str, cluster_status: ClusterStatus) -> _Shared
 
 
 def _new_node_manager_79(
-    cluster_bindings: ClusterBindingInterface, autoscale_config: Dict,
+    cluster_bindings: ClusterBindingInterface,
+    autoscale_config: Dict,
+    cluster_status: Optional[ClusterStatus] = None,
+    nodes_list: Optional[NodeList] = None,
 ) -> NodeManager:
-    cluster_status = cluster_bindings.get_cluster_status(nodes=True)
-    nodes_list = cluster_bindings.get_nodes()
-
     # to make it trivial to mimic 'onprem' nodes by simply filtering them out
     # of the response.
     mimic_on_prem = autoscale_config.get("_mimic_on_prem", [])
+
+    # the records are only referenced by this function, so there is no need to copy
+    # them while building the nodes.
+    owns_records = False
+    if cluster_status is None and autoscale_config.get("stream_nodes"):
+        # fetch the node records once, incrementally, instead of as part of both
+        # the status and the node list.
+        cluster_status = cluster_bindings.get_cluster_status(nodes=False)
+        skip_names = set(mimic_on_prem)
+        cluster_status.nodes = list(
+            cluster_bindings.iter_nodes(skip=lambda n: n["Name"] in skip_names)
+        )
+        nodes_list = NodeList(nodes=cluster_status.nodes)
+        owns_records = True
+        mimic_on_prem = []
+
+    if cluster_status is None:
+        cluster_status = cluster_bindings.get_cluster_status(nodes=True)
+    if nodes_list is None:
+        nodes_list = cluster_bindings.get_nodes()
+
     if mimic_on_prem:
         nodes_list.nodes = [
             n for n in nodes_list.nodes if n["Name"] not in mimic_on_prem
@@ -1169,17 +2363,15 @@ def _new_node_manager_79(
     all_node_names = [n["Name"] for n in nodes_list.nodes]
 
     buckets = []
+    # predefined placement groups without nodes, when they are built on first use
+    lazy_placement_groups: List[_LazyPlacementGroup] = []
+    lazy = bool(autoscale_config.get("lazy_placement_groups"))
 
-    cluster_limit = _cluster_limits(cluster_bindings.cluster_name, cluster_status)
-    cc_nodes_by_template = partition(cluster_status.nodes, lambda n: n["Template"])
-
-    nodearray_limits: Dict[str, _SharedLimit] = {}
-    regional_limits: Dict[str, _SharedLimit] = {}
-    family_limits: Dict[str, _SharedLimit] = {}
+    limits_builder = _LimitsBuilder(cluster_bindings.cluster_name, cluster_status)
+    cc_nodes_by_name = {n["Name"]: n for n in cluster_status.nodes}
 
     for nodearray_status in cluster_status.nodearrays:
         nodearray = nodearray_status.nodearray
-        region = nodearray["Region"]
 
         custom_resources = deepcopy(
             ht.ResourceDict(
@@ -1188,46 +2380,8 @@ def _new_node_manager_79(
                 .get("resources", {})
             )
         )
-        active_na_core_count = 0
-        active_na_count = 0
-        for cc_node in cc_nodes_by_template.get(nodearray_status.name, []):
-            aux_vm_info = vm_sizes.get_aux_vm_size_info(region, cc_node["MachineType"])
-            active_na_count += 1
-            active_na_core_count += aux_vm_info.vcpu_count
-
-        nodearray_limits[nodearray_status.name] = _SharedLimit(
-            "NodeArray({})".format(nodearray_status.name),
-            active_na_core_count,
-            nodearray_status.max_core_count,  # noqa: E128,
-            active_na_count,
-            nodearray_status.max_count,
-        )
-
-        spot = nodearray.get("Interruptible", False)
 
         for bucket in nodearray_status.buckets:
-            vcpu_count = bucket.virtual_machine.vcpu_count
-
-            aux_vm_info = vm_sizes.get_aux_vm_size_info(
-                region, bucket.definition.machine_type
-            )
-            assert isinstance(aux_vm_info, vm_sizes.AuxVMSizeInfo)
-            vm_family = aux_vm_info.vm_family
-
-            if region not in regional_limits:
-                regional_limits[region] = _SharedLimit(
-                    "Region({})".format(region),
-                    bucket.regional_consumed_core_count,
-                    bucket.regional_quota_core_count,
-                )
-
-            if vm_family not in family_limits:
-                family_limits[vm_family] = _SharedLimit(
-                    "VM Family({})".format(vm_family),
-                    bucket.family_consumed_core_count,
-                    bucket.family_quota_core_count,
-                )
-
             placement_groups = partition_single(
                 bucket.placement_groups, lambda p: p.name
             )
@@ -1247,8 +2401,10 @@ def _new_node_manager_79(
             if hardcoded_pg:
                 predefined_pgs.append(hardcoded_pg)
 
+            predefined_only = set()
             for predef_pg in predefined_pgs:
                 if predef_pg not in placement_groups:
+                    predefined_only.add(predef_pg)
                     placement_groups[predef_pg] = PlacementGroupStatus(
                         active_core_count=0, active_count=0, name=predef_pg
                     )
@@ -1259,94 +2415,40 @@ def _new_node_manager_79(
                 placement_groups[None] = None
 
             for pg_name, pg_status in placement_groups.items():
-
-                placement_group_limit = None
-                if pg_name:
-                    placement_group_limit = _SharedLimit(
-                        "PlacementGroup({})".format(pg_name),
-                        consumed_core_count=pg_status.active_core_count,
-                        max_core_count=bucket.max_placement_group_size * vcpu_count,
-                    )
-
-                vm_size = bucket.definition.machine_type
-                location = nodearray["Region"]
-                subnet = nodearray["SubnetId"]
-
-                bucket_memory_gb = nodearray.get("Memory") or (
-                    bucket.virtual_machine.memory
-                )
-                bucket_memory = ht.Memory(bucket_memory_gb, "g")
-
-                bucket_id = bucket.bucket_id
-
-                nodearray_name = nodearray_status.name
-
-                # TODO the bucket has a list of node names
                 cc_node_records = [
-                    n
-                    for n in cluster_status.nodes
-                    if n["Name"] in bucket.active_nodes
-                    and n.get("PlacementGroupId") == pg_name
+                    cc_nodes_by_name[name]
+                    for name in bucket.active_nodes
+                    if name in cc_nodes_by_name
+                    and cc_nodes_by_name[name].get("PlacementGroupId") == pg_name
                 ]
 
-                family_limit: Union[_SpotLimit, _SharedLimit] = family_limits[vm_family]
-                if nodearray.get("Interruptible"):
-                    # enabling spot/interruptible 0's out the family limit response
-                    # as the regional limit is supposed to be used in its place,
-                    # however that responsibility is on the caller and not the
-                    # REST api. For this library we handle that for them.
-                    family_limit = _SpotLimit(regional_limits[region])
-
-                bucket_limit = BucketLimits(
-                    vcpu_count,
-                    regional_limits[region],
-                    cluster_limit,
-                    nodearray_limits[nodearray_name],
-                    family_limit,
-                    placement_group_limit,
-                    active_core_count=bucket.active_core_count,
-                    active_count=bucket.active_count,
-                    available_core_count=bucket.available_core_count,
-                    available_count=bucket.available_count,
-                    max_core_count=bucket.max_core_count,
-                    max_count=bucket.max_count,
+                if lazy and pg_name in predefined_only and not cc_node_records:
+                    lazy_placement_groups.append(
+                        _LazyPlacementGroup(
+                            nodearray_status, bucket, pg_name, custom_resources
+                        )
+                    )
+                    continue
+
+                bucket_limit = limits_builder.bucket_limits(
+                    nodearray_status, bucket, pg_name, pg_status
                 )
 
                 nodes = []
 
                 for cc_node_rec in cc_node_records:
-                    node = _node_from_cc_node(cc_node_rec, bucket, region)
+                    node = _node_from_cc_node(
+                        cc_node_rec, bucket, nodearray["Region"], copy=not owns_records
+                    )
                     nodes.append(node)
 
-                node_def = NodeDefinition(
-                    nodearray=nodearray_name,
-                    bucket_id=bucket_id,
-                    vm_size=vm_size,
-                    location=location,
-                    spot=spot,
-                    subnet=subnet,
-                    vcpu_count=vcpu_count,
-                    memory=bucket_memory,
-                    placement_group=pg_name,
-                    resources=custom_resources,
-                    software_configuration=ImmutableOrderedDict(
-                        nodearray.get("Configuration", {})
-                    ),
-                )
-
-                def nodes_key(n: Node) -> Tuple[str, int]:
-
-                    try:
-                        name, index = n.name.rsplit("-", 1)
-                        return (name, int(index))
-                    except Exception:
-                        return (n.name, 0)
-
-                node_bucket = NodeBucket(
-                    node_def,
-                    limits=bucket_limit,
-                    max_placement_group_size=bucket.max_placement_group_size,
-                    nodes=sorted(nodes, key=nodes_key),
+                node_bucket = _new_bucket(
+                    nodearray_status,
+                    bucket,
+                    pg_name,
+                    bucket_limit,
+                    nodes,
+                    custom_resources,
                 )
 
                 logging.debug(
@@ -1355,14 +2457,249 @@ def _new_node_manager_79(
                 buckets.append(node_bucket)
 
     ret = NodeManager(cluster_bindings, buckets)
+    ret._add_lazy_placement_groups(lazy_placement_groups, limits_builder)
     for name in all_node_names:
         ret._node_names[name] = True
     return ret
 
 
+def _reset_node(node: Node) -> None:
+    """Undoes allocating and assigning, leaving the node as CycleCloud reported it"""
+    if (
+        node._allocated
+        or node.assignments
+        or node.closed
+        or node.available != node._resources
+    ):
+        node._restore((deepcopy(node._resources), set(), False, False))
+
+
+def _refreshable_in_place(node: Node, cc_node_rec: Dict) -> bool:
+    return (
+        node.hostname == cc_node_rec.get("Hostname")
+        and node.private_ip == cc_node_rec.get("PrivateIp")
+        and node.keep_alive == cc_node_rec.get("KeepAlive", False)
+        and (node.placement_group or None) == cc_node_rec.get("PlacementGroupId")
+        and dict(node.software_configuration) == cc_node_rec.get("Configuration", {})
+    )
+
+
+def _placement_group_request(
+    constraints: Iterable[constraintslib.NodeConstraint],
+) -> Tuple[bool, Set[str]]:
+    """Whether the constraints allow any placement group, and those they name"""
+    any_placement_group = False
+    names: Set[str] = set()
+    for constraint in constraints:
+        if isinstance(constraint, constraintslib.InAPlacementGroup):
+            any_placement_group = True
+        elif (
+            isinstance(constraint, constraintslib.NodePropertyConstraint)
+            and constraint.attr == "placement_group"
+        ):
+            names.update([str(v) for v in constraint.values if v])
+        child_any, child_names = _placement_group_request(constraint.get_children())
+        any_placement_group = any_placement_group or child_any
+        names.update(child_names)
+    return any_placement_group, names
+
+
+def _new_bucket(
+    nodearray_status: Any,
+    bucket: NodearrayBucketStatus,
+    pg_name: Optional[ht.PlacementGroup],
+    limits: BucketLimits,
+    nodes: List[Node],
+    custom_resources: ht.ResourceDict,
+) -> NodeBucket:
+    nodearray = nodearray_status.nodearray
+    node_def = NodeDefinition(
+        nodearray=nodearray_status.name,
+        bucket_id=bucket.bucket_id,
+        vm_size=bucket.definition.machine_type,
+        location=nodearray["Region"],
+        spot=nodearray.get("Interruptible", False),
+        subnet=nodearray["SubnetId"],
+        vcpu_count=bucket.virtual_machine.vcpu_count,
+        memory=ht.Memory(nodearray.get("Memory") or bucket.virtual_machine.memory, "g"),
+        placement_group=pg_name,
+        resources=custom_resources,
+        software_configuration=ImmutableOrderedDict(nodearray.get("Configuration", {})),
+    )
+
+    def nodes_key(n: Node) -> Tuple[str, int]:
+
+        try:
+            name, index = n.name.rsplit("-", 1)
+            return (name, int(index))
+        except Exception:
+            return (n.name, 0)
+
+    return NodeBucket(
+        node_def,
+        limits=limits,
+        max_placement_group_size=bucket.max_placement_group_size,
+        nodes=sorted(nodes, key=nodes_key),
+    )
+
+
+class _LazyPlacementGroup:
+    """
+    Stands in for the bucket of a predefined placement group that has no nodes,
+    until a request may use it. See NodeManager._materialize_placement_groups
+    """
+
+    def __init__(
+        self,
+        nodearray_status: Any,
+        bucket: NodearrayBucketStatus,
+        name: ht.PlacementGroup,
+        custom_resources: ht.ResourceDict,
+    ) -> None:
+        self.nodearray_status = nodearray_status
+        self.bucket = bucket
+        self.name = name
+        self.custom_resources = custom_resources
+
+    @property
+    def bucket_id(self) -> ht.BucketId:
+        return self.bucket.bucket_id
+
+    def materialize(self, limits_builder: "_LimitsBuilder") -> NodeBucket:
+        pg_status = PlacementGroupStatus(
+            active_core_count=0, active_count=0, name=self.name
+        )
+        limits = limits_builder.bucket_limits(
+            self.nodearray_status, self.bucket, self.name, pg_status
+        )
+        return _new_bucket(
+            self.nodearray_status,
+            self.bucket,
+            self.name,
+            limits,
+            [],
+            self.custom_resources,
+        )
+
+    def __str__(self) -> str:
+        return "LazyPlacementGroup({}, {}, pg={})".format(
+            self.nodearray_status.name, self.bucket.definition.machine_type, self.name,
+        )
+
+    def __repr__(self) -> str:
+        return str(self)
+
+
+class _LimitsBuilder:
+    """
+    Creates the BucketLimits for every bucket / placement group of a cluster
+    status. Buckets share the cluster, nodearray, regional and family limits.
+    """
+
+    def __init__(self, cluster_name: str, cluster_status: ClusterStatus) -> None:
+        self.cluster_limit = _cluster_limits(cluster_name, cluster_status)
+        self.cc_nodes_by_template = partition(
+            cluster_status.nodes, lambda n: n["Template"]
+        )
+        self.nodearray_limits: Dict[str, _SharedLimit] = {}
+        self.regional_limits: Dict[str, _SharedLimit] = {}
+        self.family_limits: Dict[str, _SharedLimit] = {}
+
+    def nodearray_limit(self, nodearray_status: Any) -> _SharedLimit:
+        if nodearray_status.name in self.nodearray_limits:
+            return self.nodearray_limits[nodearray_status.name]
+
+        region = nodearray_status.nodearray["Region"]
+        active_na_core_count = 0
+        active_na_count = 0
+        for cc_node in self.cc_nodes_by_template.get(nodearray_status.name, []):
+            aux_vm_info = vm_sizes.get_aux_vm_size_info(region, cc_node["MachineType"])
+            active_na_count += 1
+            active_na_core_count += aux_vm_info.vcpu_count
+
+        ret = self.nodearray_limits[nodearray_status.name] = _SharedLimit(
+            "NodeArray({})".format(nodearray_status.name),
+            active_na_core_count,
+            nodearray_status.max_core_count,  # noqa: E128,
+            active_na_count,
+            nodearray_status.max_count,
+        )
+        return ret
+
+    def bucket_limits(
+        self,
+        nodearray_status: Any,
+        bucket: NodearrayBucketStatus,
+        pg_name: Optional[ht.PlacementGroup],
+        pg_status: Optional[PlacementGroupStatus],
+    ) -> BucketLimits:
+        nodearray = nodearray_status.nodearray
+        region = nodearray["Region"]
+        vcpu_count = bucket.virtual_machine.vcpu_count
+        nodearray_limit = self.nodearray_limit(nodearray_status)
+
+        aux_vm_info = vm_sizes.get_aux_vm_size_info(
+            region, bucket.definition.machine_type
+        )
+        assert isinstance(aux_vm_info, vm_sizes.AuxVMSizeInfo)
+        vm_family = aux_vm_info.vm_family
+
+        if region not in self.regional_limits:
+            self.regional_limits[region] = _SharedLimit(
+                "Region({})".format(region),
+                bucket.regional_consumed_core_count,
+                bucket.regional_quota_core_count,
+            )
+
+        if vm_family not in self.family_limits:
+            self.family_limits[vm_family] = _SharedLimit(
+                "VM Family({})".format(vm_family),
+                bucket.family_consumed_core_count,
+                bucket.family_quota_core_count,
+            )
+
+        placement_group_limit = None
+        if pg_name:
+            placement_group_limit = _SharedLimit(
+                "PlacementGroup({})".format(pg_name),
+                consumed_core_count=pg_status.active_core_count if pg_status else 0,
+                max_core_count=bucket.max_placement_group_size * vcpu_count,
+            )
+
+        family_limit: Union[_SpotLimit, _SharedLimit] = self.family_limits[vm_family]
+        if nodearray.get("Interruptible"):
+            # enabling spot/interruptible 0's out the family limit response
+            # as the regional limit is supposed to be used in its place,
+            # however that responsibility is on the caller and not the
+            # REST api. For this library we handle that for them.
+            family_limit = _SpotLimit(self.regional_limits[region])
+
+        return BucketLimits(
+            vcpu_count,
+            self.regional_limits[region],
+            self.cluster_limit,
+            nodearray_limit,
+            family_limit,
+            placement_group_limit,
+            active_core_count=bucket.active_core_count,
+            active_count=bucket.active_count,
+            available_core_count=bucket.available_core_count,
+            available_count=bucket.available_count,
+            max_core_count=bucket.max_core_count,
+            max_count=bucket.max_count,
+        )
+
+
 def _node_from_cc_node(
-    cc_node_rec: dict, bucket: NodearrayBucketStatus, region: ht.Location
+    cc_node_rec: dict,
+    bucket: NodearrayBucketStatus,
+    region: ht.Location,
+    copy: bool = True,
 ) -> Node:
+    """
+    copy=False when nothing else references cc_node_rec - the resources are then
+    only copied shallowly, enough to keep defaults out of software_configuration.
+    """
     node_id = ht.NodeId(cc_node_rec["NodeId"])
     node_name = ht.NodeName(cc_node_rec["Name"])
     nodearray_name = cc_node_rec["Template"]
@@ -1377,9 +2714,10 @@ def _node_from_cc_node(
     infiniband = bool(placement_group)
 
     state = ht.NodeStatus(str(cc_node_rec.get("Status")))
-    resources = deepcopy(
+    resources = (
         cc_node_rec.get("Configuration", {}).get("autoscale", {}).get("resources", {})
     )
+    resources = ht.ResourceDict(deepcopy(resources) if copy else dict(resources))
 
     software_configuration = ImmutableOrderedDict(cc_node_rec.get("Configuration", {}))
 
@@ -1427,18 +2765,27 @@ class _DefaultResource:
         self.modifier = modifier
         self.modifier_magnitude = modifier_magnitude
 
-    def apply_default(self, node: Node) -> None:
+    def apply_default(self, node: Node) -> bool:
+        """
+        Returns False if the node did not match the selection, otherwise True, even
+        if the resource was already defined or the value could not be modified.
+        """
 
         # obviously we don't want to override anything
-        if node.resources.get(self.resource_name) is not None:
-            return
+        if node._resources.get(self.resource_name) is not None:
+            return True
 
         for criteria in self.selection:
             if not criteria.satisfied_by_node(node):
-                return
+                return False
 
         # it met all of our criteria, so set the default
-        default_value = self.default_value_function(node)
+        try:
+            default_value = self.default_value_function(node)
+        except _DefaultValueUnavailable:
+            # already reported by the expression itself
+            return True
+
         if self.modifier and default_value is not None:
             if not isinstance(default_value, (float, int, ht.Memory)):
                 raise RuntimeError(
@@ -1476,10 +2823,11 @@ class _DefaultResource:
                         self.modifier_magnitude,
                     )
                 )
-                return
+                return True
 
         node._resources[self.resource_name] = default_value
         node.available[self.resource_name] = default_value
+        return True
 
     def __str__(self) -> str:
         return "DefaultResource(select={}, name={}, value={})".format(
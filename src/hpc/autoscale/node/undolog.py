@@ -0,0 +1,112 @@
+"""
+An undo log of what allocating changes - node resources and assignments, bucket
+counters, limits and node names. While a Savepoint is open, the first change to
+each object saves how to put it back, so rolling back costs as much as what
+changed since the savepoint, not a copy of everything that might. Each thread has
+its own log, and there is one only while a savepoint is open, so a savepoint must
+always be rolled back or released - see NodeManager.transaction.
+"""
+import threading
+from functools import partial
+from typing import Any, Callable, List, Optional, Set
+
+
+class _UndoLog:
+    def __init__(self) -> None:
+        self.entries: List[Callable[[], Any]] = []
+        # ids of the objects saved since each open savepoint, innermost last
+        self.touched: List[Set[int]] = []
+
+
+class _ThreadState(threading.local):
+    # only set while a savepoint is open
+    active: Optional[_UndoLog] = None
+
+
+_state = _ThreadState()
+
+
+def recording() -> bool:
+    return _state.active is not None
+
+
+def touch(obj: Any, save: Optional[Callable[[], Callable[[], Any]]] = None) -> None:
+    """
+    Call before obj changes. The first time per savepoint, keeps save(), or by
+    default obj._restore(obj._state()), to undo the change with.
+    """
+    log = _state.active
+    if log is None:
+        return
+    touched = log.touched[-1]
+    key = id(obj)
+    if key in touched:
+        return
+    touched.add(key)
+    if save is None:
+        log.entries.append(partial(obj._restore, obj._state()))
+    else:
+        log.entries.append(save())
+
+
+def record(undo: Callable[[], Any]) -> None:
+    """Call after a change that undo reverts, every time."""
+    log = _state.active
+    if log is not None:
+        log.entries.append(undo)
+
+
+class Savepoint:
+    """
+    Either rollback or release it, innermost first. Releasing keeps the changes,
+    though an enclosing savepoint may still roll them back.
+    """
+
+    def __init__(self) -> None:
+        if _state.active is None:
+            _state.active = _UndoLog()
+        self.__log = _state.active
+        self.__start = len(self.__log.entries)
+        self.__depth = len(self.__log.touched)
+        self.__log.touched.append(set())
+        self.__open = True
+
+    @property
+    def is_open(self) -> bool:
+        return self.__open
+
+    def rollback(self) -> None:
+        self.__close()
+        entries = self.__log.entries
+        # nothing undone here is recorded again
+        _state.active = None
+        try:
+            while len(entries) > self.__start:
+                entries.pop()()
+        finally:
+            _state.active = self.__log if self.__depth else None
+
+    def release(self) -> None:
+        touched = self.__close()
+        if self.__depth:
+            # what was saved here also holds for the enclosing savepoint
+            self.__log.touched[-1].update(touched)
+        else:
+            _state.active = None
+
+    def __close(self) -> Set[int]:
+        if not self.__open:
+            raise RuntimeError("Savepoint was already rolled back or released")
+        if (
+            len(self.__log.touched) != self.__depth + 1
+            or self.__log is not _state.active
+        ):
+            raise RuntimeError("Close the savepoints opened after this one first")
+        self.__open = False
+        return self.__log.touched.pop()
+
+    def __str__(self) -> str:
+        return "Savepoint(depth={}, open={})".format(self.__depth, self.__open)
+
+    def __repr__(self) -> str:
+        return str(self)
@@ -0,0 +1,428 @@
+"""
+Runs one autoscale cycle - new_demand_calculator, add_jobs and finish - from saved
+jobs and scheduler nodes under a profiler, so a slow cycle can be diagnosed
+without instrumenting the scheduler integration.
+
+    # against the live cluster in autoscale.json, saving what it saw
+    scalelib-profile -c autoscale.json -j jobs.jsonl -n nodes.jsonl \\
+        --record cluster.json --collapsed cycle.folded
+
+    # later, offline, against the same cluster with the sampling profiler
+    scalelib-profile -c autoscale.json -j jobs.jsonl -n nodes.jsonl \\
+        --recorded cluster.json --profiler sample
+
+Jobs are Job.to_dict() and nodes SchedulerNode.to_dict(), either as json lines or
+as one json list. The collapsed stacks can be rendered by flamegraph.pl or
+speedscope.
+"""
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from abc import ABC, abstractmethod
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Any, Callable, Dict, List, Optional, TextIO, Tuple
+
+from hpc.autoscale import hpclogging as logging
+from hpc.autoscale.ccbindings import new_cluster_bindings
+from hpc.autoscale.ccbindings.recorded import (
+    RecordedClusterBinding,
+    record_cluster_status,
+)
+from hpc.autoscale.job.demandcalculator import DemandCalculator, new_demand_calculator
+from hpc.autoscale.job.job import Job
+from hpc.autoscale.job.schedulernode import SchedulerNode
+from hpc.autoscale.node.nodehistory import NullNodeHistory
+from hpc.autoscale.util import load_config
+
+# a call stack, outermost frame first
+Stack = Tuple[str, ...]
+# function label -> (self seconds, total seconds, calls or None if unknown)
+Hotspots = Dict[str, Tuple[float, float, Optional[int]]]
+
+_MAX_DEPTH = 256
+
+
+class PhaseResult:
+    def __init__(self, name: str, seconds: float, peak_memory: Optional[int]) -> None:
+        self.name = name
+        self.seconds = seconds
+        self.peak_memory = peak_memory
+
+    def __repr__(self) -> str:
+        return "PhaseResult({}, {:.3f}s, peak_memory={})".format(
+            self.name, self.seconds, self.peak_memory
+        )
+
+
+class _Profiler(ABC):
+    @abstractmethod
+    def run(self, phase: str, function: Callable[[], Any]) -> Any:
+        pass
+
+    @abstractmethod
+    def collapsed_stacks(self) -> Counter:
+        pass
+
+    @abstractmethod
+    def hotspots(self) -> Hotspots:
+        pass
+
+    def dump(self, path: str) -> None:
+        raise RuntimeError("Only the cprofile profiler can write pstats files.")
+
+
+class _CProfiler(_Profiler):
+    """
+    Exact call counts and times. cProfile only records caller / callee pairs, so
+    the collapsed stacks split each function's time between its callers in
+    proportion to the time spent under each one.
+    """
+
+    def __init__(self) -> None:
+        self.profiles: List[Tuple[str, cProfile.Profile]] = []
+
+    def run(self, phase: str, function: Callable[[], Any]) -> Any:
+        profile = cProfile.Profile()
+        self.profiles.append((phase, profile))
+        profile.enable()
+        try:
+            return function()
+        finally:
+            profile.disable()
+
+    def _stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.profiles[0][1])
+        for _, profile in self.profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def collapsed_stacks(self) -> Counter:
+        ret: Counter = Counter()
+        for phase, profile in self.profiles:
+            stats = pstats.Stats(profile).stats  # type: ignore
+            callees: Dict[Tuple, Dict[Tuple, float]] = {}
+            for func, (_, _, _, _, callers) in stats.items():
+                for caller, edge in callers.items():
+                    callees.setdefault(caller, {})[func] = edge[3]
+
+            total = sum(tt for (_, _, tt, _, _) in stats.values())
+            # drop paths that account for less than this, i.e. rarely taken ones
+            min_seconds = total * 1e-5
+
+            def visit(func: Tuple, path: List[Tuple], fraction: float) -> None:
+                _, _, tt, _, _ = stats[func]
+                path.append(func)
+                micros = int(tt * fraction * 1_000_000)
+                if micros > 0:
+                    ret[(phase,) + tuple(_func_label(*f) for f in path)] += micros
+
+                if len(path) < _MAX_DEPTH:
+                    for callee, edge_seconds in callees.get(func, {}).items():
+                        callee_seconds = stats[callee][3]
+                        if callee in path or callee_seconds <= 0:
+                            continue
+                        share = fraction * min(1.0, edge_seconds / callee_seconds)
+                        if share * callee_seconds >= min_seconds:
+                            visit(callee, path, share)
+                path.pop()
+
+            for func, (_, _, _, _, callers) in stats.items():
+                if not callers:
+                    visit(func, [], 1.0)
+        return ret
+
+    def hotspots(self) -> Hotspots:
+        ret: Hotspots = {}
+        for func, (_, calls, tt, ct, _) in self._stats().stats.items():  # type: ignore
+            ret[_func_label(*func)] = (tt, ct, calls)
+        return ret
+
+    def dump(self, path: str) -> None:
+        self._stats().dump_stats(path)
+
+
+class _Sampler(_Profiler):
+    """
+    Samples the running call stack every interval seconds from a background
+    thread. Far less overhead than cProfile, but no call counts and functions
+    that finish between samples are missed.
+    """
+
+    def __init__(self, interval: float = 0.001) -> None:
+        self.interval = interval
+        self.stacks: Counter = Counter()
+
+    def run(self, phase: str, function: Callable[[], Any]) -> Any:
+        target = threading.get_ident()
+        stop = threading.Event()
+        root = sys._getframe()
+
+        def sample() -> None:
+            while not stop.wait(self.interval):
+                frame = sys._current_frames().get(target)
+                if frame is not None:
+                    stack = _frame_stack(frame, root.f_code)
+                    if stack:
+                        self.stacks[(phase,) + stack] += 1
+
+        sampler = threading.Thread(target=sample, name="scalelib-profiler")
+        sampler.daemon = True
+        sampler.start()
+        try:
+            return function()
+        finally:
+            stop.set()
+            sampler.join()
+
+    def collapsed_stacks(self) -> Counter:
+        return Counter(self.stacks)
+
+    def hotspots(self) -> Hotspots:
+        self_samples: Counter = Counter()
+        total_samples: Counter = Counter()
+        for stack, count in self.stacks.items():
+            # the first entry is the phase
+            self_samples[stack[-1]] += count
+            for label in set(stack[1:]):
+                total_samples[label] += count
+
+        return {
+            label: (self_samples[label] * self.interval, total * self.interval, None,)
+            for label, total in total_samples.items()
+        }
+
+
+def _func_label(filename: str, lineno: int, name: str) -> str:
+    if filename == "~":
+        # i.e. a builtin, whose name is already descriptive
+        return name
+    return "{} ({}:{})".format(name, _short_path(filename), lineno)
+
+
+def _short_path(filename: str) -> str:
+    # the path below site-packages / src is enough to identify a module
+    parts = filename.replace("\\", "/").split("/")
+    for marker in ["site-packages", "src", "lib"]:
+        if marker in parts:
+            start = len(parts) - parts[::-1].index(marker)
+            return "/".join(parts[start:])
+    return os.path.basename(filename)
+
+
+def _frame_stack(frame: Optional[FrameType], root: CodeType) -> Stack:
+    # everything below the frame that started profiling the phase
+    labels: List[str] = []
+    while frame is not None and frame.f_code is not root:
+        code = frame.f_code
+        labels.append(_func_label(code.co_filename, code.co_firstlineno, code.co_name))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels[-_MAX_DEPTH:])
+
+
+def run_phases(
+    profiler: _Profiler,
+    phases: List[Tuple[str, Callable[[], Any]]],
+    trace_memory: bool = True,
+) -> List[PhaseResult]:
+    results = []
+    for name, function in phases:
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            profiler.run(name, function)
+            seconds = time.perf_counter() - start
+            peak: Optional[int] = None
+            if trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        results.append(PhaseResult(name, seconds, peak))
+    return results
+
+
+def write_collapsed(stacks: Counter, stream: TextIO) -> None:
+    for stack, count in sorted(stacks.items()):
+        stream.write("{} {}\n".format(";".join(stack), count))
+
+
+def print_hotspots(
+    hotspots: Hotspots, top: int, stream: TextIO, sort_by: str = "self"
+) -> None:
+    def sort_key(item: Tuple[str, Tuple[float, float, Optional[int]]]) -> float:
+        return item[1][0] if sort_by == "self" else item[1][1]
+
+    rows = sorted(hotspots.items(), key=sort_key, reverse=True)[:top]
+    total = sum(v[0] for v in hotspots.values()) or 1.0
+
+    stream.write(
+        "{:>10} {:>7} {:>10} {:>10}  {}\n".format(
+            "self(s)", "self%", "total(s)", "calls", "function"
+        )
+    )
+    for label, (self_seconds, total_seconds, calls) in rows:
+        stream.write(
+            "{:>10.4f} {:>6.1f}% {:>10.4f} {:>10}  {}\n".format(
+                self_seconds,
+                100 * self_seconds / total,
+                total_seconds,
+                "-" if calls is None else calls,
+                label,
+            )
+        )
+
+
+def print_phases(results: List[PhaseResult], stream: TextIO) -> None:
+    stream.write("{:<24} {:>10} {:>14}\n".format("phase", "seconds", "peak memory"))
+    for result in results:
+        peak = "-"
+        if result.peak_memory is not None:
+            peak = "{:.1f} MiB".format(result.peak_memory / 1024 / 1024)
+        stream.write(
+            "{:<24} {:>10.3f} {:>14}\n".format(result.name, result.seconds, peak)
+        )
+
+
+def load_json_records(path: str) -> List[Dict]:
+    """Reads either one json list or one json object per line."""
+    with open(path) as fr:
+        content = fr.read()
+
+    if content.lstrip().startswith("["):
+        return json.loads(content)
+
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def _cycle_phases(
+    config: Dict, jobs: List[Job], scheduler_nodes: List[SchedulerNode],
+) -> List[Tuple[str, Callable[[], Any]]]:
+    state: Dict[str, DemandCalculator] = {}
+
+    def create() -> None:
+        state["dcalc"] = new_demand_calculator(
+            config, existing_nodes=scheduler_nodes, node_history=NullNodeHistory(),
+        )
+
+    return [
+        ("new_demand_calculator", create),
+        ("add_jobs", lambda: state["dcalc"].add_jobs(jobs)),
+        ("finish", lambda: state["dcalc"].finish()),
+    ]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=(__doc__ or "").strip().split("\n\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n\n".join((__doc__ or "").strip().split("\n\n")[1:]),
+    )
+    parser.add_argument("-c", "--config", help="The autoscale config.")
+    parser.add_argument("-j", "--jobs", required=True, help="Job.to_dict() records.")
+    parser.add_argument(
+        "-n", "--nodes", help="SchedulerNode.to_dict() records.",
+    )
+
+    cluster = parser.add_mutually_exclusive_group()
+    cluster.add_argument(
+        "--recorded", help="Replay a cluster saved by --record instead of the live one."
+    )
+    cluster.add_argument(
+        "--record",
+        help="Save the live cluster's status here, then run against the recording.",
+    )
+    cluster.add_argument(
+        "--synthetic",
+        type=int,
+        metavar="SEED",
+        help="Run against a synthetic cluster generated from this seed.",
+    )
+    parser.add_argument("--synthetic-nodes", type=int, default=10_000)
+    parser.add_argument("--synthetic-nodearrays", type=int, default=100)
+
+    parser.add_argument(
+        "-p", "--profiler", choices=["cprofile", "sample"], default="cprofile"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.001, help="Seconds between samples."
+    )
+    parser.add_argument(
+        "--collapsed", help="Write collapsed stacks, for flamegraphs, to this file."
+    )
+    parser.add_argument("--pstats", help="Write cProfile stats to this file.")
+    parser.add_argument("--top", type=int, default=25, help="Hotspots to print.")
+    parser.add_argument("--sort", choices=["self", "total"], default="self")
+    parser.add_argument(
+        "--no-memory",
+        dest="trace_memory",
+        action="store_false",
+        default=True,
+        help="Skip tracemalloc, which slows everything else down noticeably.",
+    )
+    args = parser.parse_args(argv)
+
+    if args.pstats and args.profiler != "cprofile":
+        parser.error("--pstats requires --profiler cprofile")
+
+    config = load_config(args.config) if args.config else {}
+
+    if args.synthetic is not None:
+        from hpc.autoscale.ccbindings.synthetic import generate_cluster
+
+        config["_mock_bindings"] = generate_cluster(
+            seed=args.synthetic,
+            nodes=args.synthetic_nodes,
+            nodearrays=args.synthetic_nodearrays,
+        )
+    elif args.recorded:
+        config["_mock_bindings"] = RecordedClusterBinding(args.recorded)
+    elif args.record:
+        record_cluster_status(new_cluster_bindings(config), args.record)
+        config["_mock_bindings"] = RecordedClusterBinding(args.record)
+    elif not args.config:
+        parser.error("One of --config, --recorded or --synthetic is required.")
+
+    jobs = [Job.from_dict(d) for d in load_json_records(args.jobs)]
+    scheduler_nodes = []
+    if args.nodes:
+        scheduler_nodes = [
+            SchedulerNode.from_dict(d) for d in load_json_records(args.nodes)
+        ]
+
+    profiler: _Profiler
+    if args.profiler == "cprofile":
+        profiler = _CProfiler()
+    else:
+        profiler = _Sampler(args.interval)
+
+    results = run_phases(
+        profiler, _cycle_phases(config, jobs, scheduler_nodes), args.trace_memory
+    )
+
+    print()
+    print_phases(results, sys.stdout)
+    print()
+    print_hotspots(profiler.hotspots(), args.top, sys.stdout, args.sort)
+
+    if args.collapsed:
+        with open(args.collapsed, "w") as fw:
+            write_collapsed(profiler.collapsed_stacks(), fw)
+        logging.info("Wrote collapsed stacks to %s", args.collapsed)
+
+    if args.pstats:
+        profiler.dump(args.pstats)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -247,9 +247,12 @@ class NodeOperationResult(Result):
         request_id: Optional[ht.RequestId],
         nodes: Optional[List["Node"]] = None,
         reasons: Reasons = None,
+        operation_ids: Optional[List[ht.OperationId]] = None,
     ) -> None:
         Result.__init__(self, status, reasons)
         self.operation_id = operation_id
+        # when a request is split up, one per chunk. operation_id is the first.
+        self.operation_ids = operation_ids or ([operation_id] if operation_id else [])
         self.request_id = request_id
         self.nodes = nodes
         fire_result_handlers(self)
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+from typing import Any, Coroutine, List
+
+from hpc.autoscale.ccbindings.asyncbindings import AsyncClusterBindingAdapter
+from hpc.autoscale.ccbindings.mock import AsyncMockClusterBinding, MockClusterBinding
+
+
+def _run(coroutine: Coroutine) -> None:
+    # asyncio.run needs python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_adapter_runs_in_executor() -> None:
+    threads: List[Any] = []
+
+    class RecordingBindings(MockClusterBinding):
+        def get_nodes(self, operation_id: Any = None, request_id: Any = None) -> Any:
+            threads.append(threading.current_thread())
+            return MockClusterBinding.get_nodes(self, operation_id, request_id)
+
+    bindings = AsyncClusterBindingAdapter(RecordingBindings("clusty"))
+    assert bindings.cluster_name == "clusty"
+
+    async def run() -> None:
+        node_lists = await asyncio.gather(*[bindings.get_nodes() for _ in range(3)])
+        assert [nl.nodes for nl in node_lists] == [[], [], []]
+
+    _run(run())
+    assert len(threads) == 3
+    assert threading.current_thread() not in threads
+
+
+def test_async_mock() -> None:
+    bindings = AsyncMockClusterBinding("clusty", latency=0.01)
+    bindings.add_nodearray("htc", {})
+    bindings.add_bucket("htc", "Standard_F4s", 10, 10)
+    bindings.add_node("htc-1", "htc")
+    assert bindings.sync_bindings.nodes
+
+    async def run() -> None:
+        status, node_list = await asyncio.gather(
+            bindings.get_cluster_status(nodes=True), bindings.get_nodes()
+        )
+        assert [n["Name"] for n in status.nodes] == ["htc-1"]
+        assert [n["Name"] for n in node_list.nodes] == ["htc-1"]
+
+    _run(run())
+    assert bindings.max_in_flight == 2
+    assert bindings.in_flight == 0
@@ -0,0 +1,51 @@
+import json
+from typing import Any, Iterator, List
+
+import pytest
+
+from hpc.autoscale.ccbindings.jsonstream import iter_array
+
+
+def _chunks(text: str, size: int) -> Iterator[bytes]:
+    data = text.encode("utf-8")
+    for i in range(0, len(data), size):
+        yield data[i : i + size]  # noqa: E203
+
+
+def _parse(doc: Any, size: int, key: str = "nodes", **kwargs: Any) -> List[Any]:
+    return list(iter_array(_chunks(json.dumps(doc), size), key, **kwargs))
+
+
+def test_iter_array() -> None:
+    nodes = [
+        {"Name": "htc-{}".format(i), "Status": "Ready", "CoreCount": 10 ** i}
+        for i in range(1, 6)
+    ]
+    nodes.append({"Name": "héllo-世界", "Configuration": {"a": [1, {}]}})
+    doc = {"operation": {"id": "123", "action": "create"}, "nodes": nodes, "x": 1}
+
+    # every chunk size, so values, numbers and multibyte characters are split
+    for size in [1, 2, 3, 7, 64, 10000]:
+        assert _parse(doc, size) == nodes
+
+    assert _parse({"nodes": []}, 1) == []
+    assert _parse({"nodes": None}, 1) == []
+    assert _parse({}, 1) == []
+    assert _parse(doc, 5, key="missing") == []
+
+
+def test_skip() -> None:
+    nodes = [{"Name": "a"}, {"Name": "b"}, {"Name": "c"}]
+    skipped = _parse({"nodes": nodes}, 4, skip=lambda n: n["Name"] == "b")
+    assert skipped == [{"Name": "a"}, {"Name": "c"}]
+
+
+def test_invalid() -> None:
+    with pytest.raises(ValueError):
+        list(iter_array(_chunks('{"nodes": [{"Name": "a"}', 3), "nodes"))
+
+    with pytest.raises(ValueError):
+        list(iter_array(_chunks('{"nodes": [{"Name": "a"} {}]}', 3), "nodes"))
+
+    with pytest.raises(ValueError):
+        list(iter_array(_chunks("[1, 2]", 3), "nodes"))
@@ -0,0 +1,251 @@
+import json
+import threading
+import time
+import uuid
+from typing import Any, Iterator, List, Set, Tuple
+
+import pytest
+from cyclecloud.model.NodeCreationRequestModule import NodeCreationRequest
+from cyclecloud.model.NodeCreationResultModule import NodeCreationResult
+from cyclecloud.model.NodeCreationResultSetModule import NodeCreationResultSet
+
+from hpc.autoscale.ccbindings.interface import MergedNodeCreationResult
+from hpc.autoscale.ccbindings.legacy import ClusterBinding
+from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.node.node import Node
+from hpc.autoscale.node.nodemanager import new_node_manager
+
+
+class _Response:
+    status_code = 200
+
+
+class _ClustersModule:
+    def __init__(self, fail: Set[str] = set(), delay: float = 0.0) -> None:
+        self.requests: List[NodeCreationRequest] = []
+        self.fail = fail
+        self.delay = delay
+        self.max_concurrent = 0
+        self.__concurrent = 0
+        # whether two requests for one nodearray were ever sent at once
+        self.overlapped = False
+        self.__active: List[str] = []
+        self.__lock = threading.Lock()
+
+    def create_nodes(
+        self, session: Any, cluster_name: str, request: NodeCreationRequest
+    ) -> Tuple[_Response, NodeCreationResult]:
+        nodearray = request.sets[0].nodearray
+        with self.__lock:
+            self.requests.append(request)
+            self.__concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.__concurrent)
+            self.overlapped = self.overlapped or nodearray in self.__active
+            self.__active.append(nodearray)
+        try:
+            time.sleep(self.delay)
+            machine_type = request.sets[0].definition.machine_type
+            if nodearray in self.fail or machine_type in self.fail:
+                raise RuntimeError("simulated failure")
+
+            result = NodeCreationResult()
+            result.operation_id = str(uuid.uuid4())
+            result.sets = []
+            for request_set in request.sets:
+                result_set = NodeCreationResultSet()
+                result_set.added = request_set.count
+                result.sets.append(result_set)
+            return _Response(), result
+        finally:
+            with self.__lock:
+                self.__concurrent -= 1
+                self.__active.remove(nodearray)
+
+
+def _nodes() -> List[Node]:
+    bindings = MockClusterBinding("clusty")
+    bindings.add_nodearray("htc", {})
+    bindings.add_bucket("htc", "Standard_F4s", max_count=10, available_count=10)
+    bindings.add_nodearray("hpc", {})
+    bindings.add_bucket("hpc", "Standard_F8s", max_count=10, available_count=10)
+    bindings.add_nodearray("gpu", {})
+    bindings.add_bucket("gpu", "Standard_NV24", max_count=10, available_count=10)
+    node_mgr = new_node_manager({"_mock_bindings": bindings})
+
+    nodes = []
+    for nodearray, count in [("htc", 3), ("hpc", 2), ("gpu", 1)]:
+        result = node_mgr.allocate({"node.nodearray": nodearray}, node_count=count)
+        assert result
+        nodes.extend(result.nodes)
+    return nodes
+
+
+def test_create_nodes_single_request() -> None:
+    clusters_module = _ClustersModule()
+    binding = ClusterBinding("clusty", None, None, clusters_module=clusters_module)
+    result = binding.create_nodes(_nodes())
+    assert not isinstance(result, MergedNodeCreationResult)
+    assert len(clusters_module.requests) == 1
+    assert [s.nodearray for s in clusters_module.requests[0].sets] == [
+        "gpu",
+        "hpc",
+        "htc",
+    ]
+
+
+def test_create_nodes_concurrently() -> None:
+    clusters_module = _ClustersModule(delay=0.1)
+    binding = ClusterBinding(
+        "clusty", None, None, clusters_module=clusters_module, create_concurrency=2,
+    )
+    nodes = _nodes()
+    result = binding.create_nodes(nodes)
+    assert isinstance(result, MergedNodeCreationResult)
+    assert len(clusters_module.requests) == 3
+    assert clusters_module.max_concurrent == 2
+
+    assert len(result.operation_ids) == 3
+    assert result.operation_id == result.operation_ids[0]
+    assert [s.added for s in result.sets] == [1, 2, 3]
+
+    # offsets are relative to each set's own request
+    for node in nodes:
+        operation_id, offset = result.node_operations[node.name]
+        set_index = ["gpu", "hpc", "htc"].index(node.nodearray)
+        assert operation_id == result.operation_ids[set_index]
+        assert offset == int(node.name.split("-")[-1]) - 1
+
+
+def test_create_nodes_partial_failure() -> None:
+    clusters_module = _ClustersModule(fail=set(["hpc"]))
+    binding = ClusterBinding(
+        "clusty", None, None, clusters_module=clusters_module, create_concurrency=4,
+    )
+    nodes = _nodes()
+    result = binding.create_nodes(nodes)
+    assert isinstance(result, MergedNodeCreationResult)
+    assert len(result.operation_ids) == 2
+    assert [s.added for s in result.sets] == [1, 0, 3]
+    assert "simulated failure" in result.sets[1].message
+    assert set(result.node_operations.keys()) == set(
+        [n.name for n in nodes if n.nodearray != "hpc"]
+    )
+
+    clusters_module.fail = set(["htc", "hpc", "gpu"])
+    with pytest.raises(RuntimeError):
+        binding.create_nodes(nodes)
+
+
+def test_create_nodes_set_timeout() -> None:
+    clusters_module = _ClustersModule(delay=0.5)
+    binding = ClusterBinding(
+        "clusty",
+        None,
+        None,
+        clusters_module=clusters_module,
+        create_concurrency=4,
+        create_set_timeout=0.05,
+    )
+    with pytest.raises(RuntimeError):
+        binding.create_nodes(_nodes())
+
+
+def test_create_nodes_one_set_of_a_nodearray_at_a_time() -> None:
+    vm_sizes = ["Standard_F4s", "Standard_F8s", "Standard_D4s_v3"]
+    bindings = MockClusterBinding("clusty")
+    bindings.add_nodearray("htc", {})
+    for vm_size in vm_sizes:
+        bindings.add_bucket("htc", vm_size, max_count=10, available_count=10)
+    node_mgr = new_node_manager({"_mock_bindings": bindings})
+    nodes = []
+    for vm_size in vm_sizes:
+        result = node_mgr.allocate({"node.vm_size": vm_size}, node_count=2)
+        assert result
+        nodes.extend(result.nodes)
+
+    # each set fits in the timeout, though all three in a row do not
+    clusters_module = _ClustersModule(delay=0.1)
+    binding = ClusterBinding(
+        "clusty",
+        None,
+        None,
+        clusters_module=clusters_module,
+        create_concurrency=4,
+        create_set_timeout=0.25,
+    )
+    result = binding.create_nodes(nodes)
+    assert not clusters_module.overlapped
+    # in node index order, so CycleCloud names them as we did
+    assert [r.sets[0].definition.machine_type for r in clusters_module.requests] == (
+        vm_sizes
+    )
+    assert [s.added for s in result.sets] == [2, 2, 2]
+
+    # once a set fails, the later sets of that nodearray are not sent
+    clusters_module = _ClustersModule(fail=set(["Standard_F8s"]))
+    binding.clusters_module = clusters_module  # type: ignore
+    result = binding.create_nodes(nodes)
+    assert len(clusters_module.requests) == 2
+    assert [s.added for s in result.sets] == [2, 0, 0]
+    assert "Skipped" in result.sets[2].message
+
+
+class _StreamedResponse:
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+        self.chunk_sizes: List[int] = []
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        # much smaller than chunk_size, to exercise the incremental parsing
+        for i in range(0, len(self.body), 16):
+            self.chunk_sizes.append(chunk_size)
+            yield self.body[i : i + 16]  # noqa: E203
+
+    def __enter__(self) -> "_StreamedResponse":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+class _StreamSession:
+    def __init__(self, body: bytes) -> None:
+        self.urls: List[str] = []
+        self.response = _StreamedResponse(body)
+
+    def get(self, url: str, stream: bool = False) -> _StreamedResponse:
+        assert stream
+        self.urls.append(url)
+        return self.response
+
+
+def test_iter_nodes_streaming() -> None:
+    records = [{"Name": "htc-{}".format(i), "Status": "Ready"} for i in range(1, 20)]
+    session = _StreamSession(json.dumps({"nodes": records}).encode())
+    binding = ClusterBinding(
+        "my cluster",
+        None,
+        None,
+        clusters_module=_ClustersModule(),
+        url="https://localhost/",
+        stream_session=session,  # type: ignore
+    )
+    streamed = list(binding.iter_nodes(skip=lambda n: n["Name"] == "htc-2"))
+    assert session.urls == ["https://localhost/clusters/my%20cluster/nodes"]
+    assert streamed == [r for r in records if r["Name"] != "htc-2"]
+    assert len(session.response.chunk_sizes) > 1
+
+
+def test_iter_nodes_without_streaming() -> None:
+    bindings = MockClusterBinding("clusty")
+    bindings.add_nodearray("htc", {})
+    bindings.add_bucket("htc", "Standard_F4s", max_count=10, available_count=10)
+    bindings.add_node("htc-1", "htc")
+    bindings.add_node("htc-2", "htc")
+    names = [
+        n["Name"] for n in bindings.iter_nodes(skip=lambda n: n["Name"] == "htc-1")
+    ]
+    assert names == ["htc-2"]
@@ -0,0 +1,47 @@
+import pytest
+
+from hpc.autoscale.ccbindings.legacy import ReadOnlyModeException
+from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.ccbindings.recorded import (
+    RecordedClusterBinding,
+    record_cluster_status,
+)
+from hpc.autoscale.node.nodemanager import new_node_manager
+
+
+def test_record_and_replay(tmpdir) -> None:
+    bindings = MockClusterBinding("clusty")
+    bindings.add_nodearray("htc", {"ncpus": "node.vcpu_count"})
+    bindings.add_bucket("htc", "Standard_F4s", 10, 8)
+    bindings.add_nodearray("hpc", {}, max_placement_group_size=4)
+    bindings.add_bucket("hpc", "Standard_F8s", 10, 10, placement_groups=["pg0"])
+    bindings.add_node("htc-1", "htc")
+    bindings.add_node("hpc-1", "hpc", placement_group="pg0")
+
+    path = str(tmpdir.join("cluster.json"))
+    record_cluster_status(bindings, path)
+    recorded = RecordedClusterBinding(path)
+    assert recorded.cluster_name == "clusty"
+
+    expected = new_node_manager({"_mock_bindings": bindings})
+    actual = new_node_manager({"_mock_bindings": recorded})
+
+    def summary(node_mgr) -> list:
+        return sorted(
+            (b.bucket_id, b.placement_group or "", b.available_count, b.vm_size)
+            for b in node_mgr.get_buckets()
+        )
+
+    assert summary(actual) == summary(expected)
+    assert sorted(n.name for n in actual.get_nodes()) == ["hpc-1", "htc-1"]
+
+    # replaying does not let the recording be modified
+    status = recorded.get_cluster_status(nodes=True)
+    status.nodes.pop()
+    assert len(recorded.get_cluster_status(nodes=True).nodes) == 2
+    assert recorded.get_cluster_status().nodes is None
+
+    with pytest.raises(ReadOnlyModeException):
+        recorded.create_nodes(actual.get_nodes())
+    with pytest.raises(ReadOnlyModeException):
+        actual.shutdown_nodes(actual.get_nodes())
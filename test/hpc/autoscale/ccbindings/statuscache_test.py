@@ -0,0 +1,77 @@
+from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.ccbindings.statuscache import ClusterStatusCache
+
+
+def _bindings() -> MockClusterBinding:
+    bindings = MockClusterBinding("clusty")
+    bindings.add_nodearray("htc", {"ncpus": 4})
+    bindings.add_bucket("htc", "Standard_F4s", 10, 10)
+    bindings.add_node("htc-1", "htc")
+    bindings.add_node("htc-2", "htc")
+    return bindings
+
+
+def test_first_poll() -> None:
+    bindings = _bindings()
+    delta = bindings.get_cluster_status_changes()
+    assert delta.structure_changed
+    assert sorted([n["Name"] for n in delta.added_nodes]) == ["htc-1", "htc-2"]
+    assert not delta.changed_nodes
+    assert not delta.removed_nodes
+    assert not delta.empty
+
+    delta = bindings.get_cluster_status_changes()
+    assert delta.empty
+
+
+def test_node_changes() -> None:
+    bindings = _bindings()
+    bindings.get_cluster_status_changes()
+
+    bindings.update_state("Failed", ["htc-1"])
+    delta = bindings.get_cluster_status_changes()
+    assert [n["Name"] for n in delta.changed_nodes] == ["htc-1"]
+    assert delta.changed_nodes[0]["Status"] == "Failed"
+    assert not delta.added_nodes and not delta.removed_nodes
+    # a state change alone does not touch the limits
+    assert not delta.limits_changed
+    assert not delta.structure_changed
+
+    bindings.add_node("htc-3", "htc")
+    delta = bindings.get_cluster_status_changes()
+    assert [n["Name"] for n in delta.added_nodes] == ["htc-3"]
+    assert [b.bucket_id for b in delta.changed_buckets] == [
+        bindings.nodearrays["htc"].buckets[0].bucket_id
+    ]
+    assert delta.limits_changed
+
+    bindings.nodes.pop("htc-2")
+    delta = bindings.get_cluster_status_changes()
+    assert delta.removed_nodes == ["htc-2"]
+    assert not delta.added_nodes and not delta.changed_nodes
+
+
+def test_limit_and_structure_changes() -> None:
+    bindings = _bindings()
+    cache = ClusterStatusCache()
+    cache.update(bindings.get_cluster_status(nodes=True))
+
+    bindings.max_core_count = 200
+    delta = cache.update(bindings.get_cluster_status(nodes=True))
+    assert delta.cluster_limits_changed
+    assert not delta.changed_nodearrays
+
+    bindings.nodearrays["htc"].max_count = 5
+    delta = cache.update(bindings.get_cluster_status(nodes=True))
+    assert delta.changed_nodearrays == ["htc"]
+    assert not delta.cluster_limits_changed
+    assert not delta.structure_changed
+
+    bindings.add_nodearray("hpc", {})
+    delta = cache.update(bindings.get_cluster_status(nodes=True))
+    assert delta.structure_changed
+
+    cache.reset()
+    delta = cache.update(bindings.get_cluster_status(nodes=True))
+    assert delta.structure_changed
+    assert len(delta.added_nodes) == 2
@@ -0,0 +1,100 @@
+import time
+
+from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.ccbindings.synthetic import generate_cluster
+from hpc.autoscale.node.nodemanager import new_node_manager
+
+VM_SIZES = ["Standard_F4s", "Standard_F8s", "Standard_D4s_v3", "Standard_E4_v3"]
+
+
+def _generate(seed: int = 0, **kwargs: object) -> MockClusterBinding:
+    args = dict(
+        seed=seed,
+        nodearrays=20,
+        nodes=2000,
+        locations=["westus2"],
+        vm_size_names=VM_SIZES,
+        max_placement_group_size=50,
+    )
+    args.update(kwargs)
+    return generate_cluster(**args)  # type: ignore
+
+
+def _summary(bindings: MockClusterBinding) -> list:
+    return [
+        (r["Name"], r["NodeId"], r["MachineType"], r["Status"], r["PlacementGroupId"])
+        for r in bindings.get_nodes().nodes
+    ]
+
+
+def test_deterministic() -> None:
+    a = _generate(seed=1)
+    b = _generate(seed=1)
+    assert _summary(a) == _summary(b)
+    assert [bk.bucket_id for na in a.nodearrays.values() for bk in na.buckets] == [
+        bk.bucket_id for na in b.nodearrays.values() for bk in na.buckets
+    ]
+    assert _summary(a) != _summary(_generate(seed=2))
+
+
+def test_shape() -> None:
+    bindings = _generate(placement_group_fraction=0.5)
+    assert len(bindings.nodes) == 2000
+    assert len(bindings.nodearrays) == 20
+    assert len({n.state for n in bindings.nodes.values()}) > 3
+
+    pg_sizes: dict = {}
+    for node in bindings.nodes.values():
+        if node.placement_group:
+            assert node.nodearray.startswith("hpc")
+            pg_sizes[node.placement_group] = pg_sizes.get(node.placement_group, 0) + 1
+    assert pg_sizes
+    assert max(pg_sizes.values()) <= 50
+
+    for nodearray_status in bindings.nodearrays.values():
+        for bucket in nodearray_status.buckets:
+            # little headroom, but always room for one more vm
+            assert bucket.available_count >= 1
+            assert bucket.available_count <= max(1, len(bucket.active_nodes) // 10)
+            assert bucket.family_consumed_core_count <= bucket.family_quota_core_count
+            assert (
+                bucket.regional_consumed_core_count <= bucket.regional_quota_core_count
+            )
+
+
+def test_node_manager() -> None:
+    bindings = _generate()
+    node_mgr = new_node_manager({"_mock_bindings": bindings})
+    assert len(node_mgr.get_nodes()) == 2000
+    buckets = [b for b in node_mgr.get_buckets() if not b.placement_group]
+    assert len(buckets) == sum(len(na.buckets) for na in bindings.nodearrays.values())
+
+
+def test_records_cached() -> None:
+    bindings = _generate(nodearrays=2, nodes=10)
+    first = bindings.get_nodes().nodes
+    second = bindings.get_nodes().nodes
+    assert first == second
+    assert all(a["Configuration"] is b["Configuration"] for a, b in zip(first, second))
+    # callers may modify their copy
+    first[0].pop("Status")
+    assert "Status" in bindings.get_nodes().nodes[0]
+
+    bindings.update_state("Failed", [first[0]["Name"]])
+    third = bindings.get_nodes().nodes
+    assert third[0]["Status"] == "Failed"
+    assert third[0]["Configuration"] is not first[0]["Configuration"]
+    assert third[1]["Configuration"] is first[1]["Configuration"]
+
+
+def test_latency() -> None:
+    bindings = _generate(nodearrays=2, nodes=10, latency=0.05)
+    bindings.latencies["get_nodes"] = 0
+
+    start = time.time()
+    bindings.get_nodes()
+    assert time.time() - start < 0.05
+
+    start = time.time()
+    bindings.get_cluster_status(nodes=True)
+    assert time.time() - start >= 0.05
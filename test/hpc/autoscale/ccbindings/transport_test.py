@@ -0,0 +1,137 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Tuple
+
+import pytest
+import requests
+
+from hpc.autoscale.ccbindings.transport import (
+    RetryingHTTPAdapter,
+    TransportConfig,
+    install,
+    mount,
+)
+
+
+class _StandIn(BaseHTTPRequestHandler):
+    # path -> list of (status, headers) to return, in order. The last one repeats.
+    scripted_responses: Dict[str, List[Tuple[int, Dict[str, str]]]] = {}
+    calls: Dict[str, int] = {}
+
+    def _respond(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        n = _StandIn.calls.get(self.path, 0)
+        _StandIn.calls[self.path] = n + 1
+
+        if self.path == "/slow":
+            time.sleep(0.5)
+        planned = _StandIn.scripted_responses.get(self.path, [(200, {})])
+        status, headers = planned[min(n, len(planned) - 1)]
+
+        body = b"{}"
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def server() -> Iterator[str]:
+    _StandIn.scripted_responses = {}
+    _StandIn.calls = {}
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _StandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _session(**config: Any) -> Tuple[requests.Session, RetryingHTTPAdapter, List]:
+    sleeps: List[float] = []
+    adapter = RetryingHTTPAdapter(TransportConfig(**config), sleep=sleeps.append)
+    session = requests.session()
+    mount(session, adapter)
+    return session, adapter, sleeps
+
+
+def test_retry_after(server: str) -> None:
+    session, adapter, sleeps = _session(max_retries=3)
+    _StandIn.scripted_responses["/flaky"] = [
+        (429, {"Retry-After": "2"}),
+        (503, {"Retry-After": "1.5"}),
+        (200, {}),
+    ]
+    assert session.get(server + "/flaky").status_code == 200
+    assert _StandIn.calls["/flaky"] == 3
+    assert sleeps == [2.0, 1.5]
+
+    stats = adapter.stats()["GET /flaky"]
+    assert stats.calls == 3
+    assert stats.errors == 2
+    assert stats.retries == 2
+    assert stats.max_seconds >= stats.mean_seconds > 0
+
+
+def test_backoff_and_give_up(server: str) -> None:
+    session, adapter, sleeps = _session(
+        max_retries=2, backoff_factor=1.0, backoff_max=1.5
+    )
+    _StandIn.scripted_responses["/down"] = [(502, {})]
+    assert session.get(server + "/down").status_code == 502
+    assert _StandIn.calls["/down"] == 3
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 1.0
+    assert 0 <= sleeps[1] <= 1.5
+
+
+def test_post_is_not_resent_after_server_error(server: str) -> None:
+    session, adapter, sleeps = _session(max_retries=3)
+    _StandIn.scripted_responses["/create"] = [(500, {})]
+    assert session.post(server + "/create", data="{}").status_code == 500
+    assert _StandIn.calls["/create"] == 1
+
+    # but throttled requests were never processed, so they are retried
+    _StandIn.scripted_responses["/throttled"] = [(429, {"Retry-After": "0"}), (200, {})]
+    assert session.post(server + "/throttled", data="{}").status_code == 200
+    assert _StandIn.calls["/throttled"] == 2
+
+
+def test_default_timeout(server: str) -> None:
+    session, adapter, sleeps = _session(read_timeout=0.1, max_retries=1)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        session.get(server + "/slow")
+    assert _StandIn.calls["/slow"] == 2
+    assert adapter.stats()["GET /slow"].errors == 2
+
+    # an explicit timeout still wins
+    assert session.get(server + "/slow", timeout=5).status_code == 200
+
+
+def test_install() -> None:
+    class WrappingSession:
+        def __init__(self) -> None:
+            self._session = requests.session()
+
+    wrapper = WrappingSession()
+    adapter = install(wrapper, {"pool_maxsize": 32})
+    assert adapter
+    assert adapter.transport_config.pool_maxsize == 32
+    assert wrapper._session.get_adapter("https://localhost") is adapter
+
+    assert install(object(), {}) is None
+
+    with pytest.raises(RuntimeError):
+        install(requests.session(), {"pool_size": 32})
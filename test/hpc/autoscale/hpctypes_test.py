@@ -25,3 +25,35 @@ def test_memory() -> None:
 
     assert m("100g") // 9.99 == m("10g")
     assert m("100g") // 10.01 == m("9g")
+
+
+def test_memory_same_magnitude() -> None:
+    m = Memory.value_of
+    # same magnitude arithmetic matches the mixed magnitude results
+    assert m("4g") - m("1.5g") == m("4g") - m("1536m")
+    assert m("4g") + m("1.5g") == m("4g") + m("1536m")
+    assert m("4g") // m("1.5g") == m("4g") // m("1536m")
+    assert m("4g") / m("2g") == m("4g") / m("2048m")
+    assert m("4g") * 2 == m("8g")
+
+    # results keep the magnitude of the left hand side
+    assert (m("4g") - m("1g")).magnitude == "g"
+    assert (m("4g") - m("1024m")).magnitude == "g"
+    assert str(m("4g") - m("1.5g")) == "2.50g"
+    assert repr(m("4g") - m("1g")) == "3.0g"
+
+    # comparisons are against bytes, including plain numbers
+    assert m("1g") >= m("1024m")
+    assert m("1g") <= m("1024m")
+    assert m("1g") == 1024 ** 3
+    assert m("1g") > 1024 ** 3 - 1
+    assert m("1g") < 1024 ** 3 + 0.5
+    assert not m("1g") == "1g"
+    assert float(m("1.5k")) == 1536.0
+
+    # repeated decrements stay exact
+    mem = m("16g")
+    for _ in range(16):
+        mem = mem - m("1g")
+    assert mem == 0
+    assert mem >= m("0g")
@@ -7,8 +7,12 @@ from hypothesis import strategies as s
 from hpc.autoscale import results as resultslib
 from hpc.autoscale import util
 from hpc.autoscale.ccbindings.mock import MockClusterBinding
-from hpc.autoscale.job.demandcalculator import DemandCalculator, new_demand_calculator
-from hpc.autoscale.job.job import Job
+from hpc.autoscale.job.demandcalculator import (
+    DemandCalculator,
+    compare_packing,
+    new_demand_calculator,
+)
+from hpc.autoscale.job.job import Job, PackingStrategy
 from hpc.autoscale.node import vm_sizes
 from hpc.autoscale.node.constraints import (
     ExclusiveNode,
@@ -218,6 +222,64 @@ def test_bug100(mixedbindings) -> None:
     assert len(demand.new_nodes) == 3
 
 
+def _mixed_size_jobs(packing_strategy):
+    # submitted smallest first, so greedy packing fills a node with the small jobs
+    return [
+        Job(
+            "j{}".format(n),
+            {"ncpus": ncpus},
+            iterations=1,
+            packing_strategy=packing_strategy,
+        )
+        for n, ncpus in enumerate([1, 1, 1, 1, 3, 3, 3, 3])
+    ]
+
+
+def test_best_fit_decreasing() -> None:
+    bindings = MockClusterBinding()
+    bindings.add_nodearray("htc", {})
+    bindings.add_bucket("htc", "Standard_F4", 100, 100)
+
+    dcalc = _new_dc(bindings)
+    dcalc.add_jobs(_mixed_size_jobs(PackingStrategy.PACK))
+    assert len(dcalc.get_demand().new_nodes) == 5
+
+    dcalc = _new_dc(bindings)
+    dcalc.add_jobs(_mixed_size_jobs(PackingStrategy.BEST_FIT))
+    new_nodes = dcalc.get_demand().new_nodes
+    assert len(new_nodes) == 4
+    assert all(n.available["ncpus"] == 0 for n in new_nodes)
+
+    comparison = compare_packing(
+        lambda: _new_dc(bindings), _mixed_size_jobs(PackingStrategy.PACK)
+    )
+    assert comparison.greedy_new_nodes == 5
+    assert comparison.best_fit_new_nodes == 4
+    assert comparison.nodes_saved == 1
+    assert comparison.greedy_unplaced_slots == 0
+    assert comparison.best_fit_unplaced_slots == 0
+
+
+def test_best_fit_keeps_other_jobs_in_order() -> None:
+    bindings = MockClusterBinding()
+    bindings.add_nodearray("htc", {})
+    bindings.add_bucket("htc", "Standard_F4", 100, 100)
+    dcalc = _new_dc(bindings)
+
+    def best_fit(name: str, ncpus: int) -> Job:
+        return Job(name, {"ncpus": ncpus}, packing_strategy=PackingStrategy.BEST_FIT)
+
+    jobs = [
+        best_fit("a", 1),
+        best_fit("b", 2),
+        Job("c", {"ncpus": 1}),
+        best_fit("d", 1),
+        best_fit("e", 4),
+    ]
+    ordered = dcalc._best_fit_decreasing(jobs)
+    assert [j.name for j in ordered] == ["b", "a", "c", "e", "d"]
+
+
 def _assert_success(result, bucket_names, index_start=1):
     assert result
     assert "success" == result.status
@@ -1,10 +1,12 @@
+import csv
 import io
 import json
+from typing import List, Optional
 
 from hpc.autoscale.hpctypes import Memory
 from hpc.autoscale.job.computenode import SchedulerNode
 from hpc.autoscale.job.demand import DemandResult
-from hpc.autoscale.job.demandprinter import OutputFormat, print_demand
+from hpc.autoscale.job.demandprinter import DemandPrinter, OutputFormat, print_demand
 
 
 def _print_demand(output_format: OutputFormat) -> str:
@@ -55,3 +57,46 @@ def test_print_demand_json() -> None:
             "mem": "1.00g",
         }
     ]
+
+
+def test_print_demand_jsonl() -> None:
+    lines = _print_demand("jsonl").splitlines()
+    assert len(lines) == 1
+    d = json.loads(lines[0])
+    d["job_ids"] = sorted(d["job_ids"])
+    assert d == {
+        "hostname": "tux",
+        "job_ids": ["11", "12"],
+        "ncpus": 2,
+        "*ncpus": 1,
+        "mem": "1.00g",
+    }
+
+
+def test_print_demand_csv() -> None:
+    rows = list(csv.reader(io.StringIO(_print_demand("csv"))))
+    assert len(rows) == 2
+    assert rows[0] == ["hostname", "job_ids", "ncpus", "*ncpus", "mem"]
+    assert rows[1][0] == "tux"
+    assert set(rows[1][1].split(",")) == set(["11", "12"])
+    assert rows[1][2:] == ["2", "1", "1.00g"]
+
+
+def test_print_demand_sampled_width() -> None:
+    nodes = [SchedulerNode("n{}".format("x" * i), {"ncpus": i}) for i in range(1, 4)]
+    result = DemandResult([], nodes, [], [])
+
+    def print_table(width_sample_size: Optional[int]) -> List[str]:
+        stream = io.StringIO()
+        DemandPrinter(
+            ["name", "ncpus"], stream=stream, width_sample_size=width_sample_size,
+        ).print_demand(result)
+        return stream.getvalue().splitlines()
+
+    full = print_table(None)
+    sampled = print_table(1)
+    assert len(full) == len(sampled) == 4
+    # same content, only the alignment differs
+    assert [line.split() for line in full] == [line.split() for line in sampled]
+    assert full[0].index("NCPUS") == len("nxxx") + 1
+    assert sampled[0].index("NCPUS") == len("name") + 1
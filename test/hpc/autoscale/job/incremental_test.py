@@ -0,0 +1,104 @@
+import os
+from typing import List, Optional, Tuple
+
+from hpc.autoscale import util
+from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.job.demandcalculator import DemandCalculator, new_demand_calculator
+from hpc.autoscale.job.incremental import DemandJournal
+from hpc.autoscale.job.job import Job
+from hpc.autoscale.node.nodehistory import NullNodeHistory
+
+util.set_uuid_func(util.IncrementingUUID())
+
+
+def _bindings(extra_node: bool = False) -> MockClusterBinding:
+    bindings = MockClusterBinding()
+    bindings.add_nodearray("htc", {})
+    bindings.add_nodearray("mem", {})
+    bindings.add_bucket("htc", "Standard_F4", 100, 100)
+    bindings.add_bucket("mem", "Standard_E4_v3", 100, 100)
+    bindings.add_node("htc-1", "htc", "Standard_F4")
+    if extra_node:
+        bindings.add_node("htc-2", "htc", "Standard_F4")
+    return bindings
+
+
+def _dcalc(
+    bindings: MockClusterBinding, journal: Optional[DemandJournal]
+) -> DemandCalculator:
+    return new_demand_calculator(
+        {"_mock_bindings": bindings},
+        node_history=NullNodeHistory(),
+        singleton_lock=util.NullSingletonLock(),
+        journal=journal,
+    )
+
+
+def _jobs(count: int = 20) -> List[Job]:
+    ret = []
+    for n in range(count):
+        nodearray = "htc" if n % 2 else "mem"
+        ret.append(
+            Job(
+                "j{}".format(n),
+                {"ncpus": 1 + n % 3, "node.nodearray": nodearray},
+                iterations=3,
+            )
+        )
+    ret.append(Job("never", {"ncpus": 1, "node.nodearray": "other"}))
+    ret.append(Job("scatter", {"ncpus": 2, "exclusive": True}, node_count=2))
+    return ret
+
+
+def _demand(
+    bindings: MockClusterBinding, jobs: List[Job], journal: Optional[DemandJournal]
+) -> List[Tuple]:
+    dcalc = _dcalc(bindings, journal)
+    dcalc.add_jobs(jobs)
+    dcalc.finish()
+    nodes = [
+        (n.name, n.vm_size, n.exists, sorted(n.assignments), n.available["ncpus"])
+        for n in dcalc.get_compute_nodes()
+    ]
+    return sorted(nodes) + [(j.name, j.iterations_remaining) for j in jobs]
+
+
+def test_unchanged_cycle_is_replayed() -> None:
+    journal = DemandJournal()
+    first = _demand(_bindings(), _jobs(), journal)
+    assert journal.replayed_count == 0
+
+    assert first == _demand(_bindings(), _jobs(), journal)
+    # node_count jobs are always allocated
+    assert journal.allocated_count == 1
+    assert journal.replayed_count == len(_jobs()) - 1
+
+    assert first == _demand(_bindings(), _jobs(), None)
+
+
+def test_changes_match_a_full_recompute() -> None:
+    journal = DemandJournal()
+    _demand(_bindings(), _jobs(), journal)
+
+    # one job is gone and a new one is added, htc has a new node
+    def jobs() -> List[Job]:
+        return _jobs()[1:] + [Job("new", {"ncpus": 1, "node.nodearray": "mem"})]
+
+    assert _demand(_bindings(True), jobs(), journal) == _demand(
+        _bindings(True), jobs(), None
+    )
+    assert journal.replayed_count > 0
+    assert journal.allocated_count > 1
+
+    # and back again
+    assert _demand(_bindings(), _jobs(), journal) == _demand(_bindings(), _jobs(), None)
+
+
+def test_saved_to_path(tmp_path: str) -> None:
+    path = os.path.join(str(tmp_path), "demandjournal.json")
+    expected = _demand(_bindings(), _jobs(), DemandJournal(path))
+    assert os.path.exists(path)
+
+    journal = DemandJournal(path)
+    assert expected == _demand(_bindings(), _jobs(), journal)
+    assert journal.replayed_count == len(_jobs()) - 1
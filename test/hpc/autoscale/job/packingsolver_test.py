@@ -0,0 +1,92 @@
+from typing import List
+
+from hpc.autoscale import util
+from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.job.demandcalculator import DemandCalculator, new_demand_calculator
+from hpc.autoscale.job.job import Job
+from hpc.autoscale.job.packingsolver import PackingSolver, can_solve, new_packing_solver
+from hpc.autoscale.node.nodehistory import NullNodeHistory
+
+util.set_uuid_func(util.IncrementingUUID())
+
+
+def _bindings(f16_count: int = 100) -> MockClusterBinding:
+    bindings = MockClusterBinding()
+    bindings.add_nodearray("htc", {})
+    # greedy allocation prefers the first bucket
+    bindings.add_bucket("htc", "Standard_F4", 100, 100)
+    bindings.add_bucket("htc", "Standard_F16", f16_count, f16_count)
+    return bindings
+
+
+def _dcalc(
+    bindings: MockClusterBinding, solver: PackingSolver = None
+) -> DemandCalculator:
+    return new_demand_calculator(
+        {"_mock_bindings": bindings},
+        node_history=NullNodeHistory(),
+        singleton_lock=util.NullSingletonLock(),
+        packing_solver=solver,
+    )
+
+
+def _jobs() -> List[Job]:
+    return [Job("j{}".format(n), {"ncpus": 3}, iterations=1) for n in range(10)]
+
+
+def _vm_sizes(dcalc: DemandCalculator) -> List[str]:
+    demand = dcalc.finish()
+    for job_node in demand.new_nodes:
+        assert job_node.assignments
+    return sorted(n.vm_size for n in demand.new_nodes)
+
+
+def test_greedy() -> None:
+    dcalc = _dcalc(_bindings())
+    dcalc.add_jobs(_jobs())
+    assert _vm_sizes(dcalc) == ["Standard_F4"] * 10
+
+
+def test_minimizes_vcpus() -> None:
+    dcalc = _dcalc(_bindings(), PackingSolver())
+    dcalc.add_jobs(_jobs())
+    # 2 * 16 vcpus instead of 10 * 4
+    assert _vm_sizes(dcalc) == ["Standard_F16"] * 2
+
+
+def test_existing_nodes_first() -> None:
+    bindings = _bindings()
+    bindings.add_node("htc-1", "htc", "Standard_F4")
+    dcalc = _dcalc(bindings, PackingSolver())
+    dcalc.add_jobs(_jobs())
+    demand = dcalc.finish()
+    existing = [n for n in demand.compute_nodes if n.exists]
+    assert len(existing) == 1 and existing[0].assignments
+    # 9 slots left, 5 per F16
+    assert sorted(n.vm_size for n in demand.new_nodes) == ["Standard_F16"] * 2
+
+
+def test_respects_limits() -> None:
+    dcalc = _dcalc(_bindings(f16_count=1), PackingSolver())
+    dcalc.add_jobs(_jobs())
+    assert _vm_sizes(dcalc) == ["Standard_F16"] + ["Standard_F4"] * 5
+
+
+def test_cost_weights() -> None:
+    solver = new_packing_solver({"cost_weights": {"Standard_F16": 2}})
+    dcalc = _dcalc(_bindings(), solver)
+    dcalc.add_jobs(_jobs())
+    assert _vm_sizes(dcalc) == ["Standard_F4"] * 10
+
+
+def test_out_of_time_is_greedy() -> None:
+    dcalc = _dcalc(_bindings(), PackingSolver(time_budget=-1))
+    dcalc.add_jobs(_jobs())
+    assert _vm_sizes(dcalc) == ["Standard_F4"] * 10
+
+
+def test_can_solve() -> None:
+    assert can_solve(Job("a", {"ncpus": 1, "node.nodearray": "htc"}))
+    assert not can_solve(Job("b", {"ncpus": 1, "exclusive": True}))
+    assert not can_solve(Job("c", {"ncpus": 1}, node_count=2))
+    assert not can_solve(Job("d", {"ncpus": 1}, colocated=True))
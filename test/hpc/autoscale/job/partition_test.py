@@ -0,0 +1,151 @@
+from typing import List, Tuple
+
+from hpc.autoscale import util
+from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.job.demandcalculator import DemandCalculator, new_demand_calculator
+from hpc.autoscale.job.job import Job
+from hpc.autoscale.job.partition import partition_jobs
+from hpc.autoscale.node.nodehistory import NullNodeHistory
+
+util.set_uuid_func(util.IncrementingUUID())
+
+
+def _bindings(regional_quota_core_count: int = 1_000_000) -> MockClusterBinding:
+    bindings = MockClusterBinding()
+    bindings.add_nodearray("htc", {})
+    bindings.add_nodearray("mem", {})
+    bindings.add_bucket(
+        "htc",
+        "Standard_F4",
+        100,
+        100,
+        regional_quota_core_count=regional_quota_core_count,
+    )
+    bindings.add_bucket(
+        "mem",
+        "Standard_E4_v3",
+        100,
+        100,
+        regional_quota_core_count=regional_quota_core_count,
+    )
+    bindings.add_node("htc-1", "htc", "Standard_F4")
+    return bindings
+
+
+def _dcalc(bindings: MockClusterBinding, partition_workers: int) -> DemandCalculator:
+    return new_demand_calculator(
+        {"_mock_bindings": bindings},
+        node_history=NullNodeHistory(),
+        singleton_lock=util.NullSingletonLock(),
+        partition_workers=partition_workers,
+    )
+
+
+def _jobs() -> List[Job]:
+    ret = []
+    for n in range(20):
+        nodearray = "htc" if n % 2 else "mem"
+        ret.append(
+            Job(
+                "j{}".format(n),
+                {"ncpus": 1 + n % 3, "node.nodearray": nodearray},
+                iterations=3,
+            )
+        )
+    # after j0, so the mem partition still comes first. The first goes to htc-1,
+    # which no other job may then share
+    ret[1:1] = [
+        Job("x{}".format(n), {"ncpus": 1, "node.nodearray": "htc", "exclusive": True})
+        for n in range(2)
+    ]
+    ret.append(Job("n-htc", {"node.nodearray": "htc"}, node_count=3))
+    ret.append(Job("n-mem", {"ncpus": 2, "node.nodearray": "mem"}, node_count=2))
+    # neither nodearray has placement groups, so this one can't run either
+    ret.append(
+        Job("colocated", {"node.nodearray": "mem"}, node_count=2, colocated=True)
+    )
+    # no bucket can run this one
+    ret.append(Job("never", {"ncpus": 1, "node.nodearray": "other"}))
+    return ret
+
+
+def _demand(dcalc: DemandCalculator) -> List[Tuple]:
+    jobs = _jobs()
+    dcalc.add_jobs(jobs)
+    nodes = [
+        (
+            n.name,
+            n.vm_size,
+            n.exists,
+            sorted(n.assignments),
+            n.available["ncpus"],
+            n.closed,
+        )
+        for n in dcalc.get_compute_nodes()
+    ]
+    return sorted(nodes) + [(j.name, j.iterations_remaining) for j in jobs]
+
+
+def test_partition_jobs() -> None:
+    bindings = _bindings()
+    bindings.add_nodearray("htc2", {})
+    # shares the F family limit with htc
+    bindings.add_bucket("htc2", "Standard_F4", 100, 100)
+    dcalc = _dcalc(bindings, 0)
+
+    jobs = _jobs() + [Job("h", {"ncpus": 1, "node.nodearray": "htc2"})]
+    partitions, unmatched = partition_jobs(jobs, dcalc.node_mgr.get_buckets())
+    assert [j.name for j in unmatched] == ["never"]
+    assert len(partitions) == 2
+    mem, htc = partitions
+    assert [b.nodearray for b in mem.buckets] == ["mem"]
+    assert sorted(b.nodearray for b in htc.buckets) == ["htc", "htc2"]
+    assert [j.name for j in htc.jobs][-1] == "h"
+    assert len(mem.jobs) + len(htc.jobs) == len(jobs) - 1
+
+
+def test_same_as_serial() -> None:
+    serial = _demand(_dcalc(_bindings(), 0))
+    assert serial == _demand(_dcalc(_bindings(), 2))
+    # the existing node is taken, and closed, by the first exclusive job
+    assert ("htc-1", "Standard_F4", True) == serial[0][:3]
+    assert serial[0][3] == ["x0"]
+    assert serial[0][5]
+    # node_count jobs are placed as a whole
+    nodes = [n for n in serial if len(n) == 6]
+    assert len([n for n in nodes if "n-htc" in n[3]]) == 3
+    assert len([n for n in nodes if "n-mem" in n[3]]) == 2
+    assert ("never", 1) in serial
+
+
+def test_exclusive_job_on_an_existing_node() -> None:
+    def run(partition_workers: int) -> List[Tuple]:
+        dcalc = _dcalc(_bindings(), partition_workers)
+        exclusive = Job(
+            "exclusive", {"ncpus": 1, "node.nodearray": "htc", "exclusive": True}
+        )
+        dcalc.add_jobs([exclusive] + _jobs())
+        return sorted(
+            (n.name, n.closed, sorted(n.assignments), n.available["ncpus"])
+            for n in dcalc.get_compute_nodes()
+        )
+
+    serial = run(0)
+    assert serial[0] == ("htc-1", True, ["exclusive"], 3)
+    assert serial == run(2)
+
+
+def test_regional_limit_is_reconciled() -> None:
+    # each partition fits on its own, but not both. The first partition, mem, keeps
+    # its nodes and htc is allocated again with what is left.
+    def run() -> List[Tuple]:
+        return _demand(_dcalc(_bindings(regional_quota_core_count=64), 2))
+
+    partitioned = run()
+    assert partitioned == run()
+    new_nodes = [n for n in partitioned if len(n) == 6 and not n[2]]
+    # htc-1 already uses 4 of the 64 cores
+    assert 4 * len(new_nodes) == 60
+    assert {n[1] for n in new_nodes} == {"Standard_E4_v3"}
+    assert partitioned[0][:3] == ("htc-1", "Standard_F4", True)
+    assert partitioned[0][3]
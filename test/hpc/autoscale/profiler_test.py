@@ -0,0 +1,69 @@
+import json
+
+from hpc.autoscale import profiler
+from hpc.autoscale.job.job import Job
+from hpc.autoscale.job.schedulernode import SchedulerNode
+
+
+def _write_inputs(tmpdir) -> tuple:
+    jobs_path = str(tmpdir.join("jobs.jsonl"))
+    with open(jobs_path, "w") as fw:
+        for n in range(50):
+            fw.write(json.dumps(Job(str(n), {"ncpus": 1}).to_dict()) + "\n")
+
+    nodes_path = str(tmpdir.join("nodes.json"))
+    with open(nodes_path, "w") as fw:
+        json.dump([SchedulerNode("onprem-1", {"ncpus": 4}).to_dict()], fw)
+
+    return jobs_path, nodes_path
+
+
+def test_cprofile(tmpdir, capsys) -> None:
+    jobs_path, nodes_path = _write_inputs(tmpdir)
+    collapsed = str(tmpdir.join("cycle.folded"))
+    pstats_path = str(tmpdir.join("cycle.pstats"))
+
+    args = ["-j", jobs_path, "-n", nodes_path, "--synthetic", "1"]
+    args += ["--synthetic-nodes", "200", "--synthetic-nodearrays", "5"]
+    args += ["--collapsed", collapsed, "--pstats", pstats_path, "--top", "5"]
+    assert profiler.main(args) == 0
+
+    out = capsys.readouterr().out
+    for phase in ["new_demand_calculator", "add_jobs", "finish"]:
+        assert phase in out
+    assert "MiB" in out
+
+    with open(collapsed) as fr:
+        lines = fr.read().splitlines()
+    assert lines
+    phases = set()
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        phases.add(stack.split(";")[0])
+    assert phases == {"new_demand_calculator", "add_jobs", "finish"}
+
+
+def test_sample(tmpdir, capsys) -> None:
+    jobs_path, _ = _write_inputs(tmpdir)
+    collapsed = str(tmpdir.join("cycle.folded"))
+
+    args = ["-j", jobs_path, "--synthetic", "1", "--synthetic-nodes", "2000"]
+    args += ["--profiler", "sample", "--no-memory", "--collapsed", collapsed]
+    assert profiler.main(args) == 0
+
+    out = capsys.readouterr().out
+    assert "MiB" not in out
+    with open(collapsed) as fr:
+        assert any(line.startswith("new_demand_calculator;") for line in fr)
+
+
+def test_load_json_records(tmpdir) -> None:
+    path = str(tmpdir.join("records"))
+    with open(path, "w") as fw:
+        fw.write('{"a": 1}\n\n{"a": 2}\n')
+    assert profiler.load_json_records(path) == [{"a": 1}, {"a": 2}]
+
+    with open(path, "w") as fw:
+        fw.write('[{"a": 1}, {"a": 2}]')
+    assert profiler.load_json_records(path) == [{"a": 1}, {"a": 2}]
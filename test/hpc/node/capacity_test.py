@@ -0,0 +1,254 @@
+import pickle
+import random
+from typing import List
+
+from hpc.autoscale import util
+from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.job.demandcalculator import new_demand_calculator
+from hpc.autoscale.job.job import Job
+from hpc.autoscale.job.nodequeue import NodeQueue
+from hpc.autoscale.job.schedulernode import SchedulerNode
+from hpc.autoscale.node.bucket import _NodeList
+from hpc.autoscale.node.capacity import CapacityIndex, minimum_requests
+from hpc.autoscale.node.constraints import (
+    ExclusiveNode,
+    InAPlacementGroup,
+    get_constraints,
+)
+from hpc.autoscale.node.node import Node
+from hpc.autoscale.node.nodehistory import NullNodeHistory
+from hpc.autoscale.node.nodemanager import new_node_manager
+from hpc.autoscale.results import EarlyBailoutResult
+
+util.set_uuid_func(util.IncrementingUUID())
+
+
+def _fits(node: Node, ncpus: int, memgb: float) -> bool:
+    return node.available["ncpus"] >= ncpus and node.available["memgb"] >= memgb
+
+
+def test_candidates() -> None:
+    rand = random.Random(7)
+    # like a bucket's nodes, they count their changes
+    nodes: List[Node] = _NodeList(
+        SchedulerNode(
+            "n{}".format(n), {"ncpus": rand.randint(0, 8), "memgb": rand.random() * 8}
+        )
+        for n in range(37)
+    )
+    index = CapacityIndex(nodes)
+    assert index.is_current(nodes)
+
+    for _ in range(50):
+        ncpus, memgb = rand.randint(0, 9), rand.random() * 9
+        candidates = list(index.candidates({"ncpus": ncpus, "memgb": memgb}))
+        assert [n for n in nodes if _fits(n, ncpus, memgb)] == [
+            n for n in candidates if _fits(n, ncpus, memgb)
+        ]
+        for node in candidates[:3]:
+            node.available["ncpus"] = max(0, node.available["ncpus"] - 1)
+            index.update(node)
+        # updated, they are only returned if they fit
+        assert list(index.candidates({"ncpus": ncpus, "memgb": memgb})) == [
+            n for n in nodes if _fits(n, ncpus, memgb)
+        ]
+
+    # a node gained resources, so the index has to be built again
+    nodes[0].available["ncpus"] += 1
+    assert not index.is_current(nodes)
+    assert CapacityIndex(nodes).is_current(nodes)
+    # new nodes do not count
+    SchedulerNode("other", {"ncpus": 1}).available["ncpus"] = 2
+    assert CapacityIndex(nodes).is_current(nodes)
+
+
+def test_replaced_nodes() -> None:
+    node_mgr = new_node_manager({"_mock_bindings": _bindings()})
+    nodes = node_mgr.get_buckets()[0].nodes
+    index = CapacityIndex(nodes)
+    assert index.is_current(nodes)
+
+    # the same number of nodes, but not the same nodes
+    node = nodes[0]
+    nodes.remove(node)
+    nodes.append(node)
+    assert not index.is_current(nodes)
+    assert CapacityIndex(nodes).is_current(nodes)
+
+
+def test_only_the_raised_index_is_stale() -> None:
+    nodes_a = new_node_manager({"_mock_bindings": _bindings()}).get_buckets()[0].nodes
+    nodes_b = new_node_manager({"_mock_bindings": _bindings()}).get_buckets()[0].nodes
+    index_a, index_b = CapacityIndex(nodes_a), CapacityIndex(nodes_b)
+
+    nodes_b[0].available["ncpus"] += 1
+    assert not index_b.is_current(nodes_b)
+    assert index_a.is_current(nodes_a)
+
+    # nor do copies of the nodes count
+    nodes_a[0].clone().available["ncpus"] += 1
+    pickle.loads(pickle.dumps(nodes_a[1])).available["ncpus"] += 1
+    assert index_a.is_current(nodes_a)
+    nodes_a[0].available["ncpus"] += 1
+    assert not index_a.is_current(nodes_a)
+
+
+def test_minimum_requests() -> None:
+    constraints = get_constraints(
+        [
+            {"ncpus": 2},
+            {"and": [{"ncpus": 3}, {"memgb": 1.5}]},
+            {"or": [{"ngpus": 1}, {"ncpus": 8}]},
+        ]
+    )
+    assert minimum_requests(constraints) == {"ncpus": 3, "memgb": 1.5}
+
+
+def _bindings() -> MockClusterBinding:
+    bindings = MockClusterBinding()
+    bindings.add_nodearray("htc", {})
+    bindings.add_bucket("htc", "Standard_F4", 100, 100)
+    for n in range(50):
+        bindings.add_node("htc-{}".format(n + 1), "htc", "Standard_F4")
+    return bindings
+
+
+def test_nearly_full_bucket() -> None:
+    node_mgr = new_node_manager({"_mock_bindings": _bindings()})
+    nodes = node_mgr.get_buckets()[0].nodes
+    for node in nodes:
+        if node.name not in ["htc-17", "htc-33"]:
+            node.available["ncpus"] = 0
+    nodes[32].available["ncpus"] = 1
+
+    result = node_mgr.allocate({"ncpus": 1}, slot_count=6, allow_new=False)
+    assert result
+    assert [n.name for n in result.nodes] == ["htc-17", "htc-33"]
+    assert result.total_slots == 5
+
+    result = node_mgr.allocate({"ncpus": 2}, slot_count=1)
+    assert result
+    assert [n.name for n in result.nodes] == ["htc-51"]
+
+
+class _SkipOdd(NodeQueue):
+    def early_bailout(self, node: Node) -> EarlyBailoutResult:
+        if int(node.name.split("-")[1]) % 2:
+            return EarlyBailoutResult("Odd", node, ["skipping odd nodes"])
+        return EarlyBailoutResult("success")
+
+
+def test_early_bailout() -> None:
+    dcalc = new_demand_calculator(
+        {"_mock_bindings": _bindings()},
+        node_history=NullNodeHistory(),
+        node_queue=_SkipOdd(),
+        singleton_lock=util.NullSingletonLock(),
+    )
+    dcalc.add_job(Job("a", {"ncpus": 4}, iterations=3))
+    assert sorted(n.name for n in dcalc.get_compute_nodes() if n.assignments) == [
+        "htc-2",
+        "htc-4",
+        "htc-6",
+    ]
+
+
+def _shared_quota_bindings() -> MockClusterBinding:
+    bindings = MockClusterBinding()
+    bindings.add_nodearray("htc", {})
+    bindings.add_nodearray("mem", {})
+    # 64 regional cores shared by both
+    bindings.add_bucket("htc", "Standard_F4", 100, 100, regional_quota_core_count=64)
+    bindings.add_bucket("mem", "Standard_E4_v3", 100, 100, regional_quota_core_count=64)
+    bindings.add_node("htc-1", "htc", "Standard_F4")
+    return bindings
+
+
+def test_query_capacity() -> None:
+    node_mgr = new_node_manager({"_mock_bindings": _shared_quota_bindings()})
+    node_names = dict(node_mgr._node_names)
+
+    estimate = node_mgr.query_capacity({"ncpus": 2})
+    # htc-1 fits 2, then 15 new htc nodes use up the rest of the regional quota
+    assert [(b.existing_slots, b.new_node_count) for b in estimate.buckets] == [
+        (2, 15),
+        (0, 0),
+    ]
+    assert estimate.total_slots == 32
+    assert estimate
+    # nothing was allocated
+    assert node_mgr._node_names == node_names
+    assert not node_mgr.new_nodes
+
+    estimate = node_mgr.query_capacity({"ncpus": 2}, slot_count=7)
+    assert [(b.existing_slots, b.new_node_count) for b in estimate.buckets] == [(2, 3)]
+    assert estimate.total_slots == 8
+    assert not node_mgr.query_capacity({"ncpus": 2}, slot_count=33)
+
+    # the same as actually allocating
+    result = node_mgr.allocate({"ncpus": 2}, slot_count=7)
+    assert len([n for n in result.nodes if not n.exists]) == 3
+    estimate = node_mgr.query_capacity({"ncpus": 2, "node.nodearray": "mem"})
+    assert [(b.existing_slots, b.new_node_count) for b in estimate.buckets] == [(0, 12)]
+    assert node_mgr.allocate({"ncpus": 2, "node.nodearray": "mem"}, slot_count=100)
+    assert not node_mgr.query_capacity({"ncpus": 2, "node.nodearray": "mem"})
+
+
+def test_query_capacity_sees_new_default_resources() -> None:
+    node_mgr = new_node_manager({"_mock_bindings": _bindings()})
+    assert node_mgr.query_capacity({"foo": 1}, slot_count=4).total_slots == 0
+
+    node_mgr.add_default_resource({}, "foo", 4)
+    estimate = node_mgr.query_capacity({"foo": 1}, slot_count=4)
+    assert estimate.total_slots == 4
+    assert node_mgr.allocate({"foo": 1}, slot_count=4)
+
+
+def test_colocated_goes_to_the_tightest_placement_group() -> None:
+    bindings = MockClusterBinding()
+    bindings.add_nodearray("hpc", {}, max_placement_group_size=10)
+    bindings.add_bucket(
+        "hpc",
+        "Standard_F4",
+        100,
+        100,
+        placement_groups=["pg{}".format(n) for n in range(5)],
+    )
+    # an idle node still leaves room for 10
+    bindings.add_node("hpc-1", "hpc", "Standard_F4", placement_group="pg2")
+    node_mgr = new_node_manager({"_mock_bindings": bindings})
+
+    def allocate(node_count: int) -> List[str]:
+        result = node_mgr.allocate(
+            [InAPlacementGroup(), ExclusiveNode()],
+            node_count=node_count,
+            all_or_nothing=True,
+        )
+        if not result:
+            return []
+        return sorted(set([n.placement_group for n in result.nodes]))
+
+    assert allocate(7) == ["pg0"]
+    assert allocate(9) == ["pg1"]
+    # pg0 has 3 left, pg1 1 and the rest 10
+    assert allocate(1) == ["pg1"]
+    assert allocate(2) == ["pg0"]
+
+    result = node_mgr.allocate(
+        [InAPlacementGroup()], node_count=11, all_or_nothing=True
+    )
+    assert not result
+    assert any("can hold 11 nodes" in r for r in result.reasons)
+
+    # rolled back capacity is seen again
+    savepoint = node_mgr.savepoint()
+    assert allocate(9) == ["pg2"]
+    savepoint.rollback()
+    assert allocate(10) == ["pg2"]
+    assert allocate(1) == ["pg0"]
+
+    # only pg3 and pg4 are left, yielded one at a time
+    index = node_mgr._placement_group_index(node_mgr.get_buckets()[0].bucket_id)
+    fits = index.fits(2)
+    assert next(fits).placement_group == "pg3"
+    assert [b.placement_group for b in fits] == ["pg4"]
@@ -1,5 +1,6 @@
 from typing import Dict
 
+from hpc.autoscale import hpctypes as ht
 from hpc.autoscale.job.computenode import SchedulerNode
 from hpc.autoscale.node.constraints import (
     BaseNodeConstraint,
@@ -7,6 +8,7 @@ from hpc.autoscale.node.constraints import (
     InAPlacementGroup,
     MinResourcePerNode,
     Never,
+    NodeConstraint,
     NodePropertyConstraint,
     NodeResourceConstraint,
     Or,
@@ -286,3 +288,64 @@ def test_never() -> None:
     c = get_constraint({"never": "my other message"})
     assert isinstance(c, Never)
     assert c.message == "my other message"
+
+
+def test_do_decrement_n() -> None:
+    def decrement_both_ways(c: NodeConstraint, resources: Dict, count: int) -> None:
+        looped = SchedulerNode("looped", dict(resources))
+        bulk = SchedulerNode("bulk", dict(resources))
+        for _ in range(count):
+            c.do_decrement(looped)
+        assert c.do_decrement_n(bulk, count)
+        assert looped.available == bulk.available
+        assert looped.closed == bulk.closed
+
+    resources = {"ncpus": 8, "ngpus": 2, "mem": ht.Memory.value_of("16g")}
+    for expr in [
+        {"ncpus": 1},
+        {"mem": ht.Memory.value_of("2g")},
+        {"exclusive": True},
+        {"and": [{"ncpus": 2}, {"mem": ht.Memory.value_of("1g")}]},
+        {"or": [{"ngpus": 1}, {"ncpus": 1}]},
+        {"xor": [{"ngpus": 1}, {"undefined": 1}]},
+    ]:
+        decrement_both_ways(get_constraint(expr), resources, 2)
+
+    # the first child only has room for 2, so the loop semantics apply
+    decrement_both_ways(
+        get_constraint({"or": [{"ngpus": 1}, {"ncpus": 1}]}), resources, 4
+    )
+
+    c = get_constraint({"ncpus": 3})
+    node = SchedulerNode("tmp", {"ncpus": 8})
+    try:
+        c.do_decrement_n(node, 3)
+        assert False
+    except RuntimeError:
+        pass
+    assert node.available["ncpus"] == 8
+
+    class CountingConstraint(BaseNodeConstraint):
+        def __init__(self) -> None:
+            self.calls = 0
+
+        def satisfied_by_node(self, node: Node) -> SatisfiedResult:
+            return SatisfiedResult("success", self, node)
+
+        def do_decrement(self, node: Node) -> bool:
+            self.calls += 1
+            return True
+
+        def to_dict(self) -> Dict:
+            return {"counting": self.calls}
+
+        def __str__(self) -> str:
+            return "CountingConstraint()"
+
+    # custom constraints still see one do_decrement per slot
+    counting = CountingConstraint()
+    node = SchedulerNode("tmp", {"ncpus": 8})
+    result = node.decrement([get_constraint({"ncpus": 1}), counting], iterations=6)
+    assert result.total_slots == 6
+    assert counting.calls == 6
+    assert node.available["ncpus"] == 2
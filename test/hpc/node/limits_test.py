@@ -2,7 +2,7 @@ from typing import Dict
 
 from hpc.autoscale.ccbindings.mock import MockClusterBinding
 from hpc.autoscale.node.bucket import NodeBucket
-from hpc.autoscale.node.limits import _SharedLimit
+from hpc.autoscale.node.limits import LimitsSnapshot, _SharedLimit
 from hpc.autoscale.node.nodemanager import new_node_manager
 from hpc.autoscale.util import partition
 
@@ -136,6 +136,65 @@ def test_shared_limit() -> None:
     assert limit._available_count(4) == 13
 
 
+def test_shared_limit_mixed_sizes() -> None:
+    # i.e. a nodearray with 10 nodes, 5 x 2 cores and 5 x 16 cores
+    limit = _SharedLimit("test", 90, 320, 10, 20)
+    assert limit._available_count(2) == 10
+    # 90 / 2 = 45 nodes would already be over max_count=20
+    limit._decrement(10, 2)
+    assert limit._consumed_core_count == 110
+    assert limit._available_count(2) == 0
+
+
+def test_cached_availability_and_snapshot() -> None:
+    bindings = MockClusterBinding("clusty")
+    bindings.add_nodearray("htc", {})
+    bindings.add_nodearray("mem", {})
+    bindings.add_bucket("htc", "Standard_F4", 100, 100, regional_quota_core_count=64)
+    bindings.add_bucket("mem", "Standard_E4_v3", 100, 100, regional_quota_core_count=64)
+    htc, mem = new_node_manager({"_mock_bindings": bindings}).get_buckets()
+    assert htc.available_count == mem.available_count == 16
+
+    snapshot = LimitsSnapshot([htc.limits, mem.limits])
+    htc.decrement(5)
+    htc.commit()
+    # the regional limit is shared, so mem's cached count is stale
+    assert htc.available_count == mem.available_count == 11
+    assert mem.limits.regional_available_count == 11
+
+    snapshot.restore()
+    assert htc.available_count == mem.available_count == 16
+    assert htc.limits.active_count == 0
+    assert htc.limits._regional_limits._consumed_core_count == 0
+
+    mem.decrement(16)
+    mem.commit()
+    assert htc.available_count == 0
+
+
 def test_limits_hypothesis() -> None:
     # TODO
     pass
+
+
+def test_mixed_sizes_in_one_family() -> None:
+    bindings = MockClusterBinding("clusty")
+    bindings.add_nodearray("htc", {})
+    for vm_size in ["Standard_F2", "Standard_F4"]:
+        bindings.add_bucket(
+            "htc",
+            vm_size,
+            100,
+            100,
+            family_consumed_core_count=0,
+            family_quota_core_count=90,
+        )
+    node_mgr = new_node_manager({"_mock_bindings": bindings})
+    # 86 of the 90 cores, which is not a multiple of 4
+    assert node_mgr.allocate({"node.vm_size": "Standard_F2"}, node_count=43)
+    assert node_mgr.allocate({"node.vm_size": "Standard_F4"}, node_count=1)
+    assert not node_mgr.allocate({"node.vm_size": "Standard_F2"}, node_count=1)
+
+    limit = _SharedLimit("test", 86, 90)
+    limit._decrement(1, 4)
+    assert limit._consumed_core_count == 90
@@ -0,0 +1,25 @@
+import os
+
+from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.node.nodehistory import SQLiteNodeHistory
+from hpc.autoscale.node.nodemanager import new_node_manager
+
+
+def test_more_than_1000_nodes(tmp_path: str) -> None:
+    bindings = MockClusterBinding()
+    bindings.add_nodearray("htc", {})
+    bindings.add_bucket("htc", "Standard_F2", 2000, 2000)
+    for n in range(1200):
+        bindings.add_node("htc-{}".format(n + 1), "htc")
+    nodes = new_node_manager({"_mock_bindings": bindings}).get_nodes()
+    assert len(nodes) == 1200
+
+    history = SQLiteNodeHistory(os.path.join(str(tmp_path), "nodehistory.db"))
+    history.update(nodes)
+    history.decorate(nodes)
+    assert all(n.create_time_unix for n in nodes)
+
+    # every node is gone
+    history.update([])
+    history.decorate(nodes)
+    assert all(n.delete_time_unix for n in nodes)
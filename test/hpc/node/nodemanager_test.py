@@ -1,16 +1,25 @@
+import asyncio
 from typing import Any, List
 
 import pytest
+from cyclecloud.model.NodeCreationResultModule import NodeCreationResult
+from cyclecloud.model.NodeManagementResultModule import NodeManagementResult
 from hypothesis import given, settings
 from hypothesis import strategies as s
 from hypothesis.strategies import SearchStrategy
 
 from hpc.autoscale import hpctypes as ht
-from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.ccbindings.interface import MergedNodeCreationResult
+from hpc.autoscale.ccbindings.mock import AsyncMockClusterBinding, MockClusterBinding
 from hpc.autoscale.job.schedulernode import SchedulerNode
-from hpc.autoscale.node import vm_sizes
+from hpc.autoscale.node import undolog, vm_sizes
+from hpc.autoscale.node.constraints import ExclusiveNode, InAPlacementGroup
 from hpc.autoscale.node.node import Node, UnmanagedNode
-from hpc.autoscale.node.nodemanager import NodeManager, new_node_manager
+from hpc.autoscale.node.nodemanager import (
+    NodeManager,
+    new_node_manager,
+    new_node_manager_async,
+)
 from hpc.autoscale.results import (
     DefaultContextHandler,
     register_result_handler,
@@ -33,8 +42,8 @@ def bindings() -> MockClusterBinding:
     return _bindings()
 
 
-def _bindings() -> MockClusterBinding:
-    bindings = MockClusterBinding("clusty")
+def _bindings(bindings_class: type = MockClusterBinding) -> MockClusterBinding:
+    bindings = bindings_class("clusty")
     bindings.add_nodearray(
         "htc",
         {"nodetype": "A", "pcpus": 2},
@@ -380,6 +389,57 @@ def test_mock_bindings(bindings: MockClusterBinding) -> None:
     assert pg1.available_count == 7
 
 
+def test_lazy_placement_groups() -> None:
+    b = MockClusterBinding()
+    b.add_nodearray("hpc", {}, max_placement_group_size=10)
+    b.add_bucket("hpc", "Standard_F4", 100, 100)
+    b.add_nodearray("htc", {})
+    b.add_bucket("htc", "Standard_F4", 100, 100)
+    pgs = ["pg{}".format(n) for n in range(20)]
+
+    def new_nm(lazy: bool) -> NodeManager:
+        return new_node_manager(
+            {
+                "_mock_bindings": b,
+                "lazy_placement_groups": lazy,
+                "nodearrays": {"hpc": {"placement_groups": pgs}},
+            }
+        )
+
+    def colocated(nm: NodeManager, node_count: int) -> List[Any]:
+        result = nm.allocate(
+            [InAPlacementGroup(), ExclusiveNode()],
+            node_count=node_count,
+            all_or_nothing=True,
+        )
+        assert result, result
+        return sorted(set([n.placement_group for n in result.nodes]))
+
+    eager, lazy = new_nm(False), new_nm(True)
+    assert len(eager.get_buckets()) == 22
+    assert len(lazy.get_buckets()) == 2
+    assert lazy.allocate({"ncpus": 1}, node_count=2)
+    assert len(lazy.get_buckets()) == 2
+
+    for node_count in [6, 3, 3]:
+        assert colocated(eager, node_count) == colocated(lazy, node_count)
+    # pg0 and one more, still empty when the last request went to it
+    assert [b.placement_group for b in lazy.get_buckets()] == [
+        None,
+        None,
+        "pg0",
+        "pg1",
+    ]
+    spare = lazy.get_buckets()[-1]
+    assert spare.resources["ncpus"] == 4
+    assert spare.available_count == 7
+
+    # named placement groups are built as well
+    result = lazy.allocate({"node.placement_group": "pg7"}, node_count=1)
+    assert [n.placement_group for n in result.nodes] == ["pg7"]
+    assert len(lazy.get_buckets()) == 5
+
+
 def test_default_resources() -> None:
 
     # set a global default
@@ -768,5 +828,484 @@ def test_unmanaged_nodes(node_mgr: NodeManager) -> None:
     assert node_mgr.get_buckets_by_id()[tux.bucket_id].nodes == [tux, tux2]
 
 
+def test_unmanaged_nodes_with_placement_groups() -> None:
+    bindings = MockClusterBinding("clusty")
+    bindings.add_nodearray("hpc", {})
+    bucket = bindings.add_bucket(
+        "hpc", "Standard_F4", 10, 10, placement_groups=["pg0", "pg1"]
+    )
+    node_mgr = _node_mgr(bindings)
+    assert len(node_mgr.get_buckets()) == 3
+
+    # placement group buckets share the bucket_id of their bucket
+    tux = SchedulerNode("tux", bucket_id=ht.BucketId(bucket.bucket_id))
+    node_mgr.add_unmanaged_nodes([tux])
+    assert len(node_mgr.get_buckets()) == 3
+    by_pg = partition_single(node_mgr.get_buckets(), lambda b: b.placement_group)
+    assert by_pg[None].nodes == [tux]
+    assert not by_pg["pg0"].nodes and not by_pg["pg1"].nodes
+
+
+def test_batch_default_resources(node_mgr: NodeManager) -> None:
+    with node_mgr.batch_default_resources():
+        node_mgr.add_default_resource({"custom": 1}, "custom_alias", "node.vcpu_count")
+        node_mgr.add_default_resource({}, "custom", 1)
+        node_mgr.add_default_resource({}, "custom", 2)
+        for b in node_mgr.get_buckets():
+            assert "custom" not in b.resources
+
+    # the first definition still wins, and selections on later defaults apply
+    for b in node_mgr.get_buckets():
+        assert b.resources["custom"] == 1
+        assert b.resources["custom_alias"] == b.vcpu_count
+
+    result = node_mgr.allocate({"node.nodearray": "htc"}, node_count=2)
+    assert result
+    for node in result.nodes:
+        assert node.resources["custom"] == 1
+        assert node.resources["custom_alias"] == 4
+
+
+def test_default_resource_expressions(node_mgr: NodeManager) -> None:
+    node_mgr.add_default_resource({}, "double_cpus", "`node.vcpu_count * 2`")
+    for b in node_mgr.get_buckets():
+        assert b.resources["double_cpus"] == b.vcpu_count * 2
+
+    with pytest.raises(RuntimeError):
+        node_mgr.add_default_resource({}, "bad_syntax", "`node.vcpu_count *`")
+
+    # expressions can not modify the node, and failures leave the default undefined
+    node_mgr.add_default_resource({}, "mutate", "`node.available.pop('ncpus')`")
+    node_mgr.add_default_resource({}, "mutate", "`node.decrement([], 1)`")
+    node_mgr.add_default_resource({}, "missing", "`node.resources['undefined']`")
+    for b in node_mgr.get_buckets():
+        assert "mutate" not in b.resources
+        assert "missing" not in b.resources
+        assert b.resources["ncpus"] == b.vcpu_count
+
+    result = node_mgr.allocate({"node.nodearray": "htc"}, node_count=1)
+    assert result
+    assert result.nodes[0].resources["double_cpus"] == 8
+    assert "missing" not in result.nodes[0].resources
+
+
+def test_chunked_node_operations(
+    bindings: MockClusterBinding, node_mgr: NodeManager
+) -> None:
+    result = node_mgr.allocate({"node.nodearray": "htc"}, node_count=5)
+    assert result
+    assert node_mgr.bootup()
+    nodes = result.nodes
+
+    node_mgr.node_operation_batch_size = 2
+    node_mgr.node_operation_concurrency = 2
+
+    shutdown_result = node_mgr.shutdown_nodes(nodes[:3])
+    assert shutdown_result
+    assert len(shutdown_result.operation_ids) == 2
+    assert shutdown_result.operation_id == shutdown_result.operation_ids[0]
+    assert set([n.name for n in shutdown_result.nodes]) == set(
+        [n.name for n in nodes[:3]]
+    )
+    assert not shutdown_result.reasons
+    for node in nodes[:3]:
+        assert node.state == "Terminating"
+        assert node not in node_mgr.get_nodes()
+
+    # one chunk fails, the other still goes through
+    shutdown_nodes = bindings.shutdown_nodes
+    failing_name = nodes[3].name
+
+    def failing_shutdown_nodes(nodes: List[Node]) -> NodeManagementResult:
+        if failing_name in [n.name for n in nodes]:
+            raise RuntimeError("simulated failure")
+        return shutdown_nodes(nodes)
+
+    bindings.shutdown_nodes = failing_shutdown_nodes  # type: ignore
+    node_mgr.node_operation_batch_size = 1
+    shutdown_result = node_mgr.shutdown_nodes(nodes[3:])
+    assert not shutdown_result
+    assert shutdown_result.status == "partial"
+    assert [n.name for n in shutdown_result.nodes] == [nodes[4].name]
+    assert len(shutdown_result.reasons) == 1
+    assert "chunk 1/2" in shutdown_result.reasons[0]
+    assert failing_name in shutdown_result.reasons[0]
+
+    # every chunk failed, so the error is raised
+    with pytest.raises(RuntimeError):
+        node_mgr.shutdown_nodes([nodes[3]])
+
+
+def test_targeted_refresh(bindings: MockClusterBinding, node_mgr: NodeManager) -> None:
+    status_calls = []
+    get_cluster_status = bindings.get_cluster_status
+
+    def counting_get_cluster_status(nodes: bool = False) -> Any:
+        status_calls.append(nodes)
+        return get_cluster_status(nodes)
+
+    bindings.get_cluster_status = counting_get_cluster_status  # type: ignore
+
+    result = node_mgr.allocate({"node.nodearray": "htc"}, node_count=2)
+    assert result
+    bootup_result = node_mgr.bootup()
+    assert bootup_result
+    assert len(bootup_result.nodes) == 2
+    # the operation's node list was enough
+    assert status_calls == []
+
+    refreshed = node_mgr.get_nodes_by_operation(
+        bootup_result.operation_id, full_refresh=True
+    )
+    assert len(refreshed) == 2
+    assert status_calls == [True]
+
+    # records without a Status fall back to the full cluster status
+    get_nodes = bindings.get_nodes
+
+    def get_nodes_without_status(
+        operation_id: Any = None, request_id: Any = None
+    ) -> Any:
+        ret = get_nodes(operation_id, request_id)
+        if operation_id:
+            for record in ret.nodes:
+                record.pop("Status")
+        return ret
+
+    bindings.get_nodes = get_nodes_without_status  # type: ignore
+    refreshed = node_mgr.get_nodes_by_operation(bootup_result.operation_id)
+    assert len(refreshed) == 2
+    assert status_calls == [True, True]
+    for node in refreshed:
+        assert node.state
+
+
+def test_bootup_merged_creation_result() -> None:
+    class PerBucketBindings(MockClusterBinding):
+        def create_nodes(self, nodes: List[Node]) -> NodeCreationResult:
+            operation_ids = []
+            sets = []
+            node_operations = {}
+            for _, bucket_nodes in partition(nodes, lambda n: n.bucket_id).items():
+                result = MockClusterBinding.create_nodes(self, bucket_nodes)
+                operation_ids.append(result.operation_id)
+                sets.extend(result.sets)
+                for offset, node in enumerate(bucket_nodes):
+                    node_operations[node.name] = (result.operation_id, offset)
+            return MergedNodeCreationResult(operation_ids, sets, node_operations)
+
+    node_mgr = _node_mgr(_bindings(PerBucketBindings))
+    assert node_mgr.allocate({"node.nodearray": "htc"}, node_count=2)
+    assert node_mgr.allocate({"node.nodearray": "hpc"}, node_count=1)
+
+    result = node_mgr.bootup()
+    assert result
+    assert len(result.nodes) == 3
+    assert len(result.operation_ids) == 2
+    for node in result.nodes:
+        assert node.delayed_node_id.operation_id in result.operation_ids
+        if node.nodearray == "hpc":
+            assert node.delayed_node_id.operation_offset == 0
+    assert set(
+        [
+            n.delayed_node_id.operation_offset
+            for n in result.nodes
+            if n.nodearray == "htc"
+        ]
+    ) == set([0, 1])
+
+
+def test_async_node_manager() -> None:
+    bindings: Any = _bindings(AsyncMockClusterBinding)
+    bindings.latency = 0.01
+    config = {
+        "_mock_bindings": bindings,
+        "node_operation_batch_size": 1,
+        "node_operation_concurrency": 2,
+    }
+
+    result_nodes: List[Node] = []
+
+    async def run() -> None:
+        node_mgr = await new_node_manager_async(config)
+        assert node_mgr.async_cluster_bindings is bindings
+
+        result = node_mgr.allocate({"node.nodearray": "htc"}, node_count=4)
+        assert result
+        result_nodes.extend(result.nodes)
+        bootup_result = await node_mgr.bootup_async()
+        assert bootup_result
+        assert len(bootup_result.nodes) == 4
+        for node in bootup_result.nodes:
+            assert node.delayed_node_id.operation_id == bootup_result.operation_id
+            assert node.delayed_node_id.operation_offset is not None
+
+        bindings.max_in_flight = 0
+        shutdown_result = await node_mgr.shutdown_nodes_async(result.nodes[:3])
+        assert shutdown_result
+        assert len(shutdown_result.operation_ids) == 3
+        assert bindings.max_in_flight == 2
+        for node in result.nodes[:3]:
+            assert node.state == "Terminating"
+            assert node not in node_mgr.get_nodes()
+
+        # every chunk failed, so the error is raised
+        with pytest.raises(NotImplementedError):
+            await node_mgr.deallocate_nodes_async(result.nodes[3:])
+
+    # asyncio.run needs python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    # the sync api shares the same mock
+    node_mgr = new_node_manager(config)
+    states = partition_single(node_mgr.get_nodes(), lambda n: n.name)
+    assert [states[n.name].state for n in result_nodes] == ["Terminating"] * 3 + ["Off"]
+
+
+def test_refresh(bindings: MockClusterBinding) -> None:
+    bindings.add_node("htc-1", "htc")
+    bindings.add_node("htc-2", "htc")
+    node_mgr = _node_mgr(bindings)
+    by_name = partition_single(node_mgr.get_nodes(), lambda n: n.name)
+
+    # the first poll only establishes the baseline
+    assert node_mgr.refresh()
+    assert partition_single(node_mgr.get_nodes(), lambda n: n.name) == by_name
+
+    bindings.update_state("Failed", ["htc-1"])
+    bindings.add_node("htc-3", "htc", hostname="htc-3-host")
+    bindings.nodes.pop("htc-2")
+    bindings.nodearrays["htc"].buckets[0].available_count = 1
+
+    assert node_mgr.refresh()
+    refreshed = partition_single(node_mgr.get_nodes(), lambda n: n.name)
+    assert sorted(refreshed.keys()) == ["htc-1", "htc-3"]
+    # state changes are applied in place
+    assert refreshed["htc-1"] is by_name["htc-1"]
+    assert refreshed["htc-1"].state == "Failed"
+    assert not by_name["htc-2"].exists
+    assert refreshed["htc-3"].hostname == "htc-3-host"
+    assert refreshed["htc-3"].resources["nodetype"] == "A"
+    assert "htc-3" in node_mgr._node_names
+
+    # limits are rebuilt from the new status
+    htc_bucket = [b for b in node_mgr.get_buckets() if b.nodearray == "htc"][0]
+    assert htc_bucket.available_count == 1
+    result = node_mgr.allocate(
+        {"node.nodearray": "htc"}, node_count=2, allow_existing=False
+    )
+    assert result
+    assert len(result.nodes) == 1
+
+    # a new nodearray requires a new NodeManager
+    bindings.add_nodearray("gpu", {})
+    bindings.add_bucket("gpu", "Standard_F8s", 10, 10)
+    assert not node_mgr.refresh()
+
+
+def test_refresh_discards_allocations(bindings: MockClusterBinding) -> None:
+    bindings.add_node("htc-1", "htc")
+    bindings.add_node("htc-2", "htc")
+    node_mgr = _node_mgr(bindings)
+    assert node_mgr.refresh()
+    htc_bucket = [b for b in node_mgr.get_buckets() if b.nodearray == "htc"][0]
+    available_count = htc_bucket.available_count
+
+    result = node_mgr.allocate({"ncpus": 1}, slot_count=1, assignment_id="a")
+    assert result
+    assert [n.name for n in result.nodes] == ["htc-1"]
+    result = node_mgr.allocate({"node.nodearray": "htc"}, node_count=4)
+    assert result
+    assert [n.name for n in result.nodes] == ["htc-1", "htc-2", "htc-3", "htc-4"]
+    assert htc_bucket.available_count == available_count - 2
+
+    # nothing changed in CycleCloud, but what was allocated is discarded
+    assert node_mgr.refresh()
+    by_name = partition_single(node_mgr.get_nodes(), lambda n: n.name)
+    assert sorted(by_name.keys()) == ["htc-1", "htc-2"]
+    assert not node_mgr.new_nodes
+    assert by_name["htc-1"].available == by_name["htc-1"].resources
+    assert not by_name["htc-1"].assignments
+    assert not by_name["htc-1"].required
+    assert htc_bucket.available_count == available_count
+    assert "htc-3" not in node_mgr._node_names
+
+    result = node_mgr.allocate({"node.nodearray": "htc"}, node_count=4)
+    assert result
+    assert [n.name for n in result.nodes] == ["htc-1", "htc-2", "htc-3", "htc-4"]
+    assert htc_bucket.available_count == available_count - 2
+
+
+def test_refresh_between_allocations(bindings: MockClusterBinding) -> None:
+    for i in range(1, 4):
+        bindings.add_node("htc-{}".format(i), "htc")
+    node_mgr = _node_mgr(bindings)
+    assert node_mgr.refresh()
+
+    result = node_mgr.allocate({"ncpus": 1}, slot_count=8)
+    assert result
+    assert [n.name for n in result.nodes] == ["htc-1", "htc-2"]
+
+    # a new hostname replaces htc-1, the bucket keeps the same number of nodes
+    bindings.nodes.pop("htc-1")
+    bindings.add_node("htc-1", "htc", hostname="htc-1-host")
+    assert node_mgr.refresh()
+
+    result = node_mgr.allocate({"ncpus": 1}, slot_count=12)
+    assert result
+    assert sorted([n.name for n in result.nodes]) == ["htc-1", "htc-2", "htc-3"]
+    assert not node_mgr.new_nodes
+
+
+def test_stream_nodes(bindings: MockClusterBinding) -> None:
+    for i in range(1, 4):
+        bindings.add_node("htc-{}".format(i), "htc")
+    bindings.add_node("hpc-1", "hpc")
+
+    calls: List[str] = []
+    get_nodes = bindings.get_nodes
+
+    def counting_get_nodes(*args: Any, **kwargs: Any) -> Any:
+        calls.append("get_nodes")
+        return get_nodes(*args, **kwargs)
+
+    bindings.get_nodes = counting_get_nodes  # type: ignore
+
+    expected = new_node_manager(
+        {"_mock_bindings": bindings, "_mimic_on_prem": ["htc-2"]}
+    )
+    calls.clear()
+    streamed = new_node_manager(
+        {"_mock_bindings": bindings, "_mimic_on_prem": ["htc-2"], "stream_nodes": True}
+    )
+    # the node records are only fetched once
+    assert calls == ["get_nodes"]
+
+    def summary(node_mgr: NodeManager) -> List[Any]:
+        return sorted(
+            [
+                (n.name, n.bucket_id, n.state, n.resources.get("nodetype"))
+                for n in node_mgr.get_nodes()
+            ]
+        )
+
+    assert summary(streamed) == summary(expected)
+    assert "htc-2" not in [n.name for n in streamed.get_nodes()]
+    assert len(streamed.get_nodes()) == 3
+
+    # default resources do not leak into the record's configuration
+    node = [n for n in streamed.get_nodes() if n.name == "htc-1"][0]
+    assert node.resources.get("ncpus")
+    assert "ncpus" not in node.software_configuration.get("autoscale", {}).get(
+        "resources", {}
+    )
+
+
+def test_savepoint() -> None:
+    bindings = MockClusterBinding()
+    bindings.add_nodearray("htc", {})
+    bindings.add_bucket("htc", "Standard_F4", 10, 10)
+    bindings.add_node("htc-1", "htc", "Standard_F4")
+    node_mgr = new_node_manager({"_mock_bindings": bindings})
+    bucket = node_mgr.get_buckets()[0]
+    existing = bucket.nodes[0]
+
+    def summary() -> List[Any]:
+        return [
+            [(n.name, n.available["ncpus"], sorted(n.assignments)) for n in b.nodes]
+            + [b.available_count, b.limits.regional_available_count]
+            for b in node_mgr.get_buckets()
+        ] + [sorted(node_mgr._node_names)]
+
+    before = summary()
+    outer = node_mgr.savepoint()
+    assert node_mgr.allocate({"ncpus": 2}, slot_count=4, assignment_id="a")
+    after_a = summary()
+
+    inner = node_mgr.savepoint()
+    assert node_mgr.allocate({"ncpus": 4}, node_count=2, assignment_id="b")
+    assert summary() != after_a
+    # the outer savepoint can not close first
+    with pytest.raises(RuntimeError):
+        outer.rollback()
+    inner.rollback()
+    assert summary() == after_a
+
+    outer.rollback()
+    assert summary() == before
+    assert not existing.assignments and not existing.required
+
+    # a released savepoint keeps its changes
+    with node_mgr.transaction():
+        assert node_mgr.allocate({"ncpus": 1}, node_count=1, assignment_id="c")
+    assert existing.assignments == set(["c"])
+    assert existing.available["ncpus"] == 3
+
+    with pytest.raises(ValueError):
+        with node_mgr.transaction():
+            node_mgr.allocate({"ncpus": 1}, slot_count=20, assignment_id="d")
+            raise ValueError()
+    assert existing.assignments == set(["c"])
+    assert len(bucket.nodes) == 1
+
+    # the capacity index sees the rolled back nodes fit again
+    assert node_mgr.allocate({"ncpus": 4}, node_count=2, assignment_id="e")
+
+
+def test_all_or_nothing_leaves_nothing_behind() -> None:
+    bindings = MockClusterBinding()
+    bindings.add_nodearray("htc", {})
+    bindings.add_bucket("htc", "Standard_F4", 10, 2)
+    bindings.add_nodearray("hpc", {})
+    bindings.add_bucket("hpc", "Standard_F4", 10, 2, placement_groups=["pg0", "pg1"])
+    bindings.add_node("htc-1", "htc", "Standard_F4")
+    node_mgr = new_node_manager({"_mock_bindings": bindings})
+    existing = node_mgr.get_nodes()[0]
+    available = [b.available_count for b in node_mgr.get_buckets()]
+
+    # htc-1 takes one of htc's 2 nodes, so each bucket has 2 nodes or 8 slots
+    result = node_mgr.allocate(
+        {"ncpus": 1, "exclusive": True}, node_count=3, all_or_nothing=True
+    )
+    assert not result
+    result = node_mgr.allocate({"ncpus": 1}, slot_count=9, all_or_nothing=True)
+    assert not result
+    assert existing.available["ncpus"] == 4
+    assert not existing.closed and not existing.assignments
+    assert [b.available_count for b in node_mgr.get_buckets()] == available
+    assert [n.name for n in node_mgr.get_nodes()] == ["htc-1"]
+
+    result = node_mgr.allocate({"ncpus": 1}, slot_count=8, all_or_nothing=True)
+    assert result and result.total_slots == 8
+    assert existing.available["ncpus"] == 0
+
+
+def test_savepoints_are_closed_when_allocate_raises(node_mgr: NodeManager) -> None:
+    available = [b.available_count for b in node_mgr.get_buckets()]
+
+    def failing_commit(*args: Any) -> None:
+        raise RuntimeError("simulated failure")
+
+    node_mgr._commit = failing_commit  # type: ignore
+    for all_or_nothing in [True, False]:
+        with pytest.raises(RuntimeError):
+            node_mgr.allocate({"ncpus": 1}, slot_count=4, all_or_nothing=all_or_nothing)
+        assert not undolog.recording()
+        assert [b.available_count for b in node_mgr.get_buckets()] == available
+        assert not node_mgr.get_nodes()
+        assert not node_mgr._node_names
+
+
+def test_without_cluster_bindings(node_mgr: NodeManager) -> None:
+    allocate_only = NodeManager(None, node_mgr.get_buckets())
+    assert allocate_only.allocate({"ncpus": 1}, slot_count=2)
+    with pytest.raises(RuntimeError):
+        allocate_only.bootup()
+
+
 if __name__ == "__main__":
     test_slot_count_hypothesis()
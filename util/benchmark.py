@@ -0,0 +1,497 @@
+"""
+Benchmarks for the allocation and demand pipeline, run against seeded synthetic
+clusters (see hpc.autoscale.ccbindings.synthetic), so no CycleCloud is needed.
+
+    # run everything and save the results
+    python util/benchmark.py run -o results.json
+
+    # run and fail if anything is more than 20% slower than the baseline
+    python util/benchmark.py run -o results.json -b baseline.json -t 0.2
+
+    # compare two saved results, with a looser threshold for one benchmark
+    python util/benchmark.py compare results.json baseline.json \\
+        -T demand_add_jobs_100k=0.5
+
+--quick shrinks every cluster and workload, i.e. as a smoke test.
+"""
+import argparse
+import datetime
+import fnmatch
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from hpc.autoscale import hpclogging as logging
+from hpc.autoscale import util
+from hpc.autoscale.ccbindings.mock import MockClusterBinding
+from hpc.autoscale.ccbindings.synthetic import generate_cluster
+from hpc.autoscale.job.demandcalculator import new_demand_calculator
+from hpc.autoscale.job.demandprinter import DemandPrinter, OutputFormat
+from hpc.autoscale.job.job import Job, PackingStrategy
+from hpc.autoscale.job.nodequeue import NodeQueue
+from hpc.autoscale.node.constraints import (
+    ExclusiveNode,
+    InAPlacementGroup,
+    get_constraints,
+)
+from hpc.autoscale.node.nodehistory import NullNodeHistory, SQLiteNodeHistory
+from hpc.autoscale.node.nodemanager import NodeManager, new_node_manager
+
+RESULTS_VERSION = 1
+SEED = 1234
+
+# a benchmark returns the function to time, after doing any setup
+Timed = Callable[[], Any]
+Benchmark = Callable[["Scale"], Timed]
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+class Scale:
+    def __init__(self, quick: bool) -> None:
+        self.quick = quick
+        # the number of existing nodes in the synthetic clusters
+        self.cluster_nodes = 2_000 if quick else 100_000
+        self.cluster_nodearrays = 20 if quick else 300
+        # the allocation and demand benchmarks use a smaller cluster with room to
+        # grow, so that they measure matching nodes rather than hitting quota
+        self.workload_nodes = 500 if quick else 5_000
+        self.workload_nodearrays = 10 if quick else 50
+
+    def jobs(self, full_count: int) -> int:
+        return max(10, full_count // 100) if self.quick else full_count
+
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    def register(function: Benchmark) -> Benchmark:
+        assert name not in BENCHMARKS, name
+        BENCHMARKS[name] = function
+        return function
+
+    return register
+
+
+_CLUSTERS: Dict[Tuple, MockClusterBinding] = {}
+
+
+def _cluster(nodes: int, nodearrays: int, quota_headroom: float) -> MockClusterBinding:
+    # generating 100k nodes takes a while, so share clusters between benchmarks.
+    # Nothing here modifies the bindings, only the NodeManagers built from them.
+    key = (nodes, nodearrays, quota_headroom)
+    if key not in _CLUSTERS:
+        _CLUSTERS[key] = generate_cluster(
+            seed=SEED,
+            nodes=nodes,
+            nodearrays=nodearrays,
+            quota_headroom=quota_headroom,
+        )
+    return _CLUSTERS[key]
+
+
+def _large_cluster(scale: Scale) -> MockClusterBinding:
+    return _cluster(scale.cluster_nodes, scale.cluster_nodearrays, 0.05)
+
+
+def _workload_cluster(scale: Scale) -> MockClusterBinding:
+    return _cluster(scale.workload_nodes, scale.workload_nodearrays, 4.0)
+
+
+def _node_manager(bindings: MockClusterBinding) -> NodeManager:
+    return new_node_manager({"_mock_bindings": bindings})
+
+
+@benchmark("new_node_manager")
+def bench_new_node_manager(scale: Scale) -> Timed:
+    bindings = _large_cluster(scale)
+    return lambda: _node_manager(bindings)
+
+
+@benchmark("add_default_resource")
+def bench_add_default_resource(scale: Scale) -> Timed:
+    bindings = _large_cluster(scale)
+    node_mgr = _node_manager(bindings)
+    half = sorted(bindings.nodearrays)[::2]
+
+    def timed() -> None:
+        node_mgr.add_default_resource({}, "bench_cores", "node.vcpu_count")
+        node_mgr.add_default_resource(
+            {"node.nodearray": half}, "bench_mem", "node.memory"
+        )
+
+    return timed
+
+
+def _allocate(scale: Scale, constraints: Any, **kwargs: Any) -> Timed:
+    node_mgr = _node_manager(_workload_cluster(scale))
+    return lambda: node_mgr.allocate(constraints, **kwargs)
+
+
+@benchmark("allocate_node_count")
+def bench_allocate_node_count(scale: Scale) -> Timed:
+    return _allocate(scale, {"ncpus": 1}, node_count=scale.jobs(1_000))
+
+
+@benchmark("allocate_slot_count")
+def bench_allocate_slot_count(scale: Scale) -> Timed:
+    return _allocate(scale, {"ncpus": 1}, slot_count=scale.jobs(10_000))
+
+
+@benchmark("allocate_exclusive")
+def bench_allocate_exclusive(scale: Scale) -> Timed:
+    return _allocate(
+        scale, {"ncpus": 1, "exclusive": True}, slot_count=scale.jobs(1_000)
+    )
+
+
+@benchmark("allocate_colocated")
+def bench_allocate_colocated(scale: Scale) -> Timed:
+    return _allocate(
+        scale,
+        [InAPlacementGroup(), ExclusiveNode()],
+        node_count=scale.jobs(1_000),
+        all_or_nothing=True,
+    )
+
+
+def _jobs(count: int, kind: str) -> List[Job]:
+    jobs = []
+    for n in range(count):
+        name = "{}-{}".format(kind, n)
+        ncpus = 1 + n % 4
+        if kind == "pack":
+            jobs.append(Job(name, {"ncpus": ncpus}, iterations=1 + n % 3))
+        elif kind == "scatter":
+            jobs.append(
+                Job(
+                    name,
+                    {"ncpus": ncpus},
+                    node_count=1 + n % 2,
+                    packing_strategy=PackingStrategy.SCATTER,
+                )
+            )
+        elif kind == "exclusive":
+            jobs.append(Job(name, {"ncpus": ncpus, "exclusive": True}))
+        elif kind == "best_fit":
+            jobs.append(
+                Job(
+                    name,
+                    {"ncpus": ncpus},
+                    iterations=1 + n % 3,
+                    packing_strategy=PackingStrategy.BEST_FIT,
+                )
+            )
+        else:
+            constraints = get_constraints([{"ncpus": ncpus}])
+            constraints.append(InAPlacementGroup())
+            constraints.append(ExclusiveNode())
+            jobs.append(Job(name, constraints, node_count=1 + n % 4, colocated=True))
+    return jobs
+
+
+def _add_jobs(scale: Scale, count: int, kinds: List[str]) -> Timed:
+    node_mgr = _node_manager(_workload_cluster(scale))
+    per_kind = scale.jobs(count) // len(kinds)
+    jobs = [job for kind in kinds for job in _jobs(per_kind, kind)]
+    dcalc = new_demand_calculator(
+        {}, node_mgr=node_mgr, node_history=NullNodeHistory(),
+    )
+    return lambda: dcalc.add_jobs(jobs)
+
+
+def _demand_benchmark(count: int, kinds: List[str]) -> Benchmark:
+    def bench_add_jobs(scale: Scale) -> Timed:
+        return _add_jobs(scale, count, kinds)
+
+    return bench_add_jobs
+
+
+for _count, _suffix in [(1_000, "1k"), (10_000, "10k"), (100_000, "100k")]:
+    benchmark("demand_add_jobs_{}".format(_suffix))(
+        _demand_benchmark(_count, ["pack", "scatter", "exclusive", "colocated"])
+    )
+
+for _kind in ["pack", "scatter", "exclusive", "colocated", "best_fit"]:
+    benchmark("demand_add_jobs_10k_{}".format(_kind))(
+        _demand_benchmark(10_000, [_kind])
+    )
+
+
+@benchmark("node_queue")
+def bench_node_queue(scale: Scale) -> Timed:
+    nodes = _node_manager(_large_cluster(scale)).get_nodes()
+
+    def timed() -> None:
+        queue = NodeQueue()
+        for node in nodes:
+            queue.push(node)
+        queue.update()
+        for _ in queue:
+            pass
+        for _ in queue.reversed():
+            pass
+
+    return timed
+
+
+class _NodeHistoryBenchmark:
+    def __init__(self, scale: Scale) -> None:
+        self.nodes = _node_manager(_large_cluster(scale)).get_nodes()
+        self.tempdir = tempfile.mkdtemp()
+        self.history = SQLiteNodeHistory(os.path.join(self.tempdir, "nodehistory.db"))
+
+    def close(self) -> None:
+        self.history.conn.close()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+
+@benchmark("node_history_update")
+def bench_node_history_update(scale: Scale) -> Timed:
+    bench = _NodeHistoryBenchmark(scale)
+
+    def timed() -> None:
+        try:
+            # the first update inserts every node, the second only updates
+            bench.history.update(bench.nodes)
+            bench.history.update(bench.nodes)
+        finally:
+            bench.close()
+
+    return timed
+
+
+@benchmark("node_history_decorate")
+def bench_node_history_decorate(scale: Scale) -> Timed:
+    bench = _NodeHistoryBenchmark(scale)
+    bench.history.update(bench.nodes)
+
+    def timed() -> None:
+        try:
+            bench.history.decorate(bench.nodes)
+        finally:
+            bench.close()
+
+    return timed
+
+
+def _print_demand(scale: Scale, output_format: OutputFormat) -> Timed:
+    dcalc = new_demand_calculator(
+        {},
+        node_mgr=_node_manager(_workload_cluster(scale)),
+        node_history=NullNodeHistory(),
+    )
+    dcalc.add_jobs(_jobs(scale.jobs(10_000), "pack"))
+    demand = dcalc.finish()
+    columns = ["name", "hostname", "job_ids", "nodearray", "vm_size", "ncpus", "state"]
+
+    def timed() -> None:
+        stream = io.StringIO()
+        DemandPrinter(list(columns), stream, output_format).print_demand(demand)
+
+    return timed
+
+
+@benchmark("print_demand_table")
+def bench_print_demand_table(scale: Scale) -> Timed:
+    return _print_demand(scale, "table")
+
+
+@benchmark("print_demand_json")
+def bench_print_demand_json(scale: Scale) -> Timed:
+    return _print_demand(scale, "json")
+
+
+def run(
+    names: List[str], scale: Scale, repeat: int, stream: Any = sys.stderr
+) -> Dict[str, Any]:
+    benchmarks: Dict[str, Dict[str, Any]] = {}
+
+    for name in names:
+        timings = []
+        for _ in range(repeat):
+            # every repetition gets fresh state, i.e. a new NodeManager
+            util.set_uuid_func(util.IncrementingUUID())
+            timed = BENCHMARKS[name](scale)
+            start = time.perf_counter()
+            timed()
+            timings.append(time.perf_counter() - start)
+
+        benchmarks[name] = {
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "mean": statistics.mean(timings),
+            "repeat": repeat,
+        }
+        stream.write("{:<32} {:>10.4f}s\n".format(name, benchmarks[name]["median"]))
+
+    return {
+        "version": RESULTS_VERSION,
+        "created": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": scale.quick,
+        "seed": SEED,
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    threshold: float,
+    thresholds: Optional[Dict[str, float]] = None,
+    stream: Any = sys.stdout,
+) -> List[str]:
+    """
+    Compares the median of every benchmark in both results and returns the names
+    of those that are more than threshold, or thresholds[name], slower.
+    """
+    thresholds = thresholds or {}
+
+    if results.get("quick") != baseline.get("quick"):
+        raise RuntimeError("Can not compare --quick results to full results.")
+
+    regressions = []
+    stream.write(
+        "{:<32} {:>10} {:>10} {:>8}\n".format(
+            "benchmark", "baseline", "current", "ratio"
+        )
+    )
+    for name, current in sorted(results["benchmarks"].items()):
+        if name not in baseline["benchmarks"]:
+            stream.write(
+                "{:<32} {:>10} {:>10.4f}\n".format(name, "-", current["median"])
+            )
+            continue
+
+        previous = baseline["benchmarks"][name]
+        ratio = current["median"] / max(previous["median"], 1e-9)
+        limit = thresholds.get(name, threshold)
+        regressed = ratio > 1 + limit
+        if regressed:
+            regressions.append(name)
+
+        stream.write(
+            "{:<32} {:>10.4f} {:>10.4f} {:>7.2f}x{}\n".format(
+                name,
+                previous["median"],
+                current["median"],
+                ratio,
+                "  REGRESSION (> {:.0%})".format(limit) if regressed else "",
+            )
+        )
+    return regressions
+
+
+def _parse_thresholds(exprs: List[str]) -> Dict[str, float]:
+    ret = {}
+    for expr in exprs:
+        name, _, value = expr.partition("=")
+        if not value:
+            raise argparse.ArgumentTypeError(
+                "Expected NAME=FRACTION, i.e. demand_add_jobs_1k=0.5, got " + expr
+            )
+        ret[name] = float(value)
+    return ret
+
+
+def _load(path: str) -> Dict[str, Any]:
+    with open(path) as fr:
+        ret = json.load(fr)
+    if ret.get("version") != RESULTS_VERSION:
+        raise RuntimeError(
+            "{} has results version {}, expected {}".format(
+                path, ret.get("version"), RESULTS_VERSION
+            )
+        )
+    return ret
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    def add_compare_args(subparser: argparse.ArgumentParser) -> None:
+        subparser.add_argument(
+            "-t",
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Allowed slowdown, as a fraction of the baseline. Default 0.2",
+        )
+        subparser.add_argument(
+            "-T",
+            "--benchmark-threshold",
+            action="append",
+            default=[],
+            metavar="NAME=FRACTION",
+            help="Allowed slowdown for a single benchmark.",
+        )
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("-o", "--output", help="Write the results to this file.")
+    run_parser.add_argument("-b", "--baseline", help="Compare to these results.")
+    run_parser.add_argument(
+        "-k",
+        "--select",
+        action="append",
+        default=[],
+        help="Only run benchmarks matching this glob. May be repeated.",
+    )
+    run_parser.add_argument("-r", "--repeat", type=int, default=3)
+    run_parser.add_argument("--quick", action="store_true", default=False)
+    run_parser.add_argument("--list", action="store_true", default=False)
+    add_compare_args(run_parser)
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("baseline")
+    add_compare_args(compare_parser)
+
+    args = parser.parse_args(argv)
+
+    # the demand calculator logs every job it can not match
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.command == "run":
+        names = [
+            name
+            for name in BENCHMARKS
+            if not args.select
+            or any(fnmatch.fnmatch(name, pattern) for pattern in args.select)
+        ]
+        if args.list:
+            print("\n".join(names))
+            return 0
+
+        results = run(names, Scale(args.quick), args.repeat)
+
+        if args.output:
+            with open(args.output, "w") as fw:
+                json.dump(results, fw, indent=2)
+
+        if not args.baseline:
+            return 0
+        baseline = _load(args.baseline)
+    else:
+        results = _load(args.results)
+        baseline = _load(args.baseline)
+
+    regressions = compare(
+        results, baseline, args.threshold, _parse_thresholds(args.benchmark_threshold),
+    )
+    if regressions:
+        print("Regressed: {}".format(", ".join(regressions)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())